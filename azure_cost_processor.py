@@ -1,23 +1,79 @@
 import logging
 from datetime import datetime, timedelta
-from azure.identity import ClientSecretCredential, DefaultAzureCredential
-from azure.mgmt.costmanagement import CostManagementClient
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.costmanagement.models import (
-    GenerateDetailedCostReportDefinition,
-    GenerateDetailedCostReportTimePeriod,
-    GenerateDetailedCostReportMetricType
-)
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+from xlsxwriter.utility import xl_col_to_name
 import config
 import time
-import requests
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
 import os
+import shutil
+import sqlite3
 import argparse
 import json
+import fnmatch
 import glob
+import hashlib
+import io
+import contextlib
+import functools
+import math
+import base64
+from urllib.parse import urlsplit
 import re
 
+# Taggnycklar (gemener) i Tags-kolumnen och motsvarande kolumner i bearbetad data
+TAG_KOLUMNER = [
+    ('billing', 'BillingTag'),
+    ('costcenter', 'CostCenterTag'),
+    ('billing-rg', 'BillingRGTag'),
+    ('billing-proj', 'BillingProjTag'),
+    ('billing-akt', 'BillingAktTag'),
+    ('billing-kat', 'BillingKatTag'),
+    ('billing-description', 'BillingDescriptionTag'),
+]
+TAG_NYCKLAR = [nyckel for nyckel, _ in TAG_KOLUMNER]
+TOMMA_TAGGAR = ('',) * len(TAG_KOLUMNER)
+# Fallback när Tags inte är giltig JSON: regex för "key": "value"
+TAG_REGEX = [re.compile(rf'"{nyckel}"\s*:\s*"([^"]+)"', re.IGNORECASE) for nyckel in TAG_NYCKLAR]
+
+# Kolumner som behövs för bearbetningen utöver de som ska till Data-fliken
+BEARBETNING_KOLUMNER = [
+    'BillingPeriodStartDate', 'BillingPeriodEndDate', 'Date', 'ResourceId', 'ResourceGroup', 'SubscriptionName',
+    'MeterCategory', 'MeterSubCategory', 'MeterName', 'CostInBillingCurrency',
+]
+# Schema för EA-rapportens kolumner vid inläsning. Repetitiva strängkolumner läses
+# som kategorier, datum tolkas som datetime och belopp som float64. Kolumner som inte
+# finns i schemat läses med pandas standardtyper.
+KATEGORI_KOLUMNER = [
+    'BillingAccountId', 'BillingAccountName', 'BillingProfileId', 'BillingProfileName',
+    'SubscriptionName', 'SubscriptionId', 'ResourceGroup', 'ResourceId', 'ResourceName', 'ResourceLocation',
+    'MeterId', 'MeterCategory', 'MeterSubCategory', 'MeterName', 'MeterRegion', 'UnitOfMeasure',
+    'ConsumedService', 'ProductName', 'ProductOrderName', 'ChargeType', 'Frequency', 'PublisherType',
+    'PricingModel', 'CostCenter', 'BillingCurrency', 'Tags',
+]
+DATUM_KOLUMNER = ['BillingPeriodStartDate', 'BillingPeriodEndDate', 'Date']
+FLYTTAL_KOLUMNER = ['Quantity', 'EffectivePrice', 'UnitPrice', 'CostInBillingCurrency']
+KOSTNAD_SCHEMA = {
+    **{kolumn: 'category' for kolumn in KATEGORI_KOLUMNER + DATUM_KOLUMNER},
+    **{kolumn: 'float64' for kolumn in FLYTTAL_KOLUMNER},
+}
+# Kolumner som identifierar en kostnadsrad när överlappande rapporter slås ihop. Belopp och
+# kvantitet ingår inte, så att en senare rapport med omräknade värden ersätter raden.
+RADNYCKEL_KOLUMNER = [
+    'Date', 'BillingAccountId', 'SubscriptionId', 'ResourceId', 'MeterId', 'MeterCategory', 'MeterSubCategory',
+    'MeterName', 'ChargeType', 'PricingModel', 'UnitOfMeasure', 'AdditionalInfo',
+]
+# Tidsstämpeln i namnet på nedladdade rapporter (azure_cost_report_YYYYMMDD_HHMMSS*.csv.gz)
+RAPPORT_TIDSSTAMPEL = re.compile(r'(\d{8}_\d{6})')
+# Max antal rader (inklusive rubrikrad) i ett Excel-blad
+EXCEL_MAX_RADER = 1048576
+
 # Konfigurera loggning
 def setup_logging(verbose=False):
     # Stäng av HTTP-loggning från Azure SDK om inte verbose-läge är aktiverat
@@ -35,26 +91,2157 @@ def setup_logging(verbose=False):
     )
     return logging.getLogger(__name__)
 
+def aktuellt_minne():
+    """
+    Processens aktuella arbetsminne (RSS) i byte, eller None om det inte kan läsas.
+    Använder psutil om det finns, annars /proc/self/statm (Linux).
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class MinnesMatare:
+    """
+    Samplar processens RSS i en bakgrundstråd och håller reda på toppvärdet. Till
+    skillnad från tracemalloc påverkar samplingen inte tiden märkbart och den ser
+    även allokeringar utanför Python, t.ex. i pyarrow.
+    """
+
+    def __init__(self, intervall=0.005):
+        self.intervall = intervall
+        self.start = None
+        self.topp = None
+        self._stopp = threading.Event()
+        self._trad = None
+
+    def _sampla(self):
+        while not self._stopp.wait(self.intervall):
+            rss = aktuellt_minne()
+            if rss is not None and rss > self.topp:
+                self.topp = rss
+
+    def __enter__(self):
+        self.start = self.topp = aktuellt_minne()
+        if self.start is not None:
+            self._trad = threading.Thread(target=self._sampla, daemon=True)
+            self._trad.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._trad:
+            self._stopp.set()
+            self._trad.join()
+            rss = aktuellt_minne()
+            if rss is not None and rss > self.topp:
+                self.topp = rss
+        return False
+
+    @property
+    def okning(self):
+        """
+        Toppminnets ökning i byte jämfört med starten, eller None om RSS inte kan läsas.
+        """
+        return None if self.start is None else self.topp - self.start
+
+class Korningsmatning:
+    """
+    Mätning av en körning uppdelad i steg. Varje steg mäts med väggklocktid,
+    processens CPU-tid, ökning av toppminnet (RSS) och antal rader per sekund. Steg
+    med samma namn, t.ex. ett per chunk, summeras. Valfritt profileras hela körningen
+    med cProfile eller tracemalloc. Rapporten sparas som JSON, så att körningar för
+    olika månader kan jämföras.
+    """
+
+    PROFILERINGAR = ("cprofile", "tracemalloc")
+    # Antal funktioner respektive allokeringsplatser som tas med från profileringen
+    PROFIL_TOPP = 25
+
+    def __init__(self, logger, namn, profilering=None, parametrar=None):
+        if profilering and profilering not in self.PROFILERINGAR:
+            raise ValueError(f"Okänd profilering '{profilering}', välj en av {', '.join(self.PROFILERINGAR)}")
+        self.logger = logger
+        self.namn = namn
+        self.profilering = profilering
+        self.parametrar = dict(parametrar or {})
+        self.steg_resultat = {}
+        self.excel_fil = None
+        self.fel = None
+        self.profil = None
+        self._profiler = None
+        self._lock = threading.Lock()
+
+    def starta(self):
+        self.tidpunkt = datetime.now()
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._minne = MinnesMatare(intervall=0.05).__enter__()
+        if self.profilering == "cprofile":
+            import cProfile
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError as e:
+                # Bara en profilerare kan vara aktiv åt gången, t.ex. vid parallella körningar
+                self.logger.warning(f"cProfile kunde inte startas: {e}")
+                self._profiler = None
+        elif self.profilering == "tracemalloc":
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                self.logger.warning("tracemalloc är redan aktivt, körningen profileras inte")
+            else:
+                tracemalloc.start()
+                self._profiler = tracemalloc
+        return self
+
+    @contextlib.contextmanager
+    def steg(self, namn, rader=None):
+        """
+        Mäter ett steg. Antalet rader kan anges i förväg eller sättas i det
+        returnerade spannet, span["rader"], när det är känt.
+        """
+        span = {"rader": rader}
+        minne = MinnesMatare()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            with minne:
+                yield span
+        finally:
+            self._registrera(namn, time.perf_counter() - start, time.process_time() - cpu_start,
+                             minne.okning, span["rader"])
+
+    def _registrera(self, namn, sekunder, cpu_sekunder, minnesokning, rader):
+        with self._lock:
+            steg = self.steg_resultat.setdefault(namn, {
+                "anrop": 0, "sekunder": 0.0, "cpu_sekunder": 0.0, "minnesokning_mb": None, "rader": None,
+            })
+            steg["anrop"] += 1
+            steg["sekunder"] += sekunder
+            steg["cpu_sekunder"] += cpu_sekunder
+            if minnesokning is not None:
+                steg["minnesokning_mb"] = max(steg["minnesokning_mb"] or 0.0, minnesokning / 1e6)
+            if rader is not None:
+                steg["rader"] = (steg["rader"] or 0) + int(rader)
+
+    def avsluta(self):
+        self.sekunder = time.perf_counter() - self._start
+        self.cpu_sekunder = time.process_time() - self._cpu_start
+        self._minne.__exit__(None, None, None)
+        if self.profilering == "cprofile" and self._profiler is not None:
+            import pstats
+            self._profiler.disable()
+            stats = pstats.Stats(self._profiler)
+            topp = sorted(stats.stats.items(), key=lambda post: post[1][3], reverse=True)[:self.PROFIL_TOPP]
+            self.profil = [{
+                "funktion": f"{os.path.basename(fil)}:{rad}({funktion})",
+                "anrop": antal, "egen_tid": round(egen, 4), "kumulativ_tid": round(kumulativ, 4),
+            } for (fil, rad, funktion), (_, antal, egen, kumulativ, _) in topp]
+        elif self.profilering == "tracemalloc" and self._profiler is not None:
+            ogonblicksbild = self._profiler.take_snapshot()
+            _, topp = self._profiler.get_traced_memory()
+            self._profiler.stop()
+            self.profil = {
+                "toppminne_mb": round(topp / 1e6, 1),
+                "allokeringar": [{
+                    "plats": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                    "storlek_mb": round(stat.size / 1e6, 2), "antal": stat.count,
+                } for stat in ogonblicksbild.statistics("lineno")[:self.PROFIL_TOPP]],
+            }
+        return self
+
+    def rapport(self):
+        steg = {}
+        for namn, varden in self.steg_resultat.items():
+            steg[namn] = {
+                "anrop": varden["anrop"],
+                "sekunder": round(varden["sekunder"], 4),
+                "cpu_sekunder": round(varden["cpu_sekunder"], 4),
+                "minnesokning_mb": None if varden["minnesokning_mb"] is None else round(varden["minnesokning_mb"], 1),
+                "rader": varden["rader"],
+                "rader_per_sekund": (round(varden["rader"] / varden["sekunder"])
+                                     if varden["rader"] and varden["sekunder"] else None),
+            }
+        return {
+            "korning": self.namn,
+            "tidpunkt": self.tidpunkt.isoformat(timespec="seconds"),
+            "parametrar": self.parametrar,
+            "excel_fil": self.excel_fil,
+            "fel": self.fel,
+            "sekunder": round(self.sekunder, 4),
+            "cpu_sekunder": round(self.cpu_sekunder, 4),
+            "toppminne_mb": None if self._minne.topp is None else round(self._minne.topp / 1e6, 1),
+            "steg": steg,
+            "profilering": self.profilering,
+            "profil": self.profil,
+        }
+
+    def logga(self):
+        for namn, varden in self.rapport()["steg"].items():
+            text = f"Steg {namn}: {varden['sekunder']:.2f} s (CPU {varden['cpu_sekunder']:.2f} s)"
+            if varden["minnesokning_mb"] is not None:
+                text += f", minne +{varden['minnesokning_mb']:.0f} MB"
+            if varden["rader_per_sekund"]:
+                text += f", {varden['rader']} rader ({varden['rader_per_sekund']} rader/s)"
+            self.logger.info(text)
+        self.logger.info(f"Körningen tog {self.sekunder:.2f} s (CPU {self.cpu_sekunder:.2f} s)")
+
+    def spara(self, path):
+        """
+        Sparar rapporten som JSON, och vid cProfile även profildatan (.prof) bredvid.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.rapport(), f, ensure_ascii=False, indent=2, default=str)
+        if self.profilering == "cprofile" and self._profiler is not None:
+            self._profiler.dump_stats(f"{os.path.splitext(path)[0]}.prof")
+        return path
+
+# Körningen som mäts i den aktuella tråden (parallella körningar i batchläge mäts var för sig)
+_AKTIV_MATNING = threading.local()
+
+def aktiv_matning():
+    return getattr(_AKTIV_MATNING, "matning", None)
+
+def matningssteg(namn, rader=None):
+    """
+    Mäter ett steg i den pågående körningen, eller gör ingenting om ingen körning mäts.
+    """
+    matning = aktiv_matning()
+    return matning.steg(namn, rader) if matning else contextlib.nullcontext({"rader": rader})
+
+def med_korningsmatning(metod):
+    """
+    Mäter metoden som en körning (se AzureCostProcessor.korning). Anrop inifrån en
+    redan mätt körning räknas till den yttre körningen.
+    """
+    @functools.wraps(metod)
+    def wrapper(self, *args, **kwargs):
+        with self.korning(metod.__name__, **kwargs):
+            return metod(self, *args, **kwargs)
+    return wrapper
+
+class KonteringsregelIndex:
+    """
+    Förkompilerat index över resource_ids-mönstren i kontering_resource_config.json.
+
+    Mönster av typen */subscriptions/<id>/* och */resourceGroups/<namn>/* läggs i
+    uppslagstabeller per segment, mönster utan wildcards slås upp direkt och övriga
+    mönster slås ihop till ett enda kompilerat reguljärt uttryck. Matchningen ger
+    samma resultat som fnmatch mot gemener, och första matchande regel vinner.
+    Varje unikt ResourceId utvärderas endast en gång.
+    """
+
+    SEGMENT_PATTERN = re.compile(r'^\*/(subscriptions|resourcegroups)/([^/*?\[\]]+)/\*$')
+
+    def __init__(self, regler):
+        self.regler = list(regler)
+        self.segment_lookup = {'subscriptions': {}, 'resourcegroups': {}}
+        self.exakta = {}
+        wildcard_patterns = []
+        for regel_idx, regel in enumerate(self.regler):
+            for pattern in regel.get("resource_ids", []):
+                pattern = str(pattern).lower()
+                segment_match = self.SEGMENT_PATTERN.match(pattern)
+                if segment_match:
+                    bucket = self.segment_lookup[segment_match.group(1)]
+                    bucket.setdefault(segment_match.group(2), regel_idx)
+                elif not any(c in pattern for c in '*?['):
+                    self.exakta.setdefault(pattern, regel_idx)
+                else:
+                    wildcard_patterns.append((regel_idx, pattern))
+        # Alternativen ordnas efter regelordning så att första träffen är den lägsta regeln
+        self.wildcard_regex = None
+        if wildcard_patterns:
+            alternativ = [f"(?P<r{regel_idx}_{i}>{fnmatch.translate(pattern)})"
+                          for i, (regel_idx, pattern) in enumerate(wildcard_patterns)]
+            self.wildcard_regex = re.compile("|".join(alternativ))
+        self._cache = {}
+
+    def _segment_traffar(self, resource_id):
+        # Motsvarar */<segment>/<namn>/*: segmentet måste föregås och följas av '/'
+        delar = resource_id.split('/')
+        traffar = []
+        for i in range(1, len(delar) - 2):
+            bucket = self.segment_lookup.get(delar[i])
+            if bucket:
+                regel_idx = bucket.get(delar[i + 1])
+                if regel_idx is not None:
+                    traffar.append(regel_idx)
+        return traffar
+
+    def hitta_index(self, resource_id):
+        """
+        Returnerar index för första matchande regel, eller -1 om ingen regel matchar.
+        """
+        key = str(resource_id).lower()
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        kandidater = self._segment_traffar(key)
+        if key in self.exakta:
+            kandidater.append(self.exakta[key])
+        if self.wildcard_regex is not None:
+            match = self.wildcard_regex.match(key)
+            if match:
+                kandidater.append(int(match.lastgroup[1:].split('_')[0]))
+        regel_idx = min(kandidater) if kandidater else -1
+        self._cache[key] = regel_idx
+        return regel_idx
+
+    def hitta(self, resource_id):
+        """
+        Returnerar första matchande regel för ett ResourceId, eller None.
+        """
+        regel_idx = self.hitta_index(resource_id)
+        return self.regler[regel_idx] if regel_idx >= 0 else None
+
+    def fyll_cache(self, tilldelning):
+        """
+        Lägger in kända regelindex per ResourceId (gemener), t.ex. från Regeltilldelning.
+        """
+        self._cache.update(tilldelning)
+
+    def tilldelning(self):
+        """
+        Regelindex per hittills utvärderat ResourceId (gemener).
+        """
+        return dict(self._cache)
+
+    def hitta_index_kolumn(self, resource_ids, parallell=None):
+        """
+        Returnerar regelindex (-1 = ingen träff) för varje rad i en Series med ResourceId.
+        Med en ParallellBearbetning matchas många nya ResourceId i arbetsprocesserna.
+        """
+        codes, uniques = pd.factorize(resource_ids)
+        if parallell is not None:
+            nya = [key for key in dict.fromkeys(str(rid).lower() for rid in uniques) if key not in self._cache]
+            if parallell.lonar_sig(nya):
+                self._cache.update(zip(nya, parallell.regelindex(self.regler, nya)))
+        # Saknade värden (kod -1) utvärderas som str(nan), precis som i radvis matchning
+        regel_idx = [self.hitta_index(resource_id) for resource_id in uniques]
+        regel_idx.append(self.hitta_index(float('nan')))
+        return np.array(regel_idx, dtype=np.int64)[codes]
+
+class Regeltilldelning:
+    """
+    Sparad tilldelning av resursregel per ResourceId mellan körningar.
+
+    Varje regel identifieras av en hash av sina resource_ids-mönster, så att ändrade
+    konteringsvärden i en regel inte påverkar tilldelningen. När regelfilen ändrats
+    återanvänds en sparad tilldelning endast om utfallet inte kan ha ändrats. Ett
+    ResourceId som första gången matchade regel a matchade inte någon tidigare regel,
+    så regler med oförändrade mönster före a är kända icke-träffar. Hamnar en ny eller
+    ändrad regel, eller en regel som låg efter a, före a i den nya ordningen prövas
+    ResourceId:t om mot reglerna. Tilldelningen ger därmed samma resultat som
+    KonteringsregelIndex.hitta_index.
+    """
+
+    _LAS = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.regler = []
+        self.tilldelning = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.regler = data.get("regler", [])
+            self.tilldelning = data.get("tilldelning", {})
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def regelhash(regel):
+        monster = [str(pattern).lower() for pattern in regel.get("resource_ids", [])]
+        return hashlib.sha256(json.dumps(monster).encode("utf-8")).hexdigest()[:16]
+
+    def _ny_tilldelning(self, a, nya, gammal_pos, ny_pos):
+        # Ny regelposition för ett ResourceId som tidigare fick regel a (-1 = ingen),
+        # eller None om någon regel med okänt utfall kommer före
+        if a >= len(self.regler):
+            return None
+        slut = ny_pos.get(self.regler[a], len(nya)) if a >= 0 else len(nya)
+        for regel_hash in nya[:slut]:
+            tidigare = gammal_pos.get(regel_hash)
+            if tidigare is None or (a >= 0 and tidigare > a):
+                return None
+        return slut if slut < len(nya) else -1
+
+    def tillampa(self, regel_index):
+        """
+        Fyller regelindexets cache med de sparade tilldelningar som fortfarande gäller.
+        Returns:
+            tuple: (antal återanvända, antal som prövas om)
+        """
+        nya = [self.regelhash(regel) for regel in regel_index.regler]
+        gammal_pos, ny_pos = {}, {}
+        for idx, regel_hash in enumerate(self.regler):
+            gammal_pos.setdefault(regel_hash, idx)
+        for idx, regel_hash in enumerate(nya):
+            ny_pos.setdefault(regel_hash, idx)
+        # Utfallet beror bara på den tidigare regeln, så det räcker att avgöra det en gång per regel
+        per_regel = {a: self._ny_tilldelning(a, nya, gammal_pos, ny_pos) for a in set(self.tilldelning.values())}
+        giltiga = {key: per_regel[a] for key, a in self.tilldelning.items() if per_regel[a] is not None}
+        regel_index.fyll_cache(giltiga)
+        return len(giltiga), len(self.tilldelning) - len(giltiga)
+
+    def spara(self, regel_index):
+        """
+        Sparar tilldelningen för alla ResourceId som regelindexet har utvärderat eller fått från cachen.
+        """
+        self.regler = [self.regelhash(regel) for regel in regel_index.regler]
+        self.tilldelning = regel_index.tilldelning()
+        with self._LAS:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"regler": self.regler, "tilldelning": self.tilldelning}, f)
+            os.replace(f"{self.path}.tmp", self.path)
+
+# Kompilerade resursregler i en arbetsprocess, nycklade på reglernas hash
+_ARBETSPROCESS_REGLER = {}
+
+def _tolka_taggar_del(tags_lista):
+    return [AzureCostProcessor._parse_tags(tags) for tags in tags_lista]
+
+def _regelindex_del(regler_hash, regler, resource_ids):
+    regel_index = _ARBETSPROCESS_REGLER.get(regler_hash)
+    if regel_index is None:
+        # Nya regler (t.ex. ändrad regelfil): kompilera om en gång i denna process
+        _ARBETSPROCESS_REGLER.clear()
+        regel_index = _ARBETSPROCESS_REGLER[regler_hash] = KonteringsregelIndex(regler)
+    return [regel_index.hitta_index(resource_id) for resource_id in resource_ids]
+
+class ParallellBearbetning:
+    """
+    Processpool för taggtolkning och regelmatchning på flera kärnor.
+
+    Arbetet fördelas per unikt värde (Tags-sträng eller ResourceId), samma enhet som
+    de seriella stegen redan arbetar med. Delarna tolkas i arbetsprocesserna och
+    resultaten fogas ihop i ursprunglig ordning, medan uppslag per rad, gruppering
+    och summering av Netto görs i huvudprocessen som tidigare. Resultat och varningar
+    blir därför identiska med seriell körning. Resursreglerna kompileras en gång per
+    arbetsprocess och regeluppsättning. Processerna startas först när en mängd nya
+    värden är stor nog att löna sig (min_unika).
+    """
+
+    DELAR_PER_PROCESS = 4
+
+    def __init__(self, processer, min_unika=20000):
+        self.processer = processer
+        self.min_unika = min_unika
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn: huvudprocessen har trådar (nedladdning, minnesmätning) som inte tål fork
+                self._pool = ProcessPoolExecutor(max_workers=self.processer,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def lonar_sig(self, varden):
+        return len(varden) >= self.min_unika
+
+    def _fordela(self, funktion, varden, *args):
+        """
+        Delar upp varden i sammanhängande delar, kör funktion på delarna i
+        arbetsprocesserna och returnerar resultaten i samma ordning som varden.
+        """
+        varden = list(varden)
+        storlek = max(1, -(-len(varden) // (self.processer * self.DELAR_PER_PROCESS)))
+        delar = [varden[i:i + storlek] for i in range(0, len(varden), storlek)]
+        resultat = []
+        for del_resultat in self._executor().map(functools.partial(funktion, *args), delar):
+            resultat.extend(del_resultat)
+        return resultat
+
+    def tolka_taggar(self, tags_lista):
+        """
+        Tolkar Tags-strängar som AzureCostProcessor._parse_tags.
+        """
+        return self._fordela(_tolka_taggar_del, tags_lista)
+
+    def regelindex(self, regler, resource_ids):
+        """
+        Regelindex (-1 = ingen träff) per ResourceId som KonteringsregelIndex.hitta_index.
+        """
+        regler_hash = hashlib.sha256(json.dumps(regler, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        return self._fordela(_regelindex_del, resource_ids, regler_hash, regler)
+
+    def stang(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+class TaggOverrideIndex:
+    """
+    Förkompilerade tagg-overrides från tag_overrides.json. Varje override sätter en
+    taggkolumn till ett värde för resurser som matchar resource_id-mönstret (fnmatch
+    mot gemener) på rader vars datum ligger inom valid_from–valid_to (båda inklusive,
+    null = obegränsat). Giltighetsintervallen lagras i ett IntervalIndex. Mönstren
+    utvärderas en gång per unikt ResourceId och intervallen en gång per unikt datum,
+    och overrides appliceras sedan med vektoriserade masker. Vid överlapp vinner den
+    override som står sist i filen.
+    """
+
+    def __init__(self, overrides):
+        kolumn_for = {kolumn.lower(): kolumn for _, kolumn in TAG_KOLUMNER}
+        kolumn_for.update(dict(TAG_KOLUMNER))
+        self.warnings = []
+        self.overrides = []
+        self.kolumner = []
+        for override in overrides:
+            kolumn = kolumn_for.get(str(override.get("tag", "")).strip().lower())
+            if not kolumn or not override.get("resource_id"):
+                self.warnings.append(f"Ogiltig tagg-override ignoreras: {override}")
+                continue
+            self.overrides.append(override)
+            self.kolumner.append(kolumn)
+        self.varden = [str(o.get("value") or "") for o in self.overrides]
+        self.monster = [re.compile(fnmatch.translate(str(o["resource_id"]).lower())) for o in self.overrides]
+        self.intervall = pd.IntervalIndex.from_arrays(
+            pd.DatetimeIndex([pd.Timestamp(o.get("valid_from") or pd.Timestamp.min) for o in self.overrides]),
+            pd.DatetimeIndex([pd.Timestamp(o.get("valid_to") or pd.Timestamp.max) for o in self.overrides]),
+            closed="both",
+        )
+        self._cache = {}
+
+    def traffar(self, resource_id):
+        """
+        Returnerar en bool-array med en post per override: matchar resource_id mönstret.
+        """
+        key = str(resource_id).lower()
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        traffar = np.array([m.match(key) is not None for m in self.monster], dtype=bool)
+        self._cache[key] = traffar
+        return traffar
+
+    def traffar_kolumn(self, resource_ids):
+        """
+        Träffmatris (rader × overrides) för en Series med ResourceId.
+        """
+        codes, uniques = pd.factorize(resource_ids)
+        # Saknade värden (kod -1) utvärderas som str(nan), precis som i regelmatchningen
+        matris = [self.traffar(resource_id) for resource_id in uniques]
+        matris.append(self.traffar(float('nan')))
+        return np.vstack(matris)[codes]
+
+    def giltiga_kolumn(self, datum):
+        """
+        Giltighetsmatris (rader × overrides) för en Series med datum.
+        Rader utan tolkningsbart datum får ingen override.
+        """
+        codes, uniques = pd.factorize(pd.to_datetime(datum, errors="coerce").dt.normalize())
+        matris = [self.intervall.contains(dag) for dag in uniques]
+        matris.append(np.zeros(len(self.overrides), dtype=bool))
+        return np.vstack(matris)[codes]
+
+    def tillampa(self, df):
+        """
+        Applicerar overrides på taggkolumnerna i df.
+        Returns:
+            tuple: (df, antal ändrade värden)
+        """
+        if not self.overrides or df.empty or "Date" not in df.columns:
+            return df, 0
+        resource_ids = df["ResourceId"] if "ResourceId" in df.columns else pd.Series("", index=df.index)
+        mask = self.traffar_kolumn(resource_ids) & self.giltiga_kolumn(df["Date"])
+        antal = 0
+        for kolumn in dict.fromkeys(self.kolumner):
+            varden = None
+            for idx in (i for i, k in enumerate(self.kolumner) if k == kolumn):
+                rader = mask[:, idx]
+                if not rader.any():
+                    continue
+                if varden is None:
+                    varden = (df[kolumn].to_numpy(dtype=object, copy=True) if kolumn in df.columns
+                              else np.full(len(df), "", dtype=object))
+                varden[rader] = self.varden[idx]
+                antal += int(rader.sum())
+            if varden is not None:
+                df[kolumn] = pd.Categorical(varden)
+        return df, antal
+
+def _exakta_delsummor(varden):
+    """
+    Summan av varden (en lista) som en kort lista flyttal vars exakta summa är lika med den
+    exakta summan av varden. Delsummor från flera omgångar kan slås ihop och summeras
+    med math.fsum, och resultatet blir då detsamma oavsett i vilken ordning och i hur
+    många omgångar (chunkar, dagar) värdena lagts till.
+    """
+    delar = []
+    while True:
+        # math.fsum avrundar den exakta resten korrekt, så resten krymper för varje varv
+        rest = math.fsum(varden + [-d for d in delar] if delar else varden)
+        if rest == 0:
+            return delar
+        if not math.isfinite(rest):
+            return [rest]
+        delar.append(rest)
+
+def _exakta_delsummor_per_grupp(grupp, varden, antal):
+    """
+    _exakta_delsummor för varje grupp 0..antal-1, där grupp och varden har en post per rad.
+    """
+    # Ordningen inom en grupp spelar ingen roll för math.fsum
+    ordning = np.argsort(grupp)
+    granser = np.searchsorted(grupp[ordning], np.arange(antal + 1)).tolist()
+    sorterade = varden[ordning].tolist()
+    return [_exakta_delsummor(sorterade[start:slut]) for start, slut in zip(granser[:-1], granser[1:])]
+
+class Kostnadssammanfattning:
+    """
+    Totalsumma, antal rader och subtotaler per dimension (t.ex. ResourceGroup,
+    MeterCategory och SubscriptionName) för kostnadsdata. Data kan läggas till i en
+    eller flera omgångar, t.ex. chunkvis vid strömmande inläsning.
+
+    Varje omgång grupperas en gång på alla dimensioners kategorikoder tillsammans,
+    och subtotalerna per dimension summeras sedan ur den lilla grupptabellen i
+    stället för att hela datat grupperas en gång per dimension. Rader utan värde i
+    en dimension räknas med i totalsumman men inte i dimensionens subtotaler.
+    Summorna hålls som exakta delsummor, så att de blir identiska oavsett hur datat
+    delas upp i omgångar.
+    """
+
+    def __init__(self, dimensioner, kostnadskolumn='CostInBillingCurrency'):
+        self.dimensioner = list(dimensioner)
+        self.kostnadskolumn = kostnadskolumn
+        self._total = []
+        self.antal_rader = 0
+        self.kolumner = set()
+        # dimension -> {värde: [exakta delsummor, antal rader]}
+        self._subtotaler = {dimension: {} for dimension in self.dimensioner}
+
+    @property
+    def total(self):
+        return math.fsum(self._total)
+
+    @staticmethod
+    def _koder(kolumn):
+        if isinstance(kolumn.dtype, pd.CategoricalDtype):
+            return kolumn.cat.codes.to_numpy(dtype=np.int64), kolumn.cat.categories
+        koder, varden = pd.factorize(kolumn)
+        return koder.astype(np.int64, copy=False), varden
+
+    def lagg_till(self, df):
+        """
+        Lägger till kostnadsrader i sammanfattningen.
+        """
+        self.kolumner.update(df.columns)
+        if df.empty:
+            return
+        self.antal_rader += len(df)
+        if self.kostnadskolumn not in df.columns:
+            return
+        kostnad = df[self.kostnadskolumn].to_numpy(dtype=np.float64, na_value=0.0)
+
+        dimensioner = [dimension for dimension in self.dimensioner if dimension in df.columns]
+        if not dimensioner:
+            self._total = _exakta_delsummor(self._total + kostnad.tolist())
+            return
+        koder = [self._koder(df[dimension]) for dimension in dimensioner]
+        # Gemensam gruppnyckel för alla dimensioner (komprimeras om den riskerar att flöda över)
+        nyckel = np.zeros(len(df), dtype=np.int64)
+        grans = 1
+        for kod, varden in koder:
+            bas = len(varden) + 1
+            if grans * bas >= 2 ** 62:
+                nyckel = pd.factorize(nyckel)[0]
+                grans = int(nyckel.max()) + 1
+            nyckel = nyckel * bas + (kod + 1)
+            grans *= bas
+        nyckel, unika = pd.factorize(nyckel)
+        # Första raden i varje grupp (omvänd tilldelning: den första förekomsten skrivs sist)
+        forsta_rad = np.empty(len(unika), dtype=np.int64)
+        forsta_rad[nyckel[::-1]] = np.arange(len(nyckel) - 1, -1, -1)
+        delar = _exakta_delsummor_per_grupp(nyckel, kostnad, len(unika))
+        antal = np.bincount(nyckel).tolist()
+        self._total = _exakta_delsummor(self._total + [d for grupp_delar in delar for d in grupp_delar])
+
+        for dimension, (kod, varden) in zip(dimensioner, koder):
+            per_varde = {}
+            for grupp, idx in enumerate(kod[forsta_rad].tolist()):
+                if idx >= 0:
+                    post = per_varde.setdefault(idx, [[], 0])
+                    post[0].extend(delar[grupp])
+                    post[1] += antal[grupp]
+            subtotaler = self._subtotaler[dimension]
+            for idx in sorted(per_varde):
+                post = subtotaler.setdefault(varden[idx], [[], 0])
+                post[0] = _exakta_delsummor(post[0] + per_varde[idx][0])
+                post[1] += per_varde[idx][1]
+
+    def saknade_kolumner(self):
+        """
+        Kostnadskolumnen och dimensioner som inte fanns i datat.
+        """
+        return [kolumn for kolumn in [self.kostnadskolumn] + self.dimensioner if kolumn not in self.kolumner]
+
+    def subtotaler(self, dimension):
+        """
+        Subtotaler för en dimension, sorterade efter summa (störst först).
+        Returns:
+            pd.DataFrame: Kolumnerna <dimension>, Summa och Antal rader
+        """
+        poster = self._subtotaler.get(dimension, {})
+        tabell = pd.DataFrame(
+            [(varde, math.fsum(delar), antal) for varde, (delar, antal) in poster.items()],
+            columns=[dimension, "Summa", "Antal rader"],
+        )
+        return tabell.sort_values("Summa", ascending=False, kind="stable", ignore_index=True)
+
+    def som_dict(self):
+        """
+        Sammanfattningen som dict, t.ex. för JSON.
+        """
+        return {
+            "total": float(self.total),
+            "antal_rader": self.antal_rader,
+            "subtotaler": {
+                dimension: [
+                    {"varde": str(rad[0]), "summa": float(rad[1]), "antal_rader": int(rad[2])}
+                    for rad in self.subtotaler(dimension).itertuples(index=False)
+                ]
+                for dimension in self.dimensioner if dimension in self.kolumner
+            },
+        }
+
+class Konteringsackumulator:
+    """
+    Löpande aggregat av konteringsrader. Kostnadsdata kan läggas till i en eller
+    flera omgångar (t.ex. chunkvis vid strömmande inläsning) och resultatet blir
+    konteringsraderna för all data som lagts till.
+
+    Varje kostnadsrad tilldelas en källa (resursregel, DevOps-mappning,
+    DevOps-default eller uppsamlingskontering). Källornas konteringsvärden
+    beräknas en gång och Netto summeras per konteringsgrupp. Netto hålls som exakta
+    delsummor, så att konteringen blir identisk oavsett om datat läggs till på en gång,
+    chunkvis eller som sparade dagaggregat.
+    """
+
+    KOLUMNER = [
+        "Kon/Proj", "_empty1", "RG", "Aktivitet", "ProjAkt", "ProjKat", "_empty2", "Netto", "Godkänt av", "KommentarBeskrivning",
+        "_beskrivningar"
+    ]
+
+    def __init__(self, config, resource_kontering_regler, parallell=None):
+        self.regel_index = resource_kontering_regler
+        self.parallell = parallell
+        self.godkant_av = config.get("godkant_av", "John Munthe")
+        devops = config.get("devops", {})
+        self.mappings = devops.get("mappings", [])
+        self.upps = config.get("uppsamlingskontering", {})
+
+        # Källtabell: resursregler, DevOps-mappningar, DevOps-default och uppsamlingskontering
+        self.kallor = self.regel_index.regler + list(self.mappings) + [devops.get("default", {}), self.upps]
+        self.devops_offset = len(self.regel_index.regler)
+        self.devops_default_id = self.devops_offset + len(self.mappings)
+        self.upps_id = self.devops_default_id + 1
+        self.mapping_lookup = {}
+        for idx, m in enumerate(self.mappings):
+            nyckel = (m.get("subcat", "").strip().lower(), m.get("metername", "").strip().lower())
+            self.mapping_lookup.setdefault(nyckel, self.devops_offset + idx)
+
+        self.warnings = []
+        self.kallvarden = {}
+        self.grupp_for_kalla = np.full(len(self.kallor), -1, dtype=np.int64)
+        self.grupper = []
+        self.grupp_nr = {}
+        self.antal_rader = 0
+
+    def _konteringsvarden(self, kontering_src):
+        """
+        Bygger konteringsvärdena för en källa enligt reglerna:
+        - Endast en av rg eller konproj ska vara satt per rad.
+        - Om båda är satta: logga varning, men behandla raden som projektkontering.
+        - Om rg är satt (rörelsegrenskontering):
+            RG = rg
+            Kon/Proj = projkat
+            ProjKat lämnas tom
+        - Om konproj är satt (projektkontering):
+            Kon/Proj = konproj
+            ProjKat = projkat
+            RG lämnas tom
+        Anropas en gång per källa, inte per kostnadsrad.
+        """
+        konproj_val = str(kontering_src.get("konproj", "") or "").strip()
+        rg_val = str(kontering_src.get("rg", "") or "").strip()
+        akt_val = str(kontering_src.get("akt", "") or "").strip()
+        projakt_val = str(kontering_src.get("projakt", "") or "").strip()
+        projkat_val = str(kontering_src.get("projkat", "") or "").strip()
+
+        # Bestäm typ av kontering
+        if konproj_val and rg_val:
+            self.warnings.append(
+                f"Konteringsregel har både konproj och rg satta (konproj={konproj_val}, rg={rg_val}). "
+                "Behandlar som projektkontering."
+            )
+            rg_out = ""
+            konproj_out = konproj_val
+            projkat_out = projkat_val
+        elif konproj_val:
+            rg_out = ""
+            konproj_out = konproj_val
+            projkat_out = projkat_val
+        elif rg_val:
+            rg_out = rg_val
+            konproj_out = projkat_val
+            projkat_out = ""
+        else:
+            # Fallback om varken rg eller konproj är satt: lägg kontot i Kon/Proj
+            rg_out = ""
+            konproj_out = projkat_val
+            projkat_out = ""
+
+        return {
+            "Kon/Proj": konproj_out,
+            "_empty1": "",
+            "RG": rg_out,
+            "Aktivitet": akt_val,
+            "ProjAkt": projakt_val,
+            "ProjKat": projkat_out,
+            "_empty2": "",
+            "Godkänt av": self.godkant_av,
+        }
+
+    @staticmethod
+    def konteringsgrupp(varden):
+        """
+        Grupperingsnyckel för en konteringsrad: projektkontering grupperas på
+        Kon/Proj, rörelsegrenskontering på RG.
+        """
+        if str(varden["Kon/Proj"]).startswith("P."):
+            return (varden["Kon/Proj"], varden["Aktivitet"], varden["ProjKat"], varden["Godkänt av"])
+        return (varden["RG"], varden["Aktivitet"], varden["Kon/Proj"], varden["Godkänt av"])
+
+    def tilldela_kallor(self, df):
+        """
+        Tilldelar varje rad i df en källa och en kommentar.
+        Returns:
+            tuple: (kalla_id, kommentar) som numpy-arrayer med en post per rad
+        """
+        antal = len(df)
+        if "ResourceId" in df.columns:
+            kalla_id = self.regel_index.hitta_index_kolumn(df["ResourceId"], self.parallell)
+        else:
+            kalla_id = np.full(antal, self.regel_index.hitta_index(""), dtype=np.int64)
+        kommentar = np.array([regel.get("beskrivning", "") or "" for regel in self.kallor], dtype=object)[kalla_id]
+        ej_regel = kalla_id < 0
+        kalla_id[ej_regel] = self.upps_id
+
+        # DevOps-logik: mappning på MeterSubCategory och MeterName, annars default
+        if "MeterCategory" in df.columns:
+            devops_mask = ej_regel & (df["MeterCategory"] == "Azure DevOps").to_numpy(dtype=bool, na_value=False)
+        else:
+            devops_mask = np.zeros(antal, dtype=bool)
+        devops_rader = np.flatnonzero(devops_mask)
+        if len(devops_rader):
+            def textkolumn(kolumn):
+                if kolumn in df.columns:
+                    return df[kolumn].iloc[devops_rader].astype(object).fillna("").astype(str).to_numpy()
+                return np.full(len(devops_rader), "", dtype=object)
+
+            par = pd.MultiIndex.from_arrays([textkolumn("MeterSubCategory"), textkolumn("MeterName")])
+            codes, unika_par = pd.factorize(par)
+            par_kalla = []
+            par_kommentar = []
+            for subcat, metername in unika_par:
+                kalla = self.mapping_lookup.get((subcat.strip().lower(), metername.strip().lower()), self.devops_default_id)
+                par_kalla.append(kalla)
+                par_kommentar.append(self.kallor[kalla].get("beskrivning") or f"Avser Azure DevOps: {subcat} ({metername})")
+            kalla_id[devops_rader] = np.array(par_kalla, dtype=np.int64)[codes]
+            kommentar[devops_rader] = np.array(par_kommentar, dtype=object)[codes]
+
+        # Uppsamlingskontering: beskrivning från konfigurationen eller BillingDescriptionTag
+        upps_mask = ej_regel & ~devops_mask
+        if self.upps.get("beskrivning"):
+            kommentar[upps_mask] = self.upps.get("beskrivning")
+        elif "BillingDescriptionTag" in df.columns:
+            beskrivningar = df["BillingDescriptionTag"].to_numpy(dtype=object)[upps_mask]
+            kommentar[upps_mask] = np.where(beskrivningar == "", "Ingen beskrivning angiven", beskrivningar)
+        else:
+            kommentar[upps_mask] = "Ingen beskrivning angiven"
+        return kalla_id, kommentar
+
+    def _grupper_for_kallor(self, kalla_id):
+        # Konteringsvärden och grupp för nya källor (varningar loggas en gång per källa)
+        for k in np.unique(kalla_id):
+            k = int(k)
+            if k in self.kallvarden:
+                continue
+            varden = self._konteringsvarden(self.kallor[k])
+            self.kallvarden[k] = varden
+            nyckel = self.konteringsgrupp(varden)
+            nr = self.grupp_nr.get(nyckel)
+            if nr is None:
+                nr = self.grupp_nr[nyckel] = len(self.grupper)
+                self.grupper.append({"nyckel": nyckel, "kalla": None, "delar": [],
+                                     "kommentarer": set(), "forsta_kommentar": None,
+                                     "beskrivningar": {}})
+            self.grupp_for_kalla[k] = nr
+        return self.grupp_for_kalla[kalla_id]
+
+    def lagg_till(self, df):
+        """
+        Lägger till kostnadsrader i aggregatet.
+        """
+        if df.empty:
+            return
+        with matningssteg("regelmatchning", len(df)):
+            kalla_id, kommentar = self.tilldela_kallor(df)
+        with matningssteg("gruppering", len(df)):
+            grupp = self._grupper_for_kallor(kalla_id)
+            netto = (df["CostInBillingCurrency"].to_numpy(dtype=np.float64, na_value=0.0)
+                     if "CostInBillingCurrency" in df.columns else np.zeros(len(df)))
+            rader = pd.DataFrame({
+                "_grupp": grupp,
+                "_kalla": kalla_id,
+                "KommentarBeskrivning": kommentar,
+            })
+            per_grupp = rader.groupby("_grupp", sort=False).agg(
+                _kalla=("_kalla", "first"),
+                KommentarBeskrivning=("KommentarBeskrivning", "first"),
+            )
+            delar = _exakta_delsummor_per_grupp(grupp, netto, len(self.grupper))
+            for nr, (kalla, forsta) in zip(per_grupp.index, per_grupp.itertuples(index=False)):
+                state = self.grupper[nr]
+                if state["kalla"] is None:
+                    state["kalla"] = int(kalla)
+                    state["forsta_kommentar"] = forsta
+                state["delar"] = _exakta_delsummor(state["delar"] + delar[nr])
+            unika = rader.dropna(subset=["KommentarBeskrivning"]).drop_duplicates(["_grupp", "KommentarBeskrivning"])
+            for nr, text in zip(unika["_grupp"].to_numpy(), unika["KommentarBeskrivning"].to_numpy()):
+                self.grupper[nr]["kommentarer"].add(text)
+            # Unika BillingDescriptionTag per grupp, i den ordning de förekommer (för kommentarer till Medius)
+            if "BillingDescriptionTag" in df.columns:
+                beskrivningar = pd.DataFrame({
+                    "_grupp": grupp,
+                    "BillingDescriptionTag": df["BillingDescriptionTag"].to_numpy(dtype=object),
+                }).dropna().drop_duplicates()
+                for nr, text in zip(beskrivningar["_grupp"].to_numpy(), beskrivningar["BillingDescriptionTag"].to_numpy()):
+                    if text and str(text).strip() != "":
+                        self.grupper[nr]["beskrivningar"].setdefault(text, None)
+        self.antal_rader += len(df)
+
+    def resultat(self):
+        """
+        Returnerar konteringsraderna sorterade per grupp, utan rader med Netto = 0,
+        och med summeringsrad sist. Kolumnen _beskrivningar innehåller gruppens unika
+        BillingDescriptionTag-värden.
+        Returns:
+            tuple: (kontering_df, warnings)
+        """
+        rader = []
+        for state in sorted((g for g in self.grupper if g["kalla"] is not None), key=lambda g: g["nyckel"]):
+            rad = dict(self.kallvarden[state["kalla"]])
+            rad["Netto"] = math.fsum(state["delar"])
+            rad["KommentarBeskrivning"] = (
+                state["forsta_kommentar"] if len(state["kommentarer"]) == 1 else "Ingen beskrivning angiven"
+            )
+            rad["_beskrivningar"] = tuple(state["beskrivningar"])
+            rader.append(rad)
+        kontering_df = pd.DataFrame(rader, columns=self.KOLUMNER)
+        # Filtrera bort rader där Netto = 0
+        if not kontering_df.empty:
+            kontering_df = kontering_df[kontering_df["Netto"] != 0]
+        # Summeringsrad
+        total = kontering_df["Netto"].sum() if not kontering_df.empty else 0
+        sumrad = {col: "" for col in kontering_df.columns}
+        sumrad["Netto"] = total
+        sumrad["Kon/Proj"] = "SUMMA"
+        kontering_df = pd.concat([kontering_df, pd.DataFrame([sumrad])], ignore_index=True)
+        return kontering_df, list(self.warnings)
+
+    def konteringsvarden(self, kalla):
+        """
+        Konteringsvärdena för en källa (index i kallor).
+        """
+        self._grupper_for_kallor(np.array([kalla], dtype=np.int64))
+        return self.kallvarden[kalla]
+
+    def konteringskolumner(self, df):
+        """
+        Konteringsvärden enligt den tilldelade källan för varje rad i df.
+        Returns:
+            pd.DataFrame: Kolumnerna Kon/Proj, RG, Aktivitet och ProjKat med df:s index
+        """
+        kalla_id, _ = self.tilldela_kallor(df)
+        unika, codes = np.unique(kalla_id, return_inverse=True)
+        self._grupper_for_kallor(unika)
+        return pd.DataFrame({
+            kolumn: np.array([self.kallvarden[int(k)][kolumn] for k in unika], dtype=object)[codes]
+            for kolumn in ("Kon/Proj", "RG", "Aktivitet", "ProjKat")
+        }, index=df.index)
+
+    def aggregat(self):
+        """
+        Returnerar aggregatets tillstånd per grupp i JSON-serialiserbar form, t.ex. för
+        att spara konteringsaggregatet för en dag i inkrementellt läge.
+        Returns:
+            dict: {"antal_rader": int, "kallor": [källor som förekommit],
+                   "grupper": [{"kalla", "netto", "delar", "kommentarer", "forsta_kommentar", "beskrivningar"}]}
+        """
+        grupper = []
+        for state in self.grupper:
+            if state["kalla"] is None:
+                continue
+            grupper.append({
+                "kalla": state["kalla"],
+                "netto": math.fsum(state["delar"]),
+                "delar": list(state["delar"]),
+                "kommentarer": sorted(state["kommentarer"]),
+                "forsta_kommentar": state["forsta_kommentar"],
+                "beskrivningar": list(state["beskrivningar"]),
+            })
+        return {"antal_rader": self.antal_rader, "kallor": sorted(self.kallvarden), "grupper": grupper}
+
+    def lagg_till_aggregat(self, aggregat):
+        """
+        Lägger till ett sparat aggregat (från aggregat()) med samma konfiguration.
+        Att lägga till aggregaten för flera omgångar i tur och ordning ger samma
+        resultat som att lägga till omgångarnas kostnadsrader med lagg_till().
+        """
+        if not aggregat["grupper"]:
+            return
+        # Alla källor registreras först så att varningarna blir desamma som vid lagg_till()
+        self._grupper_for_kallor(np.array(aggregat["kallor"], dtype=np.int64))
+        kalla_id = np.array([g["kalla"] for g in aggregat["grupper"]], dtype=np.int64)
+        for nr, g in zip(self.grupp_for_kalla[kalla_id], aggregat["grupper"]):
+            state = self.grupper[nr]
+            if state["kalla"] is None:
+                state["kalla"] = int(g["kalla"])
+                state["forsta_kommentar"] = g["forsta_kommentar"]
+            state["delar"] = _exakta_delsummor(state["delar"] + g["delar"])
+            state["kommentarer"].update(g["kommentarer"])
+            for text in g["beskrivningar"]:
+                state["beskrivningar"].setdefault(text, None)
+        self.antal_rader += aggregat["antal_rader"]
+
+class DagligtTillstand:
+    """
+    Persistent tillstånd per dag för inkrementell bearbetning av en period.
+    Varje dags taggade kostnadsrader sparas som Parquet-fil och dagens innehållshash,
+    radantal, summa och konteringsaggregat i tillstand.json. Vid nästa körning behöver
+    endast nya dagar och dagar som Azure har räknat om läsas in och konteras.
+    """
+
+    FIL = "tillstand.json"
+
+    def __init__(self, katalog):
+        self.katalog = katalog
+        self.dagar = {}
+        self.regler_hash = None
+        try:
+            with open(os.path.join(katalog, self.FIL), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.dagar = data.get("dagar", {})
+            self.regler_hash = data.get("regler_hash")
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def innehallshash(df):
+        """
+        Hash över en dags kostnadsrader (kolumnnamn och värden, i radordning).
+        """
+        sha = hashlib.sha256("\x1f".join(map(str, df.columns)).encode("utf-8"))
+        sha.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+        return sha.hexdigest()
+
+    def dagfil(self, dag):
+        return os.path.join(self.katalog, f"{dag}.parquet")
+
+    def uppdatera_dag(self, dag, df, hash_, aggregat, period):
+        """
+        Sparar en dags taggade kostnadsrader och dess aggregat.
+        """
+        os.makedirs(self.katalog, exist_ok=True)
+        df.to_parquet(self.dagfil(dag), index=False)
+        netto = float(df["CostInBillingCurrency"].sum()) if "CostInBillingCurrency" in df.columns else 0.0
+        self.dagar[dag] = {"hash": hash_, "rader": len(df), "netto": netto, "period": period, "aggregat": aggregat}
+
+    def ta_bort_dag(self, dag):
+        self.dagar.pop(dag, None)
+        if os.path.exists(self.dagfil(dag)):
+            os.remove(self.dagfil(dag))
+
+    def las_dag(self, dag, kolumner=None):
+        if kolumner is not None:
+            import pyarrow.parquet as pq
+            tillgangliga = pq.read_schema(self.dagfil(dag)).names
+            kolumner = [col for col in tillgangliga if col in set(kolumner)]
+        return pd.read_parquet(self.dagfil(dag), columns=kolumner)
+
+    def spara(self):
+        os.makedirs(self.katalog, exist_ok=True)
+        path = os.path.join(self.katalog, self.FIL)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"regler_hash": self.regler_hash, "dagar": self.dagar}, f, indent=2, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+class Kostnadslager:
+    """
+    Lokalt SQLite-lager med bearbetade, taggade och konterade kostnadsrader för
+    flera perioder. Raderna partitioneras på billing account och period (YYYYMM):
+    bearbetas en period igen ersätts periodens tidigare rader. Index på ResourceId,
+    SubscriptionName och konteringens Kon/Proj och RG gör att aggregat över
+    perioder kan besvaras utan att rapportfilerna läses om.
+    """
+
+    TABELL = "kostnadsrader"
+    # Kolumn i lagret och SQL-typ
+    KOLUMNER = {
+        "BillingAccountId": "TEXT",
+        "Period": "TEXT",
+        "Date": "TEXT",
+        "SubscriptionName": "TEXT",
+        "ResourceGroup": "TEXT",
+        "ResourceId": "TEXT",
+        "MeterCategory": "TEXT",
+        "MeterSubCategory": "TEXT",
+        "MeterName": "TEXT",
+        "CostInBillingCurrency": "REAL",
+        **{kolumn: "TEXT" for _, kolumn in TAG_KOLUMNER},
+        "KonProj": "TEXT",
+        "RG": "TEXT",
+        "Aktivitet": "TEXT",
+        "ProjKat": "TEXT",
+    }
+    INDEX = [
+        ("BillingAccountId", "Period"), ("ResourceId",), ("SubscriptionName",),
+        ("KonProj", "Period"), ("RG", "Period"),
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._anslut() as con:
+            kolumner = ", ".join(f'"{kolumn}" {typ}' for kolumn, typ in self.KOLUMNER.items())
+            con.execute(f"CREATE TABLE IF NOT EXISTS {self.TABELL} ({kolumner})")
+            for index in self.INDEX:
+                namn = f"ix_{self.TABELL}_{'_'.join(index).lower()}"
+                con.execute(f'CREATE INDEX IF NOT EXISTS {namn} ON {self.TABELL} ({", ".join(index)})')
+
+    @contextlib.contextmanager
+    def _anslut(self):
+        con = sqlite3.connect(self.path, timeout=60)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def skriv(self, rader, ersatta=None):
+        """
+        Skriver rader till lagret. Partitioner (BillingAccountId, Period) som inte finns
+        i ersatta töms först och läggs till i ersatta, så att samma set kan användas
+        när en rapport skrivs chunkvis.
+        Args:
+            rader (pd.DataFrame): Rader med lagrets kolumner
+            ersatta (set, optional): Partitioner som redan ersatts under körningen
+        """
+        ersatta = set() if ersatta is None else ersatta
+        rader = rader[[kolumn for kolumn in self.KOLUMNER if kolumn in rader.columns]]
+        partitioner = rader[["BillingAccountId", "Period"]].drop_duplicates().itertuples(index=False, name=None)
+        nya = [partition for partition in partitioner if partition not in ersatta]
+        kolumner = ", ".join(f'"{kolumn}"' for kolumn in rader.columns)
+        platser = ", ".join("?" * len(rader.columns))
+        varden = rader.astype(object).where(rader.notna(), None).itertuples(index=False, name=None)
+        with self._anslut() as con:
+            con.executemany(f"DELETE FROM {self.TABELL} WHERE BillingAccountId = ? AND Period = ?", nya)
+            con.executemany(f"INSERT INTO {self.TABELL} ({kolumner}) VALUES ({platser})", varden)
+        ersatta.update(nya)
+
+    def aggregera(self, grupper=("Period",), filtrering=None, perioder=None):
+        """
+        Summerar kostnad och antal rader per grupp.
+        Args:
+            grupper (sequence): Lagerkolumner att gruppera på, t.ex. ("Period", "KonProj")
+            filtrering (dict, optional): {kolumn: värde} som raderna måste matcha
+            perioder (tuple, optional): (första, sista) period i formatet 'YYYYMM'
+        Returns:
+            pd.DataFrame: grupperna, Kostnad och Rader
+        """
+        okanda = [kolumn for kolumn in list(grupper) + list(filtrering or {}) if kolumn not in self.KOLUMNER]
+        if okanda:
+            raise ValueError(f"Okända kolumner i kostnadslagret: {okanda}. Giltiga: {list(self.KOLUMNER)}")
+        villkor, parametrar = [], []
+        for kolumn, varde in (filtrering or {}).items():
+            villkor.append(f'"{kolumn}" = ?')
+            parametrar.append(varde)
+        if perioder:
+            villkor.append("Period BETWEEN ? AND ?")
+            parametrar.extend(perioder)
+        where = f"WHERE {' AND '.join(villkor)}" if villkor else ""
+        grupp_sql = ", ".join(f'"{kolumn}"' for kolumn in grupper)
+        sql = (
+            f"SELECT {grupp_sql + ', ' if grupper else ''}SUM(CostInBillingCurrency) AS Kostnad, COUNT(*) AS Rader "
+            f"FROM {self.TABELL} {where}"
+            + (f" GROUP BY {grupp_sql} ORDER BY {grupp_sql}" if grupper else "")
+        )
+        with self._anslut() as con:
+            return pd.read_sql_query(sql, con, params=parametrar)
+
+class RapportPoller:
+    """
+    Pollar operationResults för en rapportoperation tills downloadUrl finns.
+
+    Väntetiden mellan anropen styrs av Retry-After-headern när den finns, annars
+    av exponentiell backoff med jitter. Pollningen avbryts med TimeoutError när
+    deadline passerats. Latens och antal anrop per operation sparas i metriker.
+    HTTP-anropet, klockan och sleep kan bytas ut, t.ex. för test mot en lokal
+    fejkad operationResults-endpoint.
+    """
+
+    def __init__(self, logger, http_get=None, headers=None, initialt_intervall=5.0, max_intervall=60.0,
+                 faktor=2.0, jitter=0.2, deadline=3600.0, sleep=time.sleep, klocka=time.monotonic):
+        self.logger = logger
+        if http_get is None:
+            import requests
+            http_get = requests.get
+        self.http_get = http_get
+        self.headers = headers or (lambda: {})
+        self.initialt_intervall = initialt_intervall
+        self.max_intervall = max_intervall
+        self.faktor = faktor
+        self.jitter = jitter
+        self.deadline = deadline
+        self.sleep = sleep
+        self.klocka = klocka
+        self.metriker = {}
+
+    @staticmethod
+    def tolka_retry_after(varde):
+        """
+        Tolkar Retry-After som antal sekunder eller HTTP-datum. Returnerar None om värdet saknas.
+        """
+        if varde is None:
+            return None
+        try:
+            return max(0.0, float(varde))
+        except ValueError:
+            pass
+        try:
+            tidpunkt = parsedate_to_datetime(varde)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (tidpunkt - datetime.now(tidpunkt.tzinfo)).total_seconds())
+
+    def _backoff(self, forsok):
+        intervall = min(self.max_intervall, self.initialt_intervall * (self.faktor ** forsok))
+        return intervall * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def vanta(self, operation_result_url, operation_id=None, retry_after=None):
+        """
+        Väntar på att operationen blir klar.
+        Args:
+            operation_result_url (str): URL till operationResults
+            operation_id (str, optional): Nyckel för metrikerna
+            retry_after (str, optional): Retry-After från svaret som startade operationen
+        Returns:
+            str: downloadUrl, eller None om svaret saknar downloadUrl
+        """
+        operation_id = operation_id or operation_result_url
+        start = self.klocka()
+        slut = start + self.deadline
+        metrik = self.metriker[operation_id] = {"anrop": 0, "omforsok": 0, "vantetid": 0.0, "latens": None, "status": None}
+        vantan = self.tolka_retry_after(retry_after)
+        if vantan is None:
+            vantan = self._backoff(0)
+        forsok = 0
+        while True:
+            kvar = slut - self.klocka()
+            if kvar <= 0:
+                metrik["status"] = "Timeout"
+                metrik["latens"] = self.klocka() - start
+                raise TimeoutError(f"Rapportoperationen blev inte klar inom {self.deadline:.0f} sekunder")
+            vantan = min(vantan, kvar)
+            self.sleep(vantan)
+            metrik["vantetid"] += vantan
+            metrik["anrop"] += 1
+            response = self.http_get(operation_result_url, headers=self.headers())
+            forsok += 1
+            retry_after = self.tolka_retry_after(response.headers.get("Retry-After"))
+
+            if response.status_code == 200:
+                data = response.json()
+                status = data.get("status")
+                if self.logger.level == logging.DEBUG:
+                    self.logger.info(f"Svar från operationResult-URL: {response.text}")
+                self.logger.info(f"Rapportstatus: {status or 'Succeeded'}")
+                if status in ("Failed", "Canceled"):
+                    metrik["status"] = status
+                    metrik["latens"] = self.klocka() - start
+                    raise Exception(f"Rapportgenerering misslyckades: {data.get('error') or status}")
+                download_url = data.get("properties", {}).get("downloadUrl")
+                if download_url or status in ("Succeeded", "Completed"):
+                    metrik["status"] = status or "Succeeded"
+                    metrik["latens"] = self.klocka() - start
+                    self.logger.info(
+                        f"Rapportoperation klar efter {metrik['latens']:.1f} s och {metrik['anrop']} anrop"
+                    )
+                    return download_url
+            elif response.status_code == 202:
+                self.logger.info("Rapportstatus: Running")
+            elif response.status_code == 429 or response.status_code >= 500:
+                metrik["omforsok"] += 1
+                self.logger.warning(f"Tillfälligt fel vid pollning: {response.status_code}, försöker igen")
+            else:
+                metrik["status"] = str(response.status_code)
+                metrik["latens"] = self.klocka() - start
+                raise Exception(f"Kunde inte hämta operationResult: {response.status_code} {response.text}")
+            vantan = retry_after if retry_after is not None else self._backoff(forsok)
+
+class KostnadsFraga:
+    """
+    Hämtar aggregerade kostnader från Cost Management Query API i stället för den
+    detaljerade rapporten. Sidor hämtas via nextLink tills svaret är komplett och
+    throttlade anrop (429/5xx) görs om efter Retry-After.
+
+    Query API tillåter högst två grupperingar per fråga. Kostnaden hämtas därför
+    summerad per ResourceId och MeterId, och mätarnas och resursernas attribut
+    (t.ex. MeterCategory och SubscriptionName) samt varje taggnyckel hämtas i egna
+    frågor om två grupperingar och kopplas på via ResourceId eller MeterId.
+    Resultatet översätts till rapportens kolumnnamn med en Tags-kolumn i JSON-format,
+    så att taggextrahering, tagg-overrides och kontering fungerar som för en rapport.
+    HTTP-anropet, bas-URL:en och sleep kan bytas ut, t.ex. för test mot en lokal
+    fejkad Query-endpoint eller inspelade svar.
+    """
+
+    MAX_GRUPPERINGAR = 2
+    # Kostnadsfrågans gruppering, som attribut- och taggfrågorna kopplas på
+    KOSTNADSNYCKLAR = ("ResourceId", "MeterId")
+
+    # Query API:ts kolumnnamn (gemener) och motsvarande kolumner i den detaljerade rapporten
+    KOLUMNER = {
+        "resourceid": "ResourceId",
+        "metercategory": "MeterCategory",
+        "metersubcategory": "MeterSubCategory",
+        "meter": "MeterName",
+        "meterid": "MeterId",
+        "resourcegroupname": "ResourceGroup",
+        "resourcegroup": "ResourceGroup",
+        "subscriptionname": "SubscriptionName",
+        "subscriptionid": "SubscriptionId",
+        "chargetype": "ChargeType",
+        "pricingmodel": "PricingModel",
+        "usagedate": "Date",
+        "currency": "BillingCurrency",
+    }
+    KOSTNADSKOLUMNER = ("cost", "pretaxcost", "totalcost")
+    OMFORSOK_HEADERS = (
+        "Retry-After",
+        "x-ms-ratelimit-microsoft.costmanagement-qpu-retry-after",
+        "x-ms-ratelimit-microsoft.costmanagement-entity-retry-after",
+        "x-ms-ratelimit-microsoft.costmanagement-tenant-retry-after",
+    )
+
+    def __init__(self, logger, http_post=None, headers=None, bas_url="https://management.azure.com",
+                 api_version="2023-03-01", max_forsok=5, sleep=time.sleep):
+        self.logger = logger
+        if http_post is None:
+            import requests
+            http_post = requests.post
+        self.http_post = http_post
+        self.headers = headers or (lambda: {})
+        self.bas_url = bas_url.rstrip("/")
+        self.api_version = api_version
+        self.max_forsok = max_forsok
+        self.sleep = sleep
+        self.metriker = {"fragor": 0, "anrop": 0, "sidor": 0, "omforsok": 0, "rader": 0}
+
+    @classmethod
+    def definition(cls, start, slut, dimensioner, taggar=(), granularitet="None"):
+        """
+        Frågedefinition för faktisk kostnad summerad per dimensioner och taggnycklar.
+        Args:
+            start (datetime): Första dagen
+            slut (datetime): Sista dagen (inklusive)
+            dimensioner (list): Dimensioner att gruppera på, t.ex. ['ResourceId', 'MeterId']
+            taggar (list): Taggnycklar att gruppera på
+            granularitet (str): "None" (hela perioden) eller "Daily"
+        Raises:
+            ValueError: Om frågan får fler grupperingar än Query API tillåter
+        """
+        gruppering = [{"type": "Dimension", "name": dimension} for dimension in dimensioner]
+        gruppering += [{"type": "TagKey", "name": tagg} for tagg in taggar]
+        if len(gruppering) > cls.MAX_GRUPPERINGAR:
+            raise ValueError(f"Query API tillåter högst {cls.MAX_GRUPPERINGAR} grupperingar per fråga, "
+                             f"fick {[g['name'] for g in gruppering]}")
+        return {
+            "type": "ActualCost",
+            "timeframe": "Custom",
+            "timePeriod": {"from": f"{start:%Y-%m-%d}T00:00:00+00:00", "to": f"{slut:%Y-%m-%d}T23:59:59+00:00"},
+            "dataset": {
+                "granularity": granularitet,
+                "aggregation": {"totalCost": {"name": "Cost", "function": "Sum"}},
+                "grouping": gruppering,
+            },
+        }
+
+    def _vantetid(self, response, forsok):
+        for header in self.OMFORSOK_HEADERS:
+            vantan = RapportPoller.tolka_retry_after(response.headers.get(header))
+            if vantan is not None:
+                return vantan
+        return min(60.0, 2.0 ** forsok)
+
+    def _post(self, url, definition):
+        for forsok in range(self.max_forsok):
+            self.metriker["anrop"] += 1
+            response = self.http_post(url, json=definition, headers=self.headers())
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code != 429 and response.status_code < 500:
+                raise Exception(f"Kostnadsfrågan misslyckades: {response.status_code} {response.text}")
+            self.metriker["omforsok"] += 1
+            vantan = self._vantetid(response, forsok)
+            self.logger.warning(f"Kostnadsfrågan throttlad eller tillfälligt fel ({response.status_code}), "
+                                f"försöker igen om {vantan:.0f} s")
+            self.sleep(vantan)
+        raise Exception(f"Kostnadsfrågan misslyckades efter {self.max_forsok} försök: "
+                        f"{response.status_code} {response.text}")
+
+    def hamta(self, scope, definition):
+        """
+        Kör frågan och hämtar alla sidor.
+        Args:
+            scope (str): T.ex. /providers/Microsoft.Billing/billingAccounts/<id>
+            definition (dict): Frågedefinition från definition()
+        Returns:
+            pd.DataFrame: Svarets kolumner och rader
+        """
+        url = (f"{self.bas_url}/{scope.strip('/')}/providers/Microsoft.CostManagement/query"
+               f"?api-version={self.api_version}")
+        kolumner = None
+        rader = []
+        self.metriker["fragor"] += 1
+        while url:
+            properties = self._post(url, definition).get("properties", {})
+            if kolumner is None:
+                kolumner = [kolumn["name"] for kolumn in properties.get("columns", [])]
+            rader.extend(properties.get("rows", []))
+            self.metriker["sidor"] += 1
+            # nextLink POST:as med samma definition och innehåller redan api-version och skiptoken
+            url = properties.get("nextLink")
+        self.metriker["rader"] += len(rader)
+        grupper = [g["name"] for g in definition.get("dataset", {}).get("grouping", [])]
+        self.logger.info(f"Kostnadsfrågan per {', '.join(grupper)} gav {len(rader)} rader")
+        return pd.DataFrame(rader, columns=kolumner or [])
+
+    def kostnadsrader(self, svar):
+        """
+        Översätter frågesvaret till den detaljerade rapportens kolumnnamn, med
+        kostnaden i CostInBillingCurrency och UsageDate som Date.
+        Args:
+            svar (pd.DataFrame): Svar från hamta()
+        """
+        df = pd.DataFrame(index=svar.index)
+        per_namn = {str(kolumn).lower(): kolumn for kolumn in svar.columns}
+        for namn, kolumn in per_namn.items():
+            if namn in self.KOLUMNER:
+                df[self.KOLUMNER[namn]] = svar[kolumn]
+        kostnad = next((per_namn[namn] for namn in self.KOSTNADSKOLUMNER if namn in per_namn), None)
+        if kostnad is None:
+            raise Exception(f"Kostnadsfrågans svar saknar kostnadskolumn: {list(svar.columns)}")
+        df["CostInBillingCurrency"] = pd.to_numeric(svar[kostnad], errors="coerce").fillna(0.0)
+        if "Date" in df.columns:
+            df["Date"] = pd.to_datetime(df["Date"].astype(str), format="%Y%m%d", errors="coerce")
+        return df
+
+    @staticmethod
+    def varde_per_nyckel(rader, nycklar, kolumn):
+        """
+        Ett värde av kolumn per nyckel, för att kopplas på kostnadsraderna. Har en nyckel
+        flera icke-tomma värden (t.ex. en resurs som taggats om under perioden) används
+        värdet med störst kostnad. Tomma nycklar, t.ex. kostnader utan ResourceId, får
+        inget värde eftersom de inte identifierar en resurs eller mätare.
+        Returns:
+            tuple: (DataFrame med nycklar och kolumn, antal nycklar med flera värden)
+        """
+        varden = rader[list(nycklar) + [kolumn, "CostInBillingCurrency"]].astype({kolumn: object})
+        giltiga = varden[kolumn].notna() & (varden[kolumn].astype(str) != "")
+        for nyckel in nycklar:
+            giltiga &= varden[nyckel].notna() & (varden[nyckel].astype(str) != "")
+        varden = varden[giltiga]
+        flera = int((varden.groupby(list(nycklar))[kolumn].nunique() > 1).sum())
+        varden = varden.sort_values("CostInBillingCurrency", ascending=False, kind="stable")
+        return varden.drop_duplicates(list(nycklar))[list(nycklar) + [kolumn]], flera
+
+    def hamta_kostnad(self, scope, start, slut, attribut, taggar=(), granularitet="None"):
+        """
+        Hämtar kostnaden per ResourceId och MeterId (och dag med granularitet "Daily")
+        och kopplar på attribut och taggar från egna frågor med högst två grupperingar.
+        Args:
+            scope (str): T.ex. /providers/Microsoft.Billing/billingAccounts/<id>
+            start (datetime): Första dagen
+            slut (datetime): Sista dagen (inklusive)
+            attribut (dict): Dimensioner att koppla på per nyckeldimension,
+                t.ex. {'MeterId': ['MeterCategory'], 'ResourceId': ['SubscriptionName']}
+            taggar (list): Taggnycklar som samlas i Tags-kolumnen
+            granularitet (str): "None" (hela perioden) eller "Daily"
+        Returns:
+            pd.DataFrame: En rad per ResourceId och MeterId (och dag) i rapportens format
+        """
+        df = self.kostnadsrader(self.hamta(scope, self.definition(start, slut, self.KOSTNADSNYCKLAR,
+                                                                    granularitet=granularitet)))
+        for nyckel, dimensioner in attribut.items():
+            nyckelkolumn = self.KOLUMNER[nyckel.lower()]
+            for dimension in dimensioner:
+                # Attributen beror inte på dagen och hämtas för hela perioden
+                rader = self.kostnadsrader(self.hamta(scope, self.definition(start, slut, [nyckel, dimension])))
+                kolumn = self.KOLUMNER.get(dimension.lower(), dimension)
+                if kolumn not in rader.columns:
+                    self.logger.warning(f"Kostnadsfrågans svar saknar {dimension}, kolumnen lämnas tom")
+                    continue
+                varden, flera = self.varde_per_nyckel(rader, [nyckelkolumn], kolumn)
+                if flera:
+                    self.logger.warning(f"{flera} {nyckelkolumn} har flera värden för {dimension}, "
+                                        "värdet med störst kostnad används")
+                df = df.drop(columns=[kolumn], errors="ignore").merge(varden, on=nyckelkolumn, how="left",
+                                                                      validate="many_to_one")
+
+        # En fråga per taggnyckel. Svaret har kolumnerna TagKey och TagValue, där
+        # kostnader utan taggen har tomt TagValue
+        tagg_nycklar = ["ResourceId"] + (["Date"] if "Date" in df.columns else [])
+        taggkolumner = []
+        for nr, tagg in enumerate(taggar):
+            svar = self.hamta(scope, self.definition(start, slut, ["ResourceId"], [tagg], granularitet))
+            per_namn = {str(kolumn).lower(): kolumn for kolumn in svar.columns}
+            vardekolumn = per_namn.get("tagvalue", per_namn.get(str(tagg).lower()))
+            if vardekolumn is None:
+                self.logger.warning(f"Kostnadsfrågans svar saknar värden för taggen {tagg}, taggen lämnas tom")
+                continue
+            rader = self.kostnadsrader(svar)
+            rader[f"_tagg{nr}"] = svar[vardekolumn]
+            varden, flera = self.varde_per_nyckel(rader, tagg_nycklar, f"_tagg{nr}")
+            if flera:
+                self.logger.warning(f"{flera} resurser har flera värden för taggen {tagg}, "
+                                    "värdet med störst kostnad används")
+            df = df.merge(varden, on=tagg_nycklar, how="left", validate="many_to_one")
+            taggkolumner.append((tagg, f"_tagg{nr}"))
+
+        if taggkolumner:
+            taggdata = df[[kolumn for _, kolumn in taggkolumner]].astype(object)
+            df["Tags"] = [
+                json.dumps({tagg: varde for (tagg, _), varde in zip(taggkolumner, rad)
+                            if isinstance(varde, str) and varde}, ensure_ascii=False)
+                for rad in taggdata.itertuples(index=False)
+            ]
+            df = df.drop(columns=[kolumn for _, kolumn in taggkolumner])
+        else:
+            df["Tags"] = ""
+        return df
+
+class Resursinventering:
+    """
+    Lokalt cachad inventering av resurser och resursgrupper med taggar, hämtad
+    från Azure Resource Manager en gång per prenumeration och TTL.
+
+    Kostnadsexportens Tags-kolumn saknar ofta taggar, t.ex. för resurser som
+    taggats i efterhand eller för underresurser. Effektiva taggar för ett
+    ResourceId byggs av resursgruppens taggar, överlagrade med föräldraresursernas
+    (t.ex. SQL-servern för en databas) och sist resursens egna. Varje prenumeration
+    listas med ett fåtal sidade anrop, inte ett anrop per resurs. HTTP-anropet,
+    bas-URL:en och klockan kan bytas ut, t.ex. för test mot en lokal fejkad endpoint.
+    """
+
+    RESURS_ID = re.compile(r'^/subscriptions/([^/]+)(?:/resourcegroups/([^/]+))?')
+
+    def __init__(self, logger, katalog, http_get=None, headers=None, ttl_timmar=24,
+                 bas_url="https://management.azure.com", api_version="2021-04-01", max_forsok=5,
+                 sleep=time.sleep, klocka=time.time):
+        self.logger = logger
+        self.katalog = katalog
+        if http_get is None:
+            import requests
+            http_get = requests.get
+        self.http_get = http_get
+        self.headers = headers or (lambda: {})
+        self.ttl = ttl_timmar * 3600
+        self.bas_url = bas_url.rstrip("/")
+        self.api_version = api_version
+        self.max_forsok = max_forsok
+        self.sleep = sleep
+        self.klocka = klocka
+        self._prenumerationer = {}
+        self._taggar = {}
+        self._lock = threading.Lock()
+        self.metriker = {"anrop": 0, "prenumerationer": 0}
+
+    def _hamta_alla(self, url):
+        """
+        Hämtar alla sidor (nextLink) av en ARM-lista och returnerar posterna i value.
+        """
+        poster = []
+        while url:
+            for forsok in range(self.max_forsok):
+                self.metriker["anrop"] += 1
+                response = self.http_get(url, headers=self.headers())
+                if response.status_code != 429 and response.status_code < 500:
+                    break
+                vantan = RapportPoller.tolka_retry_after(response.headers.get("Retry-After"))
+                self.sleep(vantan if vantan is not None else min(60.0, 2.0 ** forsok))
+            if response.status_code != 200:
+                raise Exception(f"Kunde inte lista {url}: {response.status_code} {response.text}")
+            data = response.json()
+            poster.extend(data.get("value", []))
+            url = data.get("nextLink")
+        return poster
+
+    @staticmethod
+    def _taggar_gemener(post):
+        return {str(nyckel).lower(): str(varde) for nyckel, varde in (post.get("tags") or {}).items()
+                if varde is not None and str(varde) != ""}
+
+    def _cachefil(self, prenumeration):
+        return os.path.join(self.katalog, f"{prenumeration}.json")
+
+    def _svep(self, prenumeration):
+        """
+        Listar prenumerationens resursgrupper och resurser med taggar. Endast taggade
+        poster sparas.
+        """
+        bas = f"{self.bas_url}/subscriptions/{prenumeration}"
+        resursgrupper = {}
+        for post in self._hamta_alla(f"{bas}/resourcegroups?api-version={self.api_version}"):
+            taggar = self._taggar_gemener(post)
+            if taggar:
+                resursgrupper[str(post.get("name", "")).lower()] = taggar
+        resurser = {}
+        for post in self._hamta_alla(f"{bas}/resources?api-version={self.api_version}"):
+            taggar = self._taggar_gemener(post)
+            if taggar:
+                resurser[str(post.get("id", "")).lower()] = taggar
+        self.metriker["prenumerationer"] += 1
+        self.logger.info(f"Resursinventering för prenumeration {prenumeration}: "
+                         f"{len(resurser)} taggade resurser, {len(resursgrupper)} taggade resursgrupper")
+        return {"hamtad": self.klocka(), "resurser": resurser, "resursgrupper": resursgrupper}
+
+    def prenumeration(self, prenumeration):
+        """
+        Inventeringen för en prenumeration, från minnet, från den lokala cachen om den
+        är yngre än TTL eller annars från Azure.
+        """
+        with self._lock:
+            if prenumeration in self._prenumerationer:
+                return self._prenumerationer[prenumeration]
+            inventering = None
+            try:
+                with open(self._cachefil(prenumeration), "r", encoding="utf-8") as f:
+                    inventering = json.load(f)
+                if self.klocka() - inventering.get("hamtad", 0) > self.ttl:
+                    inventering = None
+            except (OSError, ValueError):
+                pass
+            if inventering is None:
+                try:
+                    inventering = self._svep(prenumeration)
+                except Exception as e:
+                    # Saknad behörighet m.m.: prenumerationen får inga taggar under körningen
+                    self.logger.warning(f"Resursinventering misslyckades för prenumeration {prenumeration}: {e}")
+                    inventering = {"hamtad": None, "resurser": {}, "resursgrupper": {}}
+                else:
+                    os.makedirs(self.katalog, exist_ok=True)
+                    cachefil = self._cachefil(prenumeration)
+                    with open(f"{cachefil}.tmp", "w", encoding="utf-8") as f:
+                        json.dump(inventering, f, ensure_ascii=False)
+                    os.replace(f"{cachefil}.tmp", cachefil)
+            self._prenumerationer[prenumeration] = inventering
+            return inventering
+
+    def taggar(self, resource_id):
+        """
+        Effektiva taggar (gemena nycklar) för ett ResourceId: resursgruppens taggar,
+        överlagrade med föräldraresursernas och resursens egna.
+        """
+        key = str(resource_id).lower()
+        if key in self._taggar:
+            return self._taggar[key]
+        traff = self.RESURS_ID.match(key)
+        taggar = {}
+        if traff:
+            inventering = self.prenumeration(traff.group(1))
+            if traff.group(2):
+                taggar.update(inventering["resursgrupper"].get(traff.group(2), {}))
+            delar = key.split('/')
+            if 'providers' in delar:
+                # Resursen och dess föräldrar: .../providers/<namnrymd>/<typ>/<namn>[/<undertyp>/<namn>...]
+                minsta = delar.index('providers') + 4
+                kedja = ['/'.join(delar[:slut]) for slut in range(len(delar), minsta - 1, -2)]
+                for resurs in reversed(kedja):
+                    taggar.update(inventering["resurser"].get(resurs, {}))
+        self._taggar[key] = taggar
+        return taggar
+
+class _NedladdningsStrom(io.RawIOBase):
+    """
+    Sekventiell läsare över en pågående nedladdning. Läsningen blockerar tills
+    nästa byte finns på disk, så att dekomprimering och CSV-tolkning kan börja
+    innan hela filen är nedladdad.
+    """
+
+    def __init__(self, nedladdning):
+        super().__init__()
+        self.nedladdning = nedladdning
+        self.pos = 0
+        # Obuffrad: en buffrad läsare läser förbi tillganglig() och cachar nollor från
+        # den förallokerade filen i delar som ännu inte laddats ner
+        self.fil = open(nedladdning.part, 'rb', buffering=0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffert):
+        tillganglig = self.nedladdning.vanta_pa_bytes(self.pos + 1)
+        if tillganglig <= self.pos:
+            return 0
+        self.fil.seek(self.pos)
+        data = self.fil.read(min(len(buffert), tillganglig - self.pos))
+        buffert[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.fil.close()
+        super().close()
+
+class RapportNedladdning:
+    """
+    En nedladdning som pågår i bakgrunden. Filen skrivs till <destination>.part och
+    döps om till destination först när längd och checksumma verifierats i vanta().
+    """
+
+    def __init__(self, nedladdare, url, destination):
+        self.nedladdare = nedladdare
+        self.logger = nedladdare.logger
+        self.url = url
+        self.destination = destination
+        self.part = f"{destination}.part"
+        self.statusfil = f"{destination}.part.json"
+        self.storlek = None
+        self.etag = None
+        self.md5 = None
+        self.segment = []
+        self._skrivna = {}
+        self._klar = False
+        self._fel = None
+        self._senaste_procent = -10
+        self._villkor = threading.Condition()
+        self._trad = None
+
+    def tillganglig(self):
+        # Antal sammanhängande bytes från filens början som finns på disk
+        total = 0
+        for idx, (start, slut) in enumerate(self.segment):
+            skrivet = self._skrivna.get(idx, 0)
+            total += skrivet
+            if slut is None or skrivet < slut - start + 1:
+                break
+        return total
+
+    def vanta_pa_bytes(self, antal):
+        """
+        Blockerar tills minst antal bytes finns sammanhängande på disk eller nedladdningen är klar.
+        Returns:
+            int: Antal tillgängliga bytes
+        """
+        with self._villkor:
+            while True:
+                if self._fel is not None:
+                    raise self._fel
+                tillganglig = self.tillganglig()
+                if tillganglig >= antal or self._klar:
+                    return tillganglig
+                self._villkor.wait()
+
+    def _rapportera(self, idx, skrivet):
+        with self._villkor:
+            self._skrivna[idx] = skrivet
+            self._villkor.notify_all()
+            if self.storlek:
+                procent = int(sum(self._skrivna.values()) * 100 / self.storlek)
+                if procent >= self._senaste_procent + 10:
+                    self._senaste_procent = procent - procent % 10
+                    self.logger.info(f"Nedladdning {procent} % ({sum(self._skrivna.values()):,} av {self.storlek:,} bytes)")
+
+    def _spara_status(self, klara):
+        with open(self.statusfil, "w", encoding="utf-8") as f:
+            json.dump({
+                "kalla": self.nedladdare.kalla(self.url),
+                "storlek": self.storlek,
+                "etag": self.etag,
+                "delstorlek": self.nedladdare.delstorlek,
+                "klara": sorted(klara),
+            }, f)
+
+    def _las_status(self):
+        try:
+            with open(self.statusfil, "r", encoding="utf-8") as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if (status.get("storlek") != self.storlek or status.get("etag") != self.etag
+                or status.get("delstorlek") != self.nedladdare.delstorlek or not os.path.exists(self.part)):
+            return set()
+        return set(status.get("klara", []))
+
+    def _ladda_segment(self, idx, klara, klara_lock):
+        start, slut = self.segment[idx]
+        skrivet = 0
+        for forsok in range(self.nedladdare.max_forsok):
+            try:
+                headers = {"Range": f"bytes={start + skrivet}-{slut}"}
+                with self.nedladdare.session.get(self.url, headers=headers, stream=True,
+                                                 timeout=self.nedladdare.timeout) as r:
+                    r.raise_for_status()
+                    if r.status_code != 206:
+                        raise Exception(f"Servern ignorerade Range-anropet ({r.status_code})")
+                    with open(self.part, 'r+b', buffering=0) as f:
+                        f.seek(start + skrivet)
+                        for data in r.iter_content(chunk_size=self.nedladdare.buffert):
+                            f.write(data)
+                            skrivet += len(data)
+                            self._rapportera(idx, skrivet)
+                if skrivet != slut - start + 1:
+                    raise Exception(f"Segment {idx} ofullständigt: {skrivet} av {slut - start + 1} bytes")
+                with klara_lock:
+                    klara.add(idx)
+                    self._spara_status(klara)
+                return
+            except Exception as e:
+                if getattr(getattr(e, "response", None), "status_code", None) == 403:
+                    # En utgången SAS-token blir inte giltig igen; nästa körning hämtar en ny
+                    # downloadUrl och återupptar från de delar som redan är klara
+                    self.logger.error(f"Segment {idx} nekades (403), SAS-token har troligen gått ut")
+                    raise
+                if forsok + 1 >= self.nedladdare.max_forsok:
+                    raise
+                vantetid = self.nedladdare._backoff(forsok)
+                self.logger.warning(f"Fel vid nedladdning av segment {idx}, försöker igen om {vantetid:.1f}s: {e}")
+                self.nedladdare.sleep(vantetid)
+
+    def _ladda_ranger(self):
+        klara = self._las_status()
+        if klara:
+            self.logger.info(f"Återupptar nedladdning, {len(klara)} av {len(self.segment)} delar redan klara")
+        else:
+            with open(self.part, 'wb') as f:
+                f.truncate(self.storlek)
+        for idx in klara:
+            start, slut = self.segment[idx]
+            self._rapportera(idx, slut - start + 1)
+        klara_lock = threading.Lock()
+        kvar = [idx for idx in range(len(self.segment)) if idx not in klara]
+        with ThreadPoolExecutor(max_workers=self.nedladdare.parallella) as executor:
+            for future in [executor.submit(self._ladda_segment, idx, klara, klara_lock) for idx in kvar]:
+                future.result()
+
+    def _ladda_strom(self):
+        # Servern stöder inte Range eller anger ingen längd: en enda ström från början
+        with self.nedladdare.session.get(self.url, stream=True, timeout=self.nedladdare.timeout) as r:
+            r.raise_for_status()
+            skrivet = 0
+            with open(self.part, 'r+b', buffering=0) as f:
+                for data in r.iter_content(chunk_size=self.nedladdare.buffert):
+                    f.write(data)
+                    skrivet += len(data)
+                    self._rapportera(0, skrivet)
+
+    def _kor(self):
+        try:
+            if self.segment and self.segment[0][1] is not None:
+                self._ladda_ranger()
+            else:
+                self._ladda_strom()
+        except Exception as e:
+            with self._villkor:
+                self._fel = e
+                self._villkor.notify_all()
+            return
+        with self._villkor:
+            self._klar = True
+            self._villkor.notify_all()
+
+    def starta(self):
+        head = self.nedladdare.session.head(self.url, timeout=self.nedladdare.timeout, allow_redirects=True)
+        if head.ok:
+            langd = head.headers.get("Content-Length")
+            self.storlek = int(langd) if langd and langd.isdigit() else None
+            self.etag = head.headers.get("ETag")
+            self.md5 = head.headers.get("Content-MD5") or head.headers.get("x-ms-blob-content-md5")
+            stoder_range = head.headers.get("Accept-Ranges", "").lower() == "bytes"
+        else:
+            stoder_range = False
+        if stoder_range and self.storlek:
+            delstorlek = self.nedladdare.delstorlek
+            self.segment = [(start, min(start + delstorlek, self.storlek) - 1) for start in range(0, self.storlek, delstorlek)]
+            if not os.path.exists(self.part):
+                open(self.part, 'wb').close()
+        else:
+            self.segment = [(0, None)]
+            open(self.part, 'wb').close()
+        self._trad = threading.Thread(target=self._kor, daemon=True)
+        self._trad.start()
+        return self
+
+    def oppna(self):
+        """
+        Öppnar en sekventiell binär läsare som kan användas medan nedladdningen pågår.
+        """
+        return io.BufferedReader(_NedladdningsStrom(self), buffer_size=self.nedladdare.buffert)
+
+    def vanta(self):
+        """
+        Väntar tills nedladdningen är klar, verifierar längd och checksumma och döper
+        om .part-filen till destination.
+        Returns:
+            str: Sökväg till den nedladdade filen
+        """
+        self._trad.join()
+        if self._fel is not None:
+            raise self._fel
+        faktisk = os.path.getsize(self.part)
+        if self.storlek is not None and faktisk != self.storlek:
+            raise Exception(f"Nedladdad fil har fel längd: {faktisk} av {self.storlek} bytes")
+        if self.md5:
+            md5 = hashlib.md5()
+            with open(self.part, 'rb') as f:
+                for block in iter(lambda: f.read(self.nedladdare.buffert), b''):
+                    md5.update(block)
+            if base64.b64encode(md5.digest()).decode() != self.md5:
+                os.remove(self.part)
+                if os.path.exists(self.statusfil):
+                    os.remove(self.statusfil)
+                raise Exception("Nedladdad fil har fel checksumma (Content-MD5)")
+        os.replace(self.part, self.destination)
+        if os.path.exists(self.statusfil):
+            os.remove(self.statusfil)
+        self.logger.info(f"Nedladdning verifierad: {faktisk:,} bytes")
+        return self.destination
+
+class RapportNedladdare:
+    """
+    Laddar ner rapportfiler med parallella HTTP Range-anrop och stora buffertar.
+    Delar som redan laddats ner sparas i <fil>.part.json så att en avbruten
+    nedladdning kan återupptas, och filen verifieras mot Content-Length och
+    Content-MD5 innan den döps om från .part.
+    """
+
+    def __init__(self, session, logger, parallella=4, delstorlek=32 * 1024 * 1024, buffert=1024 * 1024,
+                 max_forsok=3, timeout=60, initialt_intervall=1.0, max_intervall=30.0, faktor=2.0, jitter=0.2,
+                 sleep=time.sleep):
+        self.session = session
+        self.logger = logger
+        self.parallella = parallella
+        self.delstorlek = delstorlek
+        self.buffert = buffert
+        self.max_forsok = max_forsok
+        self.timeout = timeout
+        self.initialt_intervall = initialt_intervall
+        self.max_intervall = max_intervall
+        self.faktor = faktor
+        self.jitter = jitter
+        self.sleep = sleep
+
+    def _backoff(self, forsok):
+        # Samma exponentiella backoff med jitter som RapportPoller, så att parallella segment
+        # inte försöker igen i takt mot en överbelastad server
+        intervall = min(self.max_intervall, self.initialt_intervall * (self.faktor ** forsok))
+        return intervall * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    @staticmethod
+    def kalla(url):
+        # Blobbens adress utan SAS-token, som är ny för varje downloadUrl
+        delar = urlsplit(url)
+        return f"{delar.scheme}://{delar.netloc}{delar.path}"
+
+    def pagaende_destination(self, url, katalog):
+        """
+        Returnerar destinationen för en avbruten nedladdning av samma blob, eller None.
+        """
+        for statusfil in glob.glob(os.path.join(glob.escape(katalog), "*.part.json")):
+            try:
+                with open(statusfil, "r", encoding="utf-8") as f:
+                    if json.load(f).get("kalla") == self.kalla(url):
+                        return statusfil[:-len(".part.json")]
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def starta(self, url, destination):
+        """
+        Startar nedladdningen i bakgrunden.
+        Returns:
+            RapportNedladdning
+        """
+        return RapportNedladdning(self, url, destination).starta()
+
+    def ladda_ner(self, url, destination):
+        """
+        Laddar ner url till destination och väntar tills filen är verifierad.
+        """
+        return self.starta(url, destination).vanta()
+
+class AzureTokenCache:
+    """
+    Cachar access token för Azure Resource Manager och förnyar den strax innan
+    den går ut. Trådsäker, så att parallella rapporter delar samma token.
+    """
+
+    SCOPE = "https://management.azure.com/.default"
+
+    def __init__(self, credential, marginal=300, klocka=time.time):
+        self.credential = credential
+        self.marginal = marginal
+        self.klocka = klocka
+        self._token = None
+        self._lock = threading.Lock()
+
+    def token(self):
+        with self._lock:
+            if self._token is None or self._token.expires_on - self.klocka() < self.marginal:
+                self._token = self.credential.get_token(self.SCOPE)
+            return self._token.token
+
+    def headers(self):
+        return {"Authorization": f"Bearer {self.token()}"}
+
 class AzureCostProcessor:
     def __init__(self, logger):
         self.logger = logger
-        self.credentials = ClientSecretCredential(
-            tenant_id=config.AZURE_TENANT_ID,
-            client_id=config.AZURE_CLIENT_ID,
-            client_secret=config.AZURE_CLIENT_SECRET
-        )
-        self.cost_client = CostManagementClient(self.credentials)
-        self.resource_client = ResourceManagementClient(self.credentials, config.AZURE_TENANT_ID)
+        # Inloggning, Azure-klienter och HTTP-session skapas först när de används, så att
+        # bearbetning av lokala filer varken kräver inloggningsuppgifter eller laddar Azure SDK:n
+        self._klienter = {}
+        self._klient_lock = threading.RLock()
+
+    def _klient(self, namn, skapa):
+        with self._klient_lock:
+            if namn not in self._klienter:
+                self._klienter[namn] = skapa()
+            return self._klienter[namn]
+
+    @property
+    def parallell(self):
+        """
+        Delad ParallellBearbetning enligt config.PARALLELLA_PROCESSER, eller None vid
+        seriell körning. Processerna startas först när de behövs och återanvänds mellan körningar.
+        """
+        processer = config.PARALLELLA_PROCESSER
+        if processer == 0:
+            processer = os.cpu_count() or 1
+        if not processer or processer <= 1:
+            return None
+        parallell = self._klient(f"parallell_{processer}", lambda: ParallellBearbetning(processer))
+        parallell.min_unika = config.PARALLELL_MIN_UNIKA
+        return parallell
+
+    @property
+    def credentials(self):
+        def skapa():
+            from azure.identity import ClientSecretCredential
+            return ClientSecretCredential(
+                tenant_id=config.AZURE_TENANT_ID,
+                client_id=config.AZURE_CLIENT_ID,
+                client_secret=config.AZURE_CLIENT_SECRET
+            )
+        return self._klient("credentials", skapa)
+
+    @property
+    def cost_client(self):
+        def skapa():
+            from azure.mgmt.costmanagement import CostManagementClient
+            return CostManagementClient(self.credentials)
+        return self._klient("cost_client", skapa)
+
+    @property
+    def resursinventering(self):
+        return self._klient("resursinventering", lambda: Resursinventering(
+            self.logger, config.RESURSINVENTERING_KATALOG,
+            http_get=self.session.get,
+            headers=self.token_cache.headers,
+            ttl_timmar=config.RESURSINVENTERING_TTL_TIMMAR,
+        ))
+
+    # Gemensamt transportlager för REST-anrop och nedladdningar: återanvända anslutningar och cachad token
+    @property
+    def token_cache(self):
+        return self._klient("token_cache", lambda: AzureTokenCache(self.credentials))
+
+    @property
+    def session(self):
+        return self._klient("session", self._skapa_session)
+
+    @property
+    def nedladdare(self):
+        return self._klient("nedladdare", lambda: RapportNedladdare(
+            self.session, self.logger,
+            parallella=config.NEDLADDNING_PARALLELLA,
+            delstorlek=config.NEDLADDNING_DELSTORLEK,
+            buffert=config.NEDLADDNING_BUFFERT,
+        ))
+
+    @staticmethod
+    def _skapa_session():
+        """
+        Skapar en requests.Session med keep-alive och anslutningspool, delad av alla
+        anrop mot Azure och nedladdningar av rapporter.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=config.HTTP_POOL_STORLEK, pool_maxsize=config.HTTP_POOL_STORLEK)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def azure_get(self, url, **kwargs):
+        """
+        GET mot Azure Resource Manager via den delade sessionen med cachad token.
+        """
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.update(self.token_cache.headers())
+        return self.session.get(url, headers=headers, **kwargs)
 
-    def _get_time_period(self, billing_period=None):
+    def _get_time_period(self, billing_period=None, tidsintervall=None):
         """
         Skapar tidsperiod för rapporten baserat på konfiguration eller angiven period (YYYYMM).
         Args:
             billing_period (str, optional): Period i formatet 'YYYYMM'
+            tidsintervall (tuple, optional): (start, slut) som date, har företräde framför perioden
         Returns:
             GenerateDetailedCostReportTimePeriod
         """
-        if billing_period:
+        from azure.mgmt.costmanagement.models import GenerateDetailedCostReportTimePeriod
+        start_date, end_date = self._periodgranser(billing_period, tidsintervall)
+        return GenerateDetailedCostReportTimePeriod(
+            start=start_date.strftime("%Y-%m-%d"),
+            end=end_date.strftime("%Y-%m-%d")
+        )
+
+    def _periodgranser(self, billing_period=None, tidsintervall=None):
+        """
+        Första och sista dagen för tidsintervallet, perioden (YYYYMM) eller REPORT_TIME_PERIOD.
+        Returns:
+            tuple: (start, slut)
+        """
+        if tidsintervall:
+            start_date, end_date = tidsintervall
+        elif billing_period:
             # Omvandla YYYYMM till start och slut på månaden
             try:
                 start_date = datetime.strptime(billing_period, "%Y%m")
@@ -77,145 +2264,465 @@ class AzureCostProcessor:
                 start_date = start_date.replace(day=1)
             else:
                 raise ValueError(f"Okänd tidsperiod: {config.REPORT_TIME_PERIOD}")
+        return start_date, end_date
 
-        return GenerateDetailedCostReportTimePeriod(
-            start=start_date.strftime("%Y-%m-%d"),
-            end=end_date.strftime("%Y-%m-%d")
+    _operationer_lock = threading.Lock()
+
+    def _las_operationer(self):
+        try:
+            with open(config.RAPPORT_OPERATIONER_FIL, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _spara_operation(self, nyckel, operation=None):
+        """
+        Sparar (eller tar bort, om operation är None) en pågående rapportoperation så att
+        pollningen kan återupptas efter en omstart.
+        """
+        with self._operationer_lock:
+            operationer = self._las_operationer()
+            if operation is None:
+                operationer.pop(nyckel, None)
+            else:
+                operationer[nyckel] = operation
+            os.makedirs(os.path.dirname(config.RAPPORT_OPERATIONER_FIL) or ".", exist_ok=True)
+            with open(config.RAPPORT_OPERATIONER_FIL, "w", encoding="utf-8") as f:
+                json.dump(operationer, f, indent=2)
+
+    @staticmethod
+    def _operation_nyckel(billing_account_id, billing_period, tidsintervall=None):
+        if tidsintervall:
+            return f"{billing_account_id}:{tidsintervall[0]:%Y-%m-%d}_{tidsintervall[1]:%Y-%m-%d}"
+        return f"{billing_account_id}:{billing_period or config.REPORT_TIME_PERIOD}"
+
+    def _starta_rapport(self, billing_account_id, billing_period=None, tidsintervall=None):
+        """
+        Startar generering av en detaljerad kostnadsrapport utan att vänta på resultatet.
+        Finns en sparad, ej utgången operation för samma billing account och period
+        återupptas den i stället för att en ny rapport genereras.
+        Args:
+            billing_account_id (str): Billing account ID
+            billing_period (str, optional): Period i formatet 'YYYYMM'
+            tidsintervall (tuple, optional): (start, slut) som date i stället för hela perioden
+        Returns:
+            dict: Operation med operation_id, operation_result_url och retry_after, eller None
+        """
+        nyckel = self._operation_nyckel(billing_account_id, billing_period, tidsintervall)
+        sparad = self._las_operationer().get(nyckel)
+        if sparad:
+            startad = datetime.fromisoformat(sparad["startad"])
+            if datetime.now() - startad < timedelta(hours=config.RAPPORT_OPERATION_GILTIG_TIMMAR):
+                self.logger.info(f"Återupptar pågående rapportoperation {sparad['operation_id']} för {nyckel}")
+                return dict(sparad, nyckel=nyckel, retry_after=None)
+            self._spara_operation(nyckel, None)
+
+        from azure.mgmt.costmanagement.models import (
+            GenerateDetailedCostReportDefinition,
+            GenerateDetailedCostReportMetricType
         )
+        self.logger.info(f"Genererar detaljerad kostnadsrapport för billing account: {billing_account_id}")
+        report_definition = GenerateDetailedCostReportDefinition(
+            metric=GenerateDetailedCostReportMetricType.ACTUAL_COST,
+            time_period=self._get_time_period(billing_period, tidsintervall)
+        )
+        scope = f"/providers/Microsoft.Billing/billingAccounts/{billing_account_id}"
+        # Ingen pollning i SDK:n, operationen pollas av RapportPoller
+        result = self.cost_client.generate_detailed_cost_report.begin_create_operation(
+            scope=scope,
+            parameters=report_definition,
+            polling=False
+        )
+        # Extrahera Location-headern från initial response
+        initial_headers = result._polling_method._initial_response.http_response.headers
+        location_url = initial_headers.get("Location")
+        if not location_url:
+            self.logger.error("Kunde inte hitta Location-headern i initialt svar. Kan inte fortsätta.")
+            return None
+        if self.logger.level == logging.DEBUG:
+            self.logger.info(f"Location-header (operationStatus-URL): {location_url}")
+        else:
+            self.logger.info("Location-header mottagen (operationStatus-URL).")
+        match = re.search(r'/operationResults?/([\w-]+)', location_url)
+        if match:
+            operation_id = match.group(1)
+        else:
+            self.logger.error("Kunde inte extrahera operationId från Location-headern.")
+            return None
+        operation = {
+            "operation_id": operation_id,
+            "operation_result_url": f"https://management.azure.com/providers/Microsoft.Billing/billingAccounts/{billing_account_id}/providers/Microsoft.CostManagement/operationResults/{operation_id}?api-version=2021-10-01",
+            "startad": datetime.now().isoformat(),
+        }
+        self._spara_operation(nyckel, operation)
+        return dict(operation, nyckel=nyckel, retry_after=initial_headers.get("Retry-After"))
+
+    def skapa_rapport_poller(self, **kwargs):
+        """
+        Skapar en RapportPoller med inställningar från config som pollar via den
+        delade sessionen och token-cachen.
+        """
+        instellningar = dict(
+            initialt_intervall=config.POLL_INITIALT_INTERVALL,
+            max_intervall=config.POLL_MAX_INTERVALL,
+            deadline=config.POLL_DEADLINE,
+            http_get=self.session.get,
+            headers=self.token_cache.headers,
+        )
+        instellningar.update(kwargs)
+        return RapportPoller(self.logger, **instellningar)
+
+    def _vanta_pa_rapport(self, operation, poller=None):
+        """
+        Väntar på att en startad rapport blir klar och hämtar dess downloadUrl.
+        Returns:
+            str: URL till den genererade rapporten, eller None
+        """
+        self.logger.info("Väntar på att rapporten ska genereras...")
+        poller = poller or self.skapa_rapport_poller()
+        nyckel = operation.get("nyckel")
+        try:
+            report_url = poller.vanta(operation["operation_result_url"], operation["operation_id"], operation.get("retry_after"))
+        except TimeoutError:
+            # Operationen finns kvar sparad och kan återupptas vid nästa körning
+            raise
+        except Exception:
+            if nyckel:
+                self._spara_operation(nyckel, None)
+            raise
+        if nyckel:
+            self._spara_operation(nyckel, None)
+        self.logger.info(f"Pollningsmetriker: {poller.metriker.get(operation['operation_id'])}")
+        if not report_url:
+            self.logger.warning("Kunde inte hitta rapport-URL. Kontrollera loggen för operationResult-svaret.")
+        else:
+            if self.logger.level == logging.DEBUG:
+                self.logger.info(f"Rapport genererad framgångsrikt: {report_url}")
+            else:
+                self.logger.info("Rapport genererad framgångsrikt.")
+        return report_url
 
-    def generate_detailed_cost_report_billing_account(self, billing_account_id, billing_period=None):
+    def generate_detailed_cost_report_billing_account(self, billing_account_id, billing_period=None, tidsintervall=None):
         """
         Genererar en detaljerad kostnadsrapport för ett billing account.
         Args:
             billing_account_id (str): Billing account ID
             billing_period (str, optional): Period i formatet 'YYYYMM'
+            tidsintervall (tuple, optional): (start, slut) som date i stället för hela perioden
         Returns:
             str: URL till den genererade rapporten
         """
         try:
-            self.logger.info(f"Genererar detaljerad kostnadsrapport för billing account: {billing_account_id}")
-            report_definition = GenerateDetailedCostReportDefinition(
-                metric=GenerateDetailedCostReportMetricType.ACTUAL_COST,
-                time_period=self._get_time_period(billing_period)
-            )
-            scope = f"/providers/Microsoft.Billing/billingAccounts/{billing_account_id}"
-            result = self.cost_client.generate_detailed_cost_report.begin_create_operation(
-                scope=scope,
-                parameters=report_definition
-            )
-            self.logger.info("Väntar på att rapporten ska genereras...")
-            report_url = None
-            # Extrahera Location-headern från initial response
-            location_url = result._polling_method._initial_response.http_response.headers.get("Location")
-            if not location_url:
-                self.logger.error("Kunde inte hitta Location-headern i initialt svar. Kan inte fortsätta.")
-                return None
-            if self.logger.level == logging.DEBUG:
-                self.logger.info(f"Location-header (operationStatus-URL): {location_url}")
-            else:
-                self.logger.info("Location-header mottagen (operationStatus-URL).")
-            match = re.search(r'/operationResults?/([\w-]+)', location_url)
-            if match:
-                operation_id = match.group(1)
-            else:
-                self.logger.error("Kunde inte extrahera operationId från Location-headern.")
+            operation = self._starta_rapport(billing_account_id, billing_period, tidsintervall)
+            if operation is None:
                 return None
-            operation_result_url = f"https://management.azure.com/providers/Microsoft.Billing/billingAccounts/{billing_account_id}/providers/Microsoft.CostManagement/operationResults/{operation_id}?api-version=2021-10-01"
-            # Polling loop
-            while True:
-                time.sleep(10)
-                status = result.status()
-                self.logger.info(f"Rapportstatus: {status}")
-                if status in ["Succeeded", "Completed"]:
-                    # Hämta access token
-                    credential = DefaultAzureCredential()
-                    token = credential.get_token("https://management.azure.com/.default").token
-                    headers = {"Authorization": f"Bearer {token}"}
-                    response = requests.get(operation_result_url, headers=headers)
-                    if self.logger.level == logging.DEBUG:
-                        self.logger.info(f"Svar från operationResult-URL: {response.text}")
-                    else:
-                        self.logger.info("Svar mottaget från operationResult-URL.")
-                    if response.ok:
-                        data = response.json()
-                        report_url = data.get("properties", {}).get("downloadUrl")
-                        if report_url:
-                            if self.logger.level == logging.DEBUG:
-                                self.logger.info(f"Download URL till rapporten: {report_url}")
-                            else:
-                                self.logger.info("Download URL till rapporten mottagen.")
-                        else:
-                            self.logger.warning("Ingen downloadUrl hittades i operationResult-svaret.")
-                    else:
-                        self.logger.warning(f"Kunde inte hämta operationResult: {response.status_code} {response.text}")
-                    break
-                elif status == "Failed":
-                    raise Exception("Rapportgenerering misslyckades")
-            if not report_url:
-                self.logger.warning("Kunde inte hitta rapport-URL. Kontrollera loggen för operationResult-svaret.")
-            else:
-                if self.logger.level == logging.DEBUG:
-                    self.logger.info(f"Rapport genererad framgångsrikt: {report_url}")
-                else:
-                    self.logger.info("Rapport genererad framgångsrikt.")
-            return report_url
+            return self._vanta_pa_rapport(operation)
         except Exception as e:
             self.logger.error(f"Fel vid generering av detaljerad kostnadsrapport: {str(e)}")
             raise
 
-    def extract_tags(self, row):
-        # Standardvärden
-        row['BillingTag'] = ''
-        row['CostCenterTag'] = ''
-        row['BillingRGTag'] = ''
-        row['BillingProjTag'] = ''
-        row['BillingAktTag'] = ''
-        row['BillingKatTag'] = ''
-        row['BillingDescriptionTag'] = ''
-
-        # Hämta Tags och kontrollera att det är en giltig sträng
-        tags = row.get('Tags', '')
+    def skapa_kostnadsfraga(self, **kwargs):
+        """
+        Skapar en KostnadsFraga med inställningar från config som anropar Query API
+        via den delade sessionen och token-cachen.
+        """
+        instellningar = dict(
+            bas_url=config.QUERY_BAS_URL,
+            api_version=config.QUERY_API_VERSION,
+            max_forsok=config.QUERY_MAX_FORSOK,
+        )
+        instellningar.update(kwargs)
+        # Sessionen och inloggningen skapas bara om de inte skickats in
+        if "http_post" not in instellningar:
+            instellningar["http_post"] = self.session.post
+        if "headers" not in instellningar:
+            instellningar["headers"] = self.token_cache.headers
+        return KostnadsFraga(self.logger, **instellningar)
+
+    def hamta_aggregerad_kostnad(self, billing_account_id, billing_period=None, tidsintervall=None, fraga=None):
+        """
+        Hämtar kostnaden för ett billing account summerad per ResourceId och MeterId med
+        attributen i QUERY_ATTRIBUT och taggarna i TAG_KOLUMNER via Query API, i den
+        detaljerade rapportens format.
+        Args:
+            billing_account_id (str): Billing account ID
+            billing_period (str, optional): Period i formatet 'YYYYMM'
+            tidsintervall (tuple, optional): (start, slut) som date i stället för hela perioden
+            fraga (KostnadsFraga, optional): Frågeklient (standard: skapa_kostnadsfraga())
+        Returns:
+            pd.DataFrame: En rad per grupp med CostInBillingCurrency, Tags och periodkolumner
+        """
+        fraga = fraga or self.skapa_kostnadsfraga()
+        start, slut = self._periodgranser(billing_period, tidsintervall)
+        self.logger.info(f"Hämtar aggregerad kostnad för billing account {billing_account_id}, "
+                         f"{start:%Y-%m-%d} till {slut:%Y-%m-%d}")
+        scope = f"/providers/Microsoft.Billing/billingAccounts/{billing_account_id}"
+        with matningssteg("kostnadsfraga") as steg:
+            df = fraga.hamta_kostnad(scope, start, slut, config.QUERY_ATTRIBUT, TAG_NYCKLAR, config.QUERY_GRANULARITET)
+            steg["rader"] = len(df)
+        df["BillingAccountId"] = billing_account_id
+        df["BillingPeriodStartDate"] = pd.Timestamp(start.date())
+        df["BillingPeriodEndDate"] = pd.Timestamp(slut.date())
+        for kolumn in KATEGORI_KOLUMNER:
+            if kolumn in df.columns:
+                df[kolumn] = df[kolumn].astype('category')
+        return df
+
+    @med_korningsmatning
+    def process_aggregerad_kostnad(self, billing_account_id, billing_period=None, data_kolumner=None,
+                                   excel_filename=None, fraga=None):
+        """
+        Aggregerat läge: hämtar kostnaden summerad per resurs, mätare och taggar via
+        Query API i stället för att generera och ladda ner den detaljerade rapporten,
+        och skapar Kontering-, Pivot- och Summary-flikarna från de summerade raderna.
+        Args:
+            billing_account_id (str): Billing account ID
+            billing_period (str, optional): Period i formatet 'YYYYMM'
+            data_kolumner (list, optional): Kolumner för Data-fliken med de summerade raderna
+                (None = alla, tom lista = ingen Data-flik)
+            excel_filename (str, optional): Sökväg till Excel-filen
+            fraga (KostnadsFraga, optional): Frågeklient, t.ex. mot en fejkad endpoint
+        Returns:
+            pd.DataFrame: Summerade kostnadsrader med taggkolumner
+        """
+        try:
+            df = self.hamta_aggregerad_kostnad(billing_account_id, billing_period, fraga=fraga)
+            sammanfattning = self.skapa_sammanfattning()
+            with matningssteg("sammanfattning", len(df)):
+                sammanfattning.lagg_till(df)
+            self.logga_sammanfattning(sammanfattning)
+            with matningssteg("taggar", len(df)):
+                df = self.extract_tags_columns(df)
+            with matningssteg("resursinventering", len(df)):
+                df = self.komplettera_taggar(df)
+            with matningssteg("tagg_overrides", len(df)):
+                df = self.tillampa_tagg_overrides(df, self.skapa_tagg_override_index())
+            kontering = self.generate_konteringsrader(df, self.load_kontering_config())
+            period = (df['BillingPeriodStartDate'].min(), df['BillingPeriodEndDate'].max()) if len(df) else None
+            if not excel_filename:
+                _, period_suffix = self._rapportperiod(*(period or (None, None)))
+                excel_filename = os.path.join(config.EXCEL_OUTPUT_DIR,
+                                              f"azure_cost_report_aggregerad_{period_suffix}.xlsx")
+            data = df if data_kolumner is None else df[[col for col in data_kolumner if col in df.columns]]
+            self.export_to_excel(data, excel_filename, kontering=kontering, period=period,
+                                 sammanfattning=sammanfattning)
+            return df
+        except Exception as e:
+            self.logger.error(f"Fel vid aggregerad hämtning av kostnadsdata: {str(e)}")
+            raise
+
+    @staticmethod
+    def expandera_perioder(perioder):
+        """
+        Tolkar en periodlista som '202401,202403' eller intervall som '202401-202412'.
+        Returns:
+            list: Perioder i formatet 'YYYYMM'
+        """
+        resultat = []
+        for del_ in str(perioder).split(','):
+            del_ = del_.strip()
+            if not del_:
+                continue
+            if '-' in del_:
+                start_str, slut_str = [p.strip() for p in del_.split('-', 1)]
+                start = datetime.strptime(start_str, "%Y%m")
+                slut = datetime.strptime(slut_str, "%Y%m")
+                if slut < start:
+                    raise ValueError(f"Felaktigt periodintervall: {del_}")
+                while start <= slut:
+                    resultat.append(start.strftime("%Y%m"))
+                    start = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+            else:
+                datetime.strptime(del_, "%Y%m")
+                resultat.append(del_)
+        return resultat
+
+    def generate_reports_batch(self, billing_account_ids, perioder, max_parallella=None, **process_kwargs):
+        """
+        Genererar och bearbetar rapporter för flera billing accounts och perioder.
+        Alla rapportoperationer startas direkt, pollas parallellt och varje rapport
+        laddas ner och bearbetas så snart den är klar. Totaltiden blir därmed ungefär
+        den för den långsammaste rapporten.
+        Args:
+            billing_account_ids (list): Billing account ID:n
+            perioder (list): Perioder i formatet 'YYYYMM' (None = standardperiod)
+            max_parallella (int, optional): Max antal rapporter som pollas/bearbetas samtidigt
+            **process_kwargs: Skickas vidare till process_cost_data
+        Returns:
+            dict: {(billing_account_id, period): bearbetad DataFrame eller Exception}
+        """
+        max_parallella = max_parallella or config.BATCH_MAX_PARALLELLA
+        jobb = [(account, period) for account in billing_account_ids for period in (perioder or [None])]
+        self.logger.info(f"Startar {len(jobb)} rapportoperationer (max {max_parallella} parallellt)")
+
+        resultat = {}
+        startade = {}
+        for account, period in jobb:
+            try:
+                startade[(account, period)] = self._starta_rapport(account, period)
+            except Exception as e:
+                self.logger.error(f"Kunde inte starta rapport för {account} {period or 'standardperiod'}: {e}")
+                resultat[(account, period)] = e
+
+        def kor_jobb(account, period, operation):
+            if operation is None:
+                raise Exception("Rapportoperationen saknar operationId")
+            report_url = self._vanta_pa_rapport(operation, poller)
+            if not report_url:
+                raise Exception("Ingen rapport-URL mottagen")
+            namn = f"{account}_{period or 'standard'}"
+            return self.process_cost_data(
+                report_url,
+                excel_filename=os.path.join(config.EXCEL_OUTPUT_DIR, f"azure_cost_report_export_{namn}.xlsx"),
+                download_suffix=namn,
+                **process_kwargs,
+            )
+
+        # En gemensam poller så att latensmetrikerna för alla operationer samlas på ett ställe
+        poller = self.skapa_rapport_poller()
+        with ThreadPoolExecutor(max_workers=max_parallella) as executor:
+            futures = {
+                executor.submit(kor_jobb, account, period, operation): (account, period)
+                for (account, period), operation in startade.items()
+            }
+            for future in as_completed(futures):
+                account, period = futures[future]
+                try:
+                    resultat[(account, period)] = future.result()
+                    self.logger.info(f"Rapport klar för {account} {period or 'standardperiod'}")
+                except Exception as e:
+                    self.logger.error(f"Rapport misslyckades för {account} {period or 'standardperiod'}: {e}")
+                    resultat[(account, period)] = e
+        return resultat
+
+    @staticmethod
+    def _parse_tags(tags):
+        """
+        Tolkar en Tags-sträng till en tupel med värden i samma ordning som TAG_KOLUMNER.
+        Args:
+            tags: Värdet i Tags-kolumnen
+        Returns:
+            tuple: Ett värde per taggkolumn ('' om taggen saknas)
+        """
         if pd.isna(tags) or not isinstance(tags, str):
-            return row
+            return TOMMA_TAGGAR
 
         # Försök tolka som JSON
         try:
             tag_dict = json.loads(tags.replace("'", '"'))
+            values = dict.fromkeys(TAG_NYCKLAR, '')
             # Hantera olika möjliga nycklar (case-insensitive)
             for k, v in tag_dict.items():
                 key = k.lower()
-                if key == 'billing':
-                    row['BillingTag'] = str(v)
-                elif key == 'costcenter':
-                    row['CostCenterTag'] = str(v)
-                elif key == 'billing-rg':
-                    row['BillingRGTag'] = str(v)
-                elif key == 'billing-proj':
-                    row['BillingProjTag'] = str(v)
-                elif key == 'billing-akt':
-                    row['BillingAktTag'] = str(v)
-                elif key == 'billing-kat':
-                    row['BillingKatTag'] = str(v)
-                elif key == 'billing-description':
-                    row['BillingDescriptionTag'] = str(v)
+                if key in values:
+                    values[key] = str(v)
+            return tuple(values.values())
         except Exception:
             # Fallback: regex för "key": "value"
-            def extract_regex(tag, s):
-                try:
-                    import re
-                    match = re.search(rf'"{tag}"\s*:\s*"([^"]+)"', s, re.IGNORECASE)
-                    return match.group(1) if match else ''
-                except Exception:
-                    return ''
-            row['BillingTag'] = extract_regex('Billing', tags)
-            row['CostCenterTag'] = extract_regex('costcenter', tags)
-            row['BillingRGTag'] = extract_regex('Billing-RG', tags)
-            row['BillingProjTag'] = extract_regex('Billing-proj', tags)
-            row['BillingAktTag'] = extract_regex('Billing-akt', tags)
-            row['BillingKatTag'] = extract_regex('Billing-kat', tags)
-            row['BillingDescriptionTag'] = extract_regex('Billing-description', tags)
+            values = []
+            for pattern in TAG_REGEX:
+                match = pattern.search(tags)
+                values.append(match.group(1) if match else '')
+            return tuple(values)
+
+    def extract_tags(self, row):
+        tags = row.get('Tags', '')
+        for (_, kolumn), value in zip(TAG_KOLUMNER, self._parse_tags(tags)):
+            row[kolumn] = value
         return row
 
+    def extract_tags_columns(self, df, tag_cache=None):
+        """
+        Extraherar samtliga taggkolumner kolumnvis. Varje unik Tags-sträng tolkas
+        endast en gång och resultatet sprids ut till alla rader med samma sträng.
+        Ger samma värden som extract_tags applicerad rad för rad. Många nya
+        Tags-strängar tolkas i processpoolen om PARALLELLA_PROCESSER är satt.
+        Args:
+            df (pd.DataFrame): Kostnadsdata med kolumnen Tags
+            tag_cache (dict, optional): Redan tolkade Tags-strängar, delas mellan chunkar
+        Returns:
+            pd.DataFrame: Samma DataFrame med taggkolumnerna tillagda
+        """
+        codes, uniques = pd.factorize(df['Tags'])
+        nya = list(uniques) if tag_cache is None else [tags for tags in uniques if tags not in tag_cache]
+        parallell = self.parallell
+        if parallell is not None and parallell.lonar_sig(nya):
+            tolkade = parallell.tolka_taggar(nya)
+        else:
+            tolkade = [self._parse_tags(tags) for tags in nya]
+        if tag_cache is None:
+            parsed = tolkade
+        else:
+            tag_cache.update(zip(nya, tolkade))
+            parsed = [tag_cache[tags] for tags in uniques]
+        # Saknade värden får kod -1 och pekar därmed på den tomma tupeln sist i listan
+        parsed.append(TOMMA_TAGGAR)
+        for idx, (_, kolumn) in enumerate(TAG_KOLUMNER):
+            # Taggkolumnerna blir kategorier: koderna per unik Tags-sträng slås upp per rad
+            kat_koder, kategorier = pd.factorize(np.array([p[idx] for p in parsed], dtype=object))
+            df[kolumn] = pd.Categorical.from_codes(kat_koder[codes], categories=kategorier)
+        return df
+
+    def komplettera_taggar(self, df):
+        """
+        Fyller tomma taggkolumner med taggar från resursinventeringen (config.RESURSINVENTERING),
+        där resurser ärver taggar från resursgrupp och föräldraresurs. Taggar i
+        kostnadsexporten har företräde och tagg-overrides appliceras efteråt.
+        """
+        if not config.RESURSINVENTERING or df.empty or 'ResourceId' not in df.columns:
+            return df
+        inventering = self.resursinventering
+        codes, uniques = pd.factorize(df['ResourceId'])
+        per_resurs = [inventering.taggar(resource_id) for resource_id in uniques]
+        per_resurs.append({})
+        antal = 0
+        for nyckel, kolumn in TAG_KOLUMNER:
+            varden = np.array([taggar.get(nyckel, "") for taggar in per_resurs], dtype=object)[codes]
+            if kolumn in df.columns:
+                nuvarande = df[kolumn].astype(object).fillna("").to_numpy()
+            else:
+                nuvarande = np.full(len(df), "", dtype=object)
+            fyll = (nuvarande == "") & (varden != "")
+            if fyll.any():
+                df[kolumn] = pd.Categorical(np.where(fyll, varden, nuvarande))
+                antal += int(fyll.sum())
+        if antal:
+            self.logger.info(f"{antal} saknade taggvärden ifyllda från resursinventeringen")
+        return df
+
+    def load_tag_overrides(self, path="tag_overrides.json"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f).get("overrides", [])
+        except Exception as e:
+            self.logger.info(f"Kunde inte läsa tagg-overrides: {e}")
+            return []
+
+    def skapa_tagg_override_index(self):
+        """
+        Skapar ett TaggOverrideIndex med mönster och giltighetsintervall kompilerade en gång.
+        """
+        index = TaggOverrideIndex(self.load_tag_overrides())
+        for warning in index.warnings:
+            self.logger.warning(warning)
+        return index
+
+    def tillampa_tagg_overrides(self, df, index):
+        """
+        Applicerar tagg-overrides på taggkolumnerna efter taggextraheringen.
+        Args:
+            df (pd.DataFrame): Kostnadsdata med taggkolumner, ResourceId och Date
+            index (TaggOverrideIndex): Kompilerade overrides
+        Returns:
+            pd.DataFrame: Samma DataFrame med overrides applicerade
+        """
+        if index.overrides and 'Date' not in df.columns:
+            self.logger.warning("Kolumnen 'Date' saknas, tagg-overrides kan inte appliceras!")
+        df, antal = index.tillampa(df)
+        if antal:
+            self.logger.info(f"Tagg-overrides applicerade på {antal} taggvärden")
+        return df
+
     def load_resource_kontering_config(self, path="kontering_resource_config.json"):
         try:
             with open(path, "r", encoding="utf-8") as f:
@@ -225,9 +2732,11 @@ class AzureCostProcessor:
             return []
 
     def hitta_konteringsregel(self, resource_id, regler):
+        if isinstance(regler, KonteringsregelIndex):
+            return regler.hitta(resource_id)
         for regel in regler:
             for pattern in regel.get("resource_ids", []):
-                if glob.fnmatch.fnmatch(str(resource_id).lower(), str(pattern).lower()):
+                if fnmatch.fnmatch(str(resource_id).lower(), str(pattern).lower()):
                     return regel
         return None
 
@@ -254,184 +2763,311 @@ class AzureCostProcessor:
                 "godkant_av": "John Munthe"
             }
 
+    def skapa_konteringsackumulator(self, config):
+        """
+        Skapar en Konteringsackumulator med resursreglerna kompilerade en gång.
+        """
+        return Konteringsackumulator(config, self.skapa_regelindex(), self.parallell)
+
+    def skapa_regelindex(self):
+        """
+        Kompilerar resursreglerna och fyller i de sparade regeltilldelningar
+        (config.REGELTILLDELNING_CACHE) som fortfarande gäller, så att endast nya
+        ResourceId och ResourceId vars utfall en regeländring kan ha påverkat matchas.
+        """
+        regel_index = KonteringsregelIndex(self.load_resource_kontering_config())
+        if config.REGELTILLDELNING_CACHE:
+            ateranvanda, omprovas = Regeltilldelning(config.REGELTILLDELNING_CACHE).tillampa(regel_index)
+            if omprovas:
+                self.logger.info(f"Resursreglerna har ändrats: {ateranvanda} sparade regeltilldelningar "
+                                 f"återanvänds, {omprovas} ResourceId matchas om")
+        return regel_index
+
+    def spara_regeltilldelning(self, regel_index):
+        """
+        Sparar regeltilldelningen per ResourceId till nästa körning.
+        """
+        if config.REGELTILLDELNING_CACHE:
+            Regeltilldelning(config.REGELTILLDELNING_CACHE).spara(regel_index)
+
     def generate_konteringsrader(self, df, config):
-        rows = []
-        warnings = []
-        resource_kontering_regler = self.load_resource_kontering_config()
-
-        def build_kontering_row(kontering_src, belopp, kommentar, godkant_av):
-            """
-            Bygger en konteringsrad enligt reglerna:
-            - Endast en av rg eller konproj ska vara satt per rad.
-            - Om båda är satta: logga varning, men behandla raden som projektkontering.
-            - Om rg är satt (rörelsegrenskontering):
-                RG = rg
-                Kon/Proj = projkat
-                ProjKat lämnas tom
-            - Om konproj är satt (projektkontering):
-                Kon/Proj = konproj
-                ProjKat = projkat
-                RG lämnas tom
-            """
-            konproj_val = str(kontering_src.get("konproj", "") or "").strip()
-            rg_val = str(kontering_src.get("rg", "") or "").strip()
-            akt_val = str(kontering_src.get("akt", "") or "").strip()
-            projakt_val = str(kontering_src.get("projakt", "") or "").strip()
-            projkat_val = str(kontering_src.get("projkat", "") or "").strip()
-
-            # Bestäm typ av kontering
-            if konproj_val and rg_val:
-                warnings.append(
-                    f"Konteringsregel har både konproj och rg satta (konproj={konproj_val}, rg={rg_val}). "
-                    "Behandlar som projektkontering."
-                )
-                rg_out = ""
-                konproj_out = konproj_val
-                projkat_out = projkat_val
-            elif konproj_val:
-                rg_out = ""
-                konproj_out = konproj_val
-                projkat_out = projkat_val
-            elif rg_val:
-                rg_out = rg_val
-                konproj_out = projkat_val
-                projkat_out = ""
-            else:
-                # Fallback om varken rg eller konproj är satt: lägg kontot i Kon/Proj
-                rg_out = ""
-                konproj_out = projkat_val
-                projkat_out = ""
+        """
+        Skapar konteringsrader kolumnvis för hela df.
+        Args:
+            df (pd.DataFrame): Kostnadsdata med taggkolumner
+            config (dict): Konteringskonfiguration (kontering_config.json)
+        Returns:
+            tuple: (kontering_df, warnings)
+        """
+        ackumulator = self.skapa_konteringsackumulator(config)
+        ackumulator.lagg_till(df)
+        self.spara_regeltilldelning(ackumulator.regel_index)
+        return ackumulator.resultat()
 
-            return {
-                "Kon/Proj": konproj_out,
-                "_empty1": "",
-                "RG": rg_out,
-                "Aktivitet": akt_val,
-                "ProjAkt": projakt_val,
-                "ProjKat": projkat_out,
-                "_empty2": "",
-                "Netto": belopp,
-                "Godkänt av": godkant_av,
-                "KommentarBeskrivning": kommentar or ""
-            }
+    def skapa_sammanfattning(self):
+        """
+        Skapar en Kostnadssammanfattning för dimensionerna i config.SAMMANFATTNING_DIMENSIONER.
+        """
+        return Kostnadssammanfattning(config.SAMMANFATTNING_DIMENSIONER)
 
-        for _, row in df.iterrows():
-            resource_id = row.get("ResourceId", "")
-            regel = self.hitta_konteringsregel(resource_id, resource_kontering_regler)
-            if regel:
-                kontering = build_kontering_row(
-                    regel,
-                    belopp=row.get("CostInBillingCurrency", 0),
-                    kommentar=regel.get("beskrivning", ""),
-                    godkant_av=config.get("godkant_av", "John Munthe"),
-                )
-                rows.append(kontering)
-                continue
-            # DevOps-logik
-            if row.get('MeterCategory') == "Azure DevOps":
-                devops = config.get("devops", {})
-                mapping = devops.get("default", {})
-                mappings = devops.get("mappings", [])
-                subcat = row.get("MeterSubCategory", "")
-                metername = row.get("MeterName", "")
-                for m in mappings:
-                    if m.get("subcat", "").strip().lower() == subcat.strip().lower() and m.get("metername", "").strip().lower() == metername.strip().lower():
-                        mapping = m
-                        break
-                kommentar_beskrivning = mapping.get("beskrivning") or f"Avser Azure DevOps: {subcat} ({metername})"
-                kontering = build_kontering_row(
-                    mapping,
-                    belopp=row.get("CostInBillingCurrency", 0),
-                    kommentar=kommentar_beskrivning,
-                    godkant_av=config.get("godkant_av", "John Munthe"),
-                )
-                rows.append(kontering)
-                continue
-            # Uppsamlingskontering
-            upps = config.get("uppsamlingskontering", {})
-            kommentar_beskrivning = upps.get("beskrivning") or row.get("BillingDescriptionTag", "") or "Ingen beskrivning angiven"
-            kontering = build_kontering_row(
-                upps,
-                belopp=row.get("CostInBillingCurrency", 0),
-                kommentar=kommentar_beskrivning,
-                godkant_av=config.get("godkant_av", "John Munthe"),
+    def logga_sammanfattning(self, sammanfattning):
+        """
+        Loggar totalsumma och antal värden per dimension. Subtotalerna skrivs till
+        fliken Summary i Excel-filen.
+        """
+        for kolumn in sammanfattning.saknade_kolumner():
+            self.logger.warning(f"Kolumnen '{kolumn}' saknas i rapporten!")
+        if sammanfattning.kostnadskolumn in sammanfattning.kolumner:
+            self.logger.info(
+                f"\nTOTALSUMMA för {sammanfattning.kostnadskolumn}: {sammanfattning.total:,.2f} "
+                f"({sammanfattning.antal_rader} rader)\n"
             )
-            rows.append(kontering)
+        for dimension in sammanfattning.dimensioner:
+            if dimension in sammanfattning.kolumner:
+                self.logger.info(f"Subtotaler per {dimension}: {len(sammanfattning.subtotaler(dimension))} värden")
 
-        # Definiera kolumnordning med unika tomma kolumner
-        kolumner = [
-            "Kon/Proj", "_empty1", "RG", "Aktivitet", "ProjAkt", "ProjKat", "_empty2", "Netto", "Godkänt av", "KommentarBeskrivning"
-        ]
+    @staticmethod
+    def _rapportperiod(start_min, end_max):
+        """
+        Skapar periodtext och filnamnssuffix från minsta BillingPeriodStartDate och
+        största BillingPeriodEndDate.
+        Returns:
+            tuple: (period_str, period_suffix)
+        """
+        if start_min is None or end_max is None:
+            period_str = "Period okänd (BillingPeriodStartDate/BillingPeriodEndDate saknas)"
+            period_suffix = datetime.now().strftime('%Y-%m')
+        else:
+            start = pd.to_datetime(start_min).strftime('%Y-%m-%d')
+            end = pd.to_datetime(end_max).strftime('%Y-%m-%d')
+            period_str = f"Denna rapport gäller perioden: {start} till {end}"
+            # För filnamn: YYYY-MM
+            period_suffix = pd.to_datetime(start_min).strftime('%Y-%m')
+        return period_str, period_suffix
 
-        # Skapa DataFrame även om rows är tom
-        kontering_df = pd.DataFrame(rows, columns=kolumner)
+    def _write_data_sheet(self, writer, workbook, df):
+        """
+        Skriver df till fliken Data som Excel-tabell med filter och valutaformat.
+        """
+        df.to_excel(writer, sheet_name='Data', index=False, header=True, startrow=0)
+        worksheet_data = writer.sheets['Data']
+        (max_row, max_col) = df.shape
 
-        # Gruppera och summera per relevant kombination om det finns rader
-        if not kontering_df.empty:
-            def group_key(row):
-                if str(row["Kon/Proj"]).startswith("P."):
-                    return (row["Kon/Proj"], row["Aktivitet"], row["ProjKat"], row["Godkänt av"])
+        def excel_col(n):
+            s = ''
+            while n >= 0:
+                s = chr(n % 26 + ord('A')) + s
+                n = n // 26 - 1
+            return s
+
+        last_col = excel_col(max_col - 1)
+        table_range = f"A1:{last_col}{max_row+1}"
+
+        currency_format = workbook.add_format({'num_format': '#,##0.00 "kr"'})
+        if 'CostInBillingCurrency' in df.columns:
+            col_idx = df.columns.get_loc('CostInBillingCurrency')
+            col_letter = excel_col(col_idx)
+            worksheet_data.set_column(f'{col_letter}:{col_letter}', None, currency_format)
+
+        worksheet_data.add_table(table_range, {
+            'name': 'Data',
+            'columns': [{'header': col} for col in df.columns],
+            'autofilter': True
+        })
+
+    def _write_data_sheet_streaming(self, workbook, df, sheet_name='Data', start=0, stop=None):
+        """
+        Skriver raderna start:stop i df till ett Data-blad rad för rad med typade
+        xlsxwriter-anrop per kolumn. Fungerar i constant_memory-läge, där Excel-tabeller
+        inte stöds: bladet får i stället autofilter.
+        Returns:
+            worksheet: Det skrivna bladet
+        """
+        stop = len(df) if stop is None else stop
+        worksheet = workbook.add_worksheet(sheet_name)
+        currency_format = workbook.add_format({'num_format': '#,##0.00 "kr"'})
+        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+
+        def write_text(row, col, value):
+            if isinstance(value, str):
+                worksheet.write_string(row, col, value)
+            else:
+                worksheet.write(row, col, value)
+
+        def write_date(row, col, value):
+            worksheet.write_number(row, col, value, date_format)
+
+        def nummer_eller_none(values):
+            values = values.astype(object)
+            values[~np.isfinite(values.astype(float))] = None
+            return values.tolist()
+
+        # Förbered en skrivfunktion och en värdelista per kolumn; tomma värden blir None
+        kolumner = []
+        for col_idx, col in enumerate(df.columns):
+            serie = df[col].iloc[start:stop]
+            if pd.api.types.is_bool_dtype(serie.dtype):
+                values = serie.astype(object).where(serie.notna(), None).tolist()
+                write = worksheet.write_boolean
+            elif pd.api.types.is_numeric_dtype(serie.dtype):
+                values = nummer_eller_none(serie.to_numpy(dtype=float, na_value=np.nan))
+                write = worksheet.write_number
+            elif pd.api.types.is_datetime64_any_dtype(serie.dtype):
+                # Datum skrivs som Excel-serienummer (dagar sedan 1899-12-30) med datumformat
+                dagar = (serie.dt.tz_localize(None) if serie.dt.tz is not None else serie) - pd.Timestamp('1899-12-30')
+                values = nummer_eller_none((dagar / pd.Timedelta(days=1)).to_numpy(dtype=float, na_value=np.nan))
+                write = write_date
+            else:
+                values = serie.astype(object).where(serie.notna(), None).tolist()
+                if pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty"):
+                    write = worksheet.write_string
                 else:
-                    return (row["RG"], row["Aktivitet"], row["Kon/Proj"], row["Godkänt av"])
-            kontering_df["_group"] = kontering_df.apply(group_key, axis=1)
-            grouped = kontering_df.groupby("_group", dropna=False).agg({
-                "Kon/Proj": "first",
-                "_empty1": "first",
-                "RG": "first",
-                "Aktivitet": "first",
-                "ProjAkt": "first",
-                "ProjKat": "first",
-                "_empty2": "first",
-                "Netto": "sum",
-                "Godkänt av": "first",
-                "KommentarBeskrivning": lambda x: x.iloc[0] if (x.nunique() == 1) else "Ingen beskrivning angiven"
-            }).reset_index(drop=True)
-            kontering_df = grouped
-            # Filtrera bort rader där Netto = 0
-            kontering_df = kontering_df[kontering_df["Netto"] != 0]
-        # Summeringsrad
-        total = kontering_df["Netto"].sum() if not kontering_df.empty else 0
-        sumrad = {col: "" for col in kontering_df.columns}
-        sumrad["Netto"] = total
-        sumrad["Kon/Proj"] = "SUMMA"
-        kontering_df = pd.concat([kontering_df, pd.DataFrame([sumrad])], ignore_index=True)
-        return kontering_df, warnings
+                    write = write_text
+            kolumner.append((col_idx, write, values))
+            if col == 'CostInBillingCurrency':
+                worksheet.set_column(col_idx, col_idx, None, currency_format)
+
+        for col_idx, col in enumerate(df.columns):
+            worksheet.write_string(0, col_idx, str(col))
+        for row_idx in range(stop - start):
+            excel_row = row_idx + 1
+            for col_idx, write, values in kolumner:
+                value = values[row_idx]
+                if value is not None:
+                    write(excel_row, col_idx, value)
+        worksheet.autofilter(0, 0, stop - start, max(len(df.columns) - 1, 0))
+        return worksheet
+
+    def _write_data_sheets(self, writer, workbook, df, filename, motor, overflow):
+        """
+        Skriver Data-fliken med vald motor. Data som inte ryms inom Excels radgräns
+        delas upp på flera blad (overflow="blad") eller skrivs i sin helhet till en
+        Parquet-/CSV-fil bredvid Excel-filen (overflow="parquet"/"csv").
+        """
+        max_data_rader = EXCEL_MAX_RADER - 1
+        if motor == "tabell" and len(df) <= max_data_rader:
+            self._write_data_sheet(writer, workbook, df)
+            return
+
+        delar = [(0, len(df))]
+        if len(df) > max_data_rader:
+            if overflow in ("parquet", "csv"):
+                companion = f"{os.path.splitext(filename)[0]}_data.{overflow}"
+                if overflow == "parquet":
+                    df.to_parquet(companion, index=False)
+                else:
+                    df.to_csv(companion, index=False)
+                self.logger.warning(
+                    f"Data överskrider Excels radgräns ({len(df)} rader). Data-fliken innehåller de första "
+                    f"{max_data_rader} raderna, all data finns i {companion}"
+                )
+                delar = [(0, max_data_rader)]
+            else:
+                delar = [(start, min(start + max_data_rader, len(df))) for start in range(0, len(df), max_data_rader)]
+                self.logger.info(f"Data överskrider Excels radgräns, delas upp på {len(delar)} blad.")
 
-    def export_to_excel(self, df, filename=None):
+        last_col = xl_col_to_name(max(len(df.columns) - 1, 0))
+        for nr, (start, stop) in enumerate(delar, 1):
+            sheet_name = 'Data' if nr == 1 else f'Data{nr}'
+            self._write_data_sheet_streaming(workbook, df, sheet_name, start, stop)
+            if nr == 1:
+                # Namngivet område så att pivotinstruktionen (Tabell/område = Data) fungerar utan Excel-tabell
+                workbook.define_name('Data', f"='{sheet_name}'!$A$1:${last_col}${stop - start + 1}")
+
+    def _write_summary_sheet(self, workbook, sammanfattning):
+        """
+        Skriver fliken Summary: totalsumma, antal rader och en tabell med subtotaler
+        per dimension, sorterade efter summa. Raderna skrivs i ordning så att fliken
+        fungerar även med den strömmande motorn.
+        """
+        worksheet = workbook.add_worksheet('Summary')
+        bold_format = workbook.add_format({'bold': True})
+        currency_format = workbook.add_format({'num_format': '#,##0.00 "kr"'})
+        worksheet.set_column(0, 0, 45)
+        worksheet.set_column(1, 2, 18)
+        worksheet.write(0, 0, f"Totalsumma {sammanfattning.kostnadskolumn}", bold_format)
+        worksheet.write_number(0, 1, sammanfattning.total, currency_format)
+        worksheet.write(1, 0, "Antal rader", bold_format)
+        worksheet.write_number(1, 1, sammanfattning.antal_rader)
+        rad = 3
+        for dimension in sammanfattning.dimensioner:
+            if dimension not in sammanfattning.kolumner:
+                continue
+            tabell = sammanfattning.subtotaler(dimension)
+            for col_idx, rubrik in enumerate(tabell.columns):
+                worksheet.write(rad, col_idx, rubrik, bold_format)
+            for varde, summa, antal in tabell.itertuples(index=False):
+                rad += 1
+                worksheet.write_string(rad, 0, str(varde))
+                worksheet.write_number(rad, 1, summa, currency_format)
+                worksheet.write_number(rad, 2, antal)
+            rad += 2
+        return worksheet
+
+    def _valj_data_motor(self, df, motor=None):
+        """
+        Väljer motor för Data-fliken: "tabell" (Excel-tabell via pandas) eller
+        "strömmande" (xlsxwriter i constant_memory-läge). "auto" väljer strömmande
+        för stora DataFrames.
+        """
+        motor = motor or config.EXCEL_DATA_MOTOR
+        if motor == "auto":
+            motor = "tabell" if len(df) <= config.EXCEL_TABELL_MAX_RADER else "strömmande"
+        if motor not in ("tabell", "strömmande"):
+            raise ValueError(f"Okänd motor för Data-fliken: {motor}")
+        if motor == "tabell" and len(df) > EXCEL_MAX_RADER - 1:
+            self.logger.warning("Data överskrider Excels radgräns, använder strömmande motor för Data-fliken.")
+            motor = "strömmande"
+        return motor
+
+    def export_to_excel(self, df, filename=None, kontering=None, period=None, data_motor=None, data_overflow=None,
+                        sammanfattning=None):
         """
-        Exporterar data till en Excel-fil med tre flikar:
+        Exporterar data till en Excel-fil med flikarna:
         - Kontering (med periodinfo överst och konteringstabell)
         - Pivot (instruktion för pivottabell)
+        - Summary (totalsumma och subtotaler, om sammanfattning anges)
         - Data (hela DataFrame som Excel-tabell med filter och valutaformat)
+        Args:
+            df (pd.DataFrame): Data för Data-fliken
+            filename (str, optional): Sökväg till Excel-filen
+            kontering (tuple, optional): Färdig (kontering_df, warnings), t.ex. från strömmande inläsning
+            period (tuple, optional): (minsta BillingPeriodStartDate, största BillingPeriodEndDate)
+            data_motor (str, optional): "tabell", "strömmande" eller "auto" (standard från config)
+            data_overflow (str, optional): "blad", "parquet" eller "csv" för data över Excels radgräns
+            sammanfattning (Kostnadssammanfattning, optional): Totalsumma och subtotaler för fliken Summary
         """
-        import pandas as pd
-        from datetime import datetime
-
         # Hämta period från BillingPeriodStartDate och BillingPeriodEndDate
-        if 'BillingPeriodStartDate' in df.columns and 'BillingPeriodEndDate' in df.columns:
-            start = pd.to_datetime(df['BillingPeriodStartDate'].min()).strftime('%Y-%m-%d')
-            end = pd.to_datetime(df['BillingPeriodEndDate'].max()).strftime('%Y-%m-%d')
-            period_str = f"Denna rapport gäller perioden: {start} till {end}"
-            # För filnamn: YYYY-MM
-            period_suffix = pd.to_datetime(df['BillingPeriodStartDate'].min()).strftime('%Y-%m')
-        else:
-            period_str = "Period okänd (BillingPeriodStartDate/BillingPeriodEndDate saknas)"
-            period_suffix = datetime.now().strftime('%Y-%m')
+        if period is None and 'BillingPeriodStartDate' in df.columns and 'BillingPeriodEndDate' in df.columns:
+            period = (df['BillingPeriodStartDate'].min(), df['BillingPeriodEndDate'].max())
+        period_str, period_suffix = self._rapportperiod(*(period or (None, None)))
 
         # Sätt filnamn om det inte är angivet
         if not filename:
-            filename = f"reports/azure_cost_report_export_{period_suffix}.xlsx"
+            filename = os.path.join(config.EXCEL_OUTPUT_DIR, f"azure_cost_report_export_{period_suffix}.xlsx")
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        if aktiv_matning() is not None:
+            aktiv_matning().excel_fil = filename
 
         # Läs in konteringskonfiguration från fil
         kontering_config = self.load_kontering_config()
 
         # Skapa konteringstabell
-        kontering_df, warnings = self.generate_konteringsrader(df, kontering_config)
+        if kontering is None:
+            kontering = self.generate_konteringsrader(df, kontering_config)
+        kontering_df, warnings = kontering
         if warnings:
             for w in warnings:
                 self.logger.warning(w)
 
-        with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
+        data_motor = self._valj_data_motor(df, data_motor)
+        data_overflow = data_overflow or config.EXCEL_DATA_OVERFLOW
+        # Strömmande motor: xlsxwriter skriver rad för rad till disk i stället för att hålla hela boken i minnet
+        engine_kwargs = {'options': {'constant_memory': True}} if data_motor == "strömmande" else {}
+
+        # Steget excel omfattar även när xlsxwriter skriver filen till disk när boken stängs
+        with matningssteg("excel", len(df)), \
+                pd.ExcelWriter(filename, engine='xlsxwriter', engine_kwargs=engine_kwargs) as writer:
             # Flik 1: Kontering (med periodinfo överst och konteringstabell)
             workbook  = writer.book
             worksheet_konter = workbook.add_worksheet('Kontering')
@@ -466,86 +3102,453 @@ class AzureCostProcessor:
                 "5. Dra t.ex. CostCenterTag till Rader och CostInBillingCurrency till Värden.\n"
                 "Du kan sedan utforska datat fritt!"
             )
-            worksheet_pivot.write(0, 0, instruktion, wrap_format)
             worksheet_pivot.set_column(0, 0, 60)  # Sätt kolumnbredd till 60 tecken
             worksheet_pivot.set_row(0, 120)  # Sätt radhöjd till 120 pixlar
+            worksheet_pivot.write(0, 0, instruktion, wrap_format)
 
-            # Flik 3: Data (hela DataFrame som tabell)
-            df.to_excel(writer, sheet_name='Data', index=False, header=True, startrow=0)
-            worksheet_data = writer.sheets['Data']
-            (max_row, max_col) = df.shape
-
-            def excel_col(n):
-                s = ''
-                while n >= 0:
-                    s = chr(n % 26 + ord('A')) + s
-                    n = n // 26 - 1
-                return s
-
-            last_col = excel_col(max_col - 1)
-            table_range = f"A1:{last_col}{max_row+1}"
-
-            currency_format = workbook.add_format({'num_format': '#,##0.00 "kr"'})
-            if 'CostInBillingCurrency' in df.columns:
-                col_idx = df.columns.get_loc('CostInBillingCurrency')
-                col_letter = excel_col(col_idx)
-                worksheet_data.set_column(f'{col_letter}:{col_letter}', None, currency_format)
-
-            worksheet_data.add_table(table_range, {
-                'name': 'Data',
-                'columns': [{'header': col} for col in df.columns],
-                'autofilter': True
-            })
+            # Flik 3: Summary (totalsumma och subtotaler per dimension)
+            if sammanfattning is not None:
+                writer.sheets['Summary'] = self._write_summary_sheet(workbook, sammanfattning)
+
+            # Flik 4: Data (hela DataFrame som tabell)
+            if len(df.columns):
+                with matningssteg("excel_data", len(df)):
+                    self._write_data_sheets(writer, workbook, df, filename, data_motor, data_overflow)
 
         self.logger.info(f"Excel-fil skapad: {filename}")
 
-        # Efter att kontering_df och warnings skapats i export_to_excel:
-        # ...
         # Generera kommentarer för inklistring i Medius
         print("\nKommentarer för inklistring i Medius:")
+        for idx, kommentar in enumerate(self.medius_kommentarer(kontering_df, period_str), 1):
+            print(f"{idx}. {kommentar}")
+
+    @staticmethod
+    def medius_kommentarer(kontering_df, period_str):
+        """
+        Skapar kommentarer för inklistring i Medius, en per konteringsrad (utom
+        summeringsraden). Rader utan gemensam beskrivning får kommentaren från
+        gruppens unika BillingDescriptionTag, som samlats in vid grupperingen.
+        Returns:
+            list: Kommentarer i samma ordning som konteringsraderna
+        """
         # Hämta periodinfo
         period = period_str.replace("Denna rapport gäller perioden: ", "")
-        # Skriv ut kommentarerna numrerat direkt från kontering_df (utom summeringsraden)
-        for idx, row in enumerate(kontering_df.iloc[:-1].itertuples(index=False), 1):
-            kommentar = getattr(row, "KommentarBeskrivning", "")
-            # Om kommentaren är "Ingen beskrivning angiven", försök hitta unika BillingDescriptionTag i matchande rader
+        kommentarer = []
+        for kommentar, descs in zip(kontering_df["KommentarBeskrivning"].iloc[:-1], kontering_df["_beskrivningar"].iloc[:-1]):
+            # Om kommentaren är "Ingen beskrivning angiven", använd gruppens unika BillingDescriptionTag
             if kommentar == "Ingen beskrivning angiven":
-                row_dict = row._asdict()
-                kon_proj = row_dict.get("Kon/Proj")
-                aktivitet = row_dict.get("Aktivitet")
-                projkat = row_dict.get("ProjKat")
-                godkant_av = row_dict.get("Godkänt av")
-                rg = row_dict.get("RG")
-                # Hitta matchande rader i df för denna konteringsrad
-                if str(kon_proj).startswith("P."):
-                    group = (kon_proj, aktivitet, projkat, godkant_av)
-                elif rg:
-                    group = (rg, aktivitet, kon_proj, godkant_av)
-                else:
-                    group = (rg, aktivitet, projkat, godkant_av)
-                # Hämta matchande rader ur df (ursprungsdata)
-                match_rows = df.copy()
-                match_rows["_group"] = match_rows.apply(lambda r: (f"P.{r['BillingProjTag']}" if str(r.get("BillingProjTag", "")).startswith("P.") or str(r.get("BillingProjTag", "")).isdigit() else r.get("BillingRGTag", ""), r.get("BillingAktTag", ""), r.get("BillingKatTag", ""), kontering_config.get("godkant_av", "John Munthe")), axis=1)
-                match_rows = match_rows[match_rows["_group"] == group]
-                descs = match_rows["BillingDescriptionTag"].dropna().unique()
-                descs = [d for d in descs if d and str(d).strip() != ""]
+                descs = list(descs)
                 if len(descs) == 1:
                     kommentar = f"Avser: {descs[0]}"
                 elif len(descs) > 1:
                     kommentar = f"Flera beskrivningar: {', '.join(descs)}"
-                else:
-                    kommentar = f"Ingen beskrivning angiven"
             # Lägg bara till perioden om den inte redan finns i kommentaren
             if "period:" not in kommentar:
                 kommentar = f"{kommentar}, period: {period}"
-            print(f"{idx}. {kommentar}")
+            kommentarer.append(kommentar)
+        return kommentarer
+
+    def _read_cost_csv(self, file_to_process, kolumner=None, **kwargs):
+        """
+        Läser in rapportfilen (gzip eller vanlig CSV). file_to_process kan vara en
+        sökväg eller en binär ström, t.ex. från en pågående nedladdning. Med chunksize
+        i kwargs returneras en iterator över DataFrame-chunkar.
+        Kolumnerna typas enligt KOSTNAD_SCHEMA redan vid inläsningen, och med
+        kolumner angivet läses bara de kolumnerna in.
+        """
+        # Kontrollera om filen är gzip-komprimerad genom att läsa de första bytena
+        if isinstance(file_to_process, str):
+            with open(file_to_process, 'rb') as f:
+                magic = f.read(2)
+            self.logger.info(f"Läser in CSV-data från {file_to_process}")
+        else:
+            magic = file_to_process.peek(2)[:2]
+            self.logger.info("Läser in CSV-data medan rapporten laddas ner")
+
+        kwargs.setdefault('dtype', KOSTNAD_SCHEMA)
+        if kolumner is not None:
+            kolumner = set(kolumner)
+            kwargs['usecols'] = lambda kolumn: kolumn in kolumner
+
+        # Läs in CSV-filen med rätt inställningar
+        if magic == b'\x1f\x8b':  # gzip magic number
+            self.logger.info("Filen är gzip-komprimerad")
+            resultat = pd.read_csv(file_to_process, compression='gzip', **kwargs)
+        else:
+            self.logger.info("Filen är en vanlig CSV-fil")
+            if not isinstance(file_to_process, str):
+                file_to_process = io.TextIOWrapper(file_to_process, encoding='utf-8-sig')
+            resultat = pd.read_csv(file_to_process, encoding='utf-8-sig', **kwargs)
+        if isinstance(resultat, pd.DataFrame):
+            return self._tolka_datum(resultat)
+        return (self._tolka_datum(chunk) for chunk in resultat)
+
+    def _tolka_datum(self, df):
+        """
+        Tolkar datumkolumnerna som datetime. Kolumnerna är kategorier efter inläsningen,
+        så varje unikt datum tolkas bara en gång.
+        """
+        for col in DATUM_KOLUMNER:
+            if col not in df.columns or pd.api.types.is_datetime64_any_dtype(df[col]):
+                continue
+            try:
+                if isinstance(df[col].dtype, pd.CategoricalDtype):
+                    # Saknade värden har kod -1 och pekar därmed på NaT sist i indexet
+                    datum = pd.DatetimeIndex(pd.to_datetime(df[col].cat.categories)).append(
+                        pd.DatetimeIndex([pd.NaT]))
+                    df[col] = datum.take(df[col].cat.codes.to_numpy())
+                else:
+                    df[col] = pd.to_datetime(df[col])
+            except (ValueError, TypeError) as e:
+                self.logger.warning(f"Kunde inte tolka {col} som datum, behåller text: {e}")
+        return df
+
+    @staticmethod
+    def konkatenera(delar):
+        """
+        Slår ihop DataFrame-delar (chunkar eller dagar). Kategorikolumner vars
+        kategorier skiljer sig mellan delarna förblir kategorier med unionen av
+        kategorierna, i stället för att falla tillbaka till object.
+        """
+        if not delar:
+            return pd.DataFrame()
+        df = pd.concat(delar, ignore_index=True)
+        for kolumn in df.columns:
+            serier = [del_[kolumn] for del_ in delar if kolumn in del_.columns]
+            if (not isinstance(df[kolumn].dtype, pd.CategoricalDtype) and len(serier) == len(delar)
+                    and all(isinstance(serie.dtype, pd.CategoricalDtype) for serie in serier)):
+                df[kolumn] = union_categoricals(serier)
+        return df
+
+    def bearbetningskolumner(self, data_kolumner):
+        """
+        Kolumner som behöver läsas in från rapporten för bearbetning, sammanfattning,
+        kostnadslager och Data-fliken. None betyder att alla kolumner behövs.
+        """
+        if data_kolumner is None:
+            return None
+        kolumner = (BEARBETNING_KOLUMNER + list(config.SAMMANFATTNING_DIMENSIONER) + ['Tags']
+                    + [kolumn for _, kolumn in TAG_KOLUMNER] + list(data_kolumner))
+        if config.KOSTNADSLAGER:
+            kolumner += list(Kostnadslager.KOLUMNER)
+        return list(dict.fromkeys(kolumner))
+
+    @staticmethod
+    def _kallfil_hash(path):
+        """
+        Beräknar SHA-256 för rapportfilens innehåll.
+        """
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def _typa_kostnadsdata(self, df):
+        """
+        Typar kostnadsdata för Parquet-cachen enligt KOSTNAD_SCHEMA och delar upp
+        Tags i taggkolumner. Kategorier som inte används i df tas bort.
+        """
+        for col in KATEGORI_KOLUMNER:
+            if col not in df.columns:
+                continue
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].cat.remove_unused_categories()
+            else:
+                df[col] = df[col].astype('category')
+        df = self._tolka_datum(df)
+        if 'Tags' in df.columns:
+            df = self.extract_tags_columns(df)
+        return df
+
+    def _parquet_cache_path(self, file_to_process, filhash):
+        return f"{file_to_process}.{filhash[:16]}.parquet"
+
+    def _las_parquet_cache(self, file_to_process, kolumner=None):
+        """
+        Läser rapporten från Parquet-cachen om det finns en cache för filens
+        nuvarande innehåll.
+        Args:
+            file_to_process (str): Sökväg till rapportfilen
+            kolumner (list, optional): Kolumner att läsa (None = alla)
+        Returns:
+            pd.DataFrame eller None om cache saknas
+        """
+        cache_path = self._parquet_cache_path(file_to_process, self._kallfil_hash(file_to_process))
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            if kolumner is not None:
+                import pyarrow.parquet as pq
+                tillgangliga = pq.read_schema(cache_path).names
+                kolumner = [col for col in tillgangliga if col in set(kolumner)]
+            df = pd.read_parquet(cache_path, columns=kolumner)
+        except ImportError:
+            self.logger.warning("pyarrow saknas, kan inte läsa Parquet-cachen.")
+            return None
+        self.logger.info(f"Läste rapport från Parquet-cache {cache_path}")
+        return df
+
+    def _skapa_parquet_cache(self, file_to_process, df):
+        """
+        Sparar typad kostnadsdata som Parquet-cache bredvid rapportfilen, nycklad på
+        filens innehållshash. Äldre cachefiler för samma rapport tas bort.
+        Returns:
+            pd.DataFrame: Den typade DataFrame:n
+        """
+        df = self._typa_kostnadsdata(df)
+        cache_path = self._parquet_cache_path(file_to_process, self._kallfil_hash(file_to_process))
+        try:
+            df.to_parquet(cache_path, index=False)
+        except ImportError:
+            self.logger.warning("pyarrow saknas, ingen Parquet-cache skapas.")
+            return df
+        for gammal in glob.glob(f"{glob.escape(file_to_process)}.*.parquet"):
+            if gammal != cache_path:
+                os.remove(gammal)
+        self.logger.info(f"Parquet-cache skapad: {cache_path}")
+        return df
+
+    def _process_cost_data_streaming(self, file_to_process, chunksize, data_kolumner=None, excel_filename=None):
+        """
+        Bearbetar rapportfilen chunkvis. Taggextrahering och regelmatchning körs per
+        chunk och resultaten viks in i löpande aggregat (totalsumma, subtotaler och
+        konteringsgrupper), så att minnesåtgången styrs av chunkstorleken.
+        Args:
+            file_to_process (str): Sökväg till rapportfilen, eller binär ström från en pågående nedladdning
+            chunksize (int): Antal rader per chunk
+            data_kolumner (list, optional): Kolumner som sparas för Data-fliken.
+                None sparar alla kolumner, en tom lista hoppar över Data-fliken.
+            excel_filename (str, optional): Sökväg till Excel-filen
+        Returns:
+            pd.DataFrame: Sparade kolumner för Data-fliken
+        """
+        ackumulator = self.skapa_konteringsackumulator(self.load_kontering_config())
+        sammanfattning = self.skapa_sammanfattning()
+        period_start = period_end = None
+        kolumner = None
+        tag_cache = {}
+        data_delar = []
+        lager = self.kostnadslager()
+        ersatta = set()
+        override_index = self.skapa_tagg_override_index()
+
+        chunkar = self._read_cost_csv(file_to_process, self.bearbetningskolumner(data_kolumner), chunksize=chunksize)
+        for chunk in self._matt_chunkar(chunkar, "inlasning"):
+            if kolumner is None:
+                kolumner = list(chunk.columns)
+            with matningssteg("sammanfattning", len(chunk)):
+                sammanfattning.lagg_till(chunk)
+            if 'BillingPeriodStartDate' in chunk.columns and 'BillingPeriodEndDate' in chunk.columns:
+                chunk_start = chunk['BillingPeriodStartDate'].min()
+                chunk_end = chunk['BillingPeriodEndDate'].max()
+                period_start = chunk_start if period_start is None else min(period_start, chunk_start)
+                period_end = chunk_end if period_end is None else max(period_end, chunk_end)
+            if 'Tags' in chunk.columns:
+                with matningssteg("taggar", len(chunk)):
+                    chunk = self.extract_tags_columns(chunk, tag_cache)
+            with matningssteg("resursinventering", len(chunk)):
+                chunk = self.komplettera_taggar(chunk)
+            with matningssteg("tagg_overrides", len(chunk)):
+                chunk = self.tillampa_tagg_overrides(chunk, override_index)
+            ackumulator.lagg_till(chunk)
+            if lager:
+                self.spara_i_kostnadslager(lager, chunk, ackumulator, ersatta)
+            if data_kolumner is None:
+                data_delar.append(chunk)
+            elif data_kolumner:
+                data_delar.append(chunk[[col for col in data_kolumner if col in chunk.columns]])
+            self.logger.info(f"Chunk bearbetad. Antal rader hittills: {ackumulator.antal_rader}")
+
+        kolumner = kolumner or []
+        self.spara_regeltilldelning(ackumulator.regel_index)
+        self.logger.info(f"CSV-data inläst framgångsrikt. Antal rader: {ackumulator.antal_rader}")
+        self.logga_sammanfattning(sammanfattning)
+        if 'Tags' not in kolumner:
+            self.logger.warning("Kolumnen 'Tags' saknas i rapporten!")
+
+        with matningssteg("sammanslagning"):
+            df = self.konkatenera(data_delar)
+        period = (period_start, period_end) if period_start is not None else None
+        self.export_to_excel(df, excel_filename, kontering=ackumulator.resultat(), period=period,
+                             sammanfattning=sammanfattning)
+        return df
+
+    def _las_rapport(self, file_to_process, kolumner=None):
+        """
+        Läser en rapportfil, från Parquet-cachen om den finns. Parquet-cachen skapas vid
+        första inläsningen och ska innehålla alla kolumner, annars läses bara kolumner.
+        """
+        df = None
+        if config.PARQUET_CACHE:
+            with matningssteg("inlasning_parquet") as steg:
+                df = self._las_parquet_cache(file_to_process, kolumner)
+                steg["rader"] = None if df is None else len(df)
+        if df is None:
+            with matningssteg("inlasning") as steg:
+                df = self._read_cost_csv(file_to_process, None if config.PARQUET_CACHE else kolumner)
+                steg["rader"] = len(df)
+            self.logger.info(f"CSV-data inläst framgångsrikt. Antal rader: {len(df)}")
+            if config.PARQUET_CACHE:
+                with matningssteg("parquet_cache", len(df)):
+                    df = self._skapa_parquet_cache(file_to_process, df)
+        return df
+
+    @staticmethod
+    def rapport_tidpunkt(path):
+        """
+        När rapporten skapades: tidsstämpeln i filnamnet för nedladdade rapporter,
+        annars filens ändringstid.
+        """
+        traff = RAPPORT_TIDSSTAMPEL.search(os.path.basename(path))
+        if traff:
+            try:
+                return datetime.strptime(traff.group(1), "%Y%m%d_%H%M%S")
+            except ValueError:
+                pass
+        return datetime.fromtimestamp(os.path.getmtime(path))
+
+    @staticmethod
+    def radnycklar(df, kolumner):
+        """
+        Stabil 64-bitars nyckel per rad, hashad kolumnvis över kolumner. Samma värden
+        ger samma nyckel oavsett fil, radordning och kategorikodning.
+        """
+        return pd.util.hash_pandas_object(df[kolumner], index=False, categorize=False).to_numpy()
+
+    def sla_ihop_rapporter(self, filer, kolumner=None):
+        """
+        Slår ihop rapportfiler med överlappande perioder, t.ex. Last30Days och en
+        månadsrapport, till en DataFrame utan dubblerade kostnadsrader.
+
+        Varje rad får en nyckel hashad över RADNYCKEL_KOLUMNER. Rapporterna ordnas
+        efter när de skapades, och för varje nyckel behålls raderna från den senaste
+        rapport som innehåller nyckeln: en senare omräkning ersätter tidigare värden.
+        Rader med samma nyckel inom en och samma rapport behålls alla. Nycklarna
+        grupperas en gång för alla rapporter, så tiden växer linjärt med antalet rader.
+        Args:
+            filer (list): Rapportfiler (.csv eller .csv.gz)
+            kolumner (list, optional): Kolumner att läsa in utöver radnyckelns (None = alla)
+        Returns:
+            pd.DataFrame: Sammanslagen kostnadsdata, redo för taggextrahering och kontering
+        """
+        filer = sorted(filer, key=self.rapport_tidpunkt)
+        if kolumner is not None:
+            kolumner = list(dict.fromkeys(list(kolumner) + RADNYCKEL_KOLUMNER))
+        delar = [self._las_rapport(fil, kolumner) for fil in filer]
+        nyckelkolumner = [kol for kol in RADNYCKEL_KOLUMNER if all(kol in df.columns for df in delar)]
+        if not nyckelkolumner:
+            raise ValueError("Rapporterna saknar gemensamma kolumner för radnyckeln")
+        saknade = [kol for kol in RADNYCKEL_KOLUMNER if kol not in nyckelkolumner and any(kol in df.columns for df in delar)]
+        if saknade:
+            self.logger.warning(f"Kolumnerna {saknade} finns inte i alla rapporter och ingår inte i radnyckeln")
+
+        with matningssteg("deduplicering", sum(len(df) for df in delar)):
+            nycklar = np.concatenate([self.radnycklar(df, nyckelkolumner) for df in delar])
+            rapport_nr = np.repeat(np.arange(len(delar)), [len(df) for df in delar])
+            # Senaste rapporten per nyckel, via en hashbaserad gruppering över alla rader
+            senaste = pd.Series(rapport_nr).groupby(nycklar, sort=False).transform("max").to_numpy()
+            behall = np.split(rapport_nr == senaste, np.cumsum([len(df) for df in delar])[:-1])
+            for fil, df, mask in zip(filer, delar, behall):
+                self.logger.info(f"{os.path.basename(fil)}: {int(mask.sum())} av {len(df)} rader behålls")
+            df = self.konkatenera([df[mask] for df, mask in zip(delar, behall)])
+        self.logger.info(f"{len(filer)} rapporter sammanslagna: {len(df)} rader, "
+                         f"{len(nycklar) - len(df)} rader ersatta av senare rapporter")
+        return df
+
+    @staticmethod
+    def _matt_chunkar(chunkar, namn):
+        """
+        Mäter inläsningen av varje chunk som ett steg, utan bearbetningen däremellan.
+        """
+        chunkar = iter(chunkar)
+        while True:
+            with matningssteg(namn) as steg:
+                chunk = next(chunkar, None)
+                steg["rader"] = None if chunk is None else len(chunk)
+            if chunk is None:
+                return
+            yield chunk
+
+    def kostnadslager(self):
+        """
+        Kostnadslagret enligt config.KOSTNADSLAGER, eller None om lagret inte används.
+        """
+        return Kostnadslager(config.KOSTNADSLAGER) if config.KOSTNADSLAGER else None
+
+    def spara_i_kostnadslager(self, lager, df, ackumulator, ersatta=None):
+        """
+        Skriver taggade kostnadsrader med tilldelad kontering till kostnadslagret.
+        Args:
+            lager (Kostnadslager): Lagret att skriva till
+            df (pd.DataFrame): Kostnadsdata med taggkolumner
+            ackumulator (Konteringsackumulator): Ger konteringen per rad
+            ersatta (set, optional): Partitioner som redan ersatts under körningen (vid chunkvis skrivning)
+        """
+        if df.empty:
+            return
+        rader = pd.DataFrame(index=df.index)
+        for kolumn in Kostnadslager.KOLUMNER:
+            if kolumn in df.columns:
+                rader[kolumn] = df[kolumn]
+        rader["BillingAccountId"] = rader["BillingAccountId"].astype(object).fillna("").astype(str) if "BillingAccountId" in rader else ""
+        periodkolumn = "BillingPeriodStartDate" if "BillingPeriodStartDate" in df.columns else "Date"
+        if periodkolumn not in df.columns:
+            self.logger.warning("Period saknas i rapporten (BillingPeriodStartDate/Date), raderna sparas inte i kostnadslagret.")
+            return
+        rader["Period"] = pd.to_datetime(df[periodkolumn]).dt.strftime("%Y%m")
+        if "Date" in df.columns:
+            rader["Date"] = pd.to_datetime(df["Date"]).dt.strftime("%Y-%m-%d")
+        with matningssteg("regelmatchning", len(df)):
+            kontering = ackumulator.konteringskolumner(df)
+        rader["KonProj"] = kontering["Kon/Proj"]
+        for kolumn in ("RG", "Aktivitet", "ProjKat"):
+            rader[kolumn] = kontering[kolumn]
+        with matningssteg("kostnadslager", len(rader)):
+            lager.skriv(rader, ersatta)
+        self.logger.info(f"{len(rader)} rader sparade i kostnadslagret {lager.path}")
+
+    @staticmethod
+    def fraga_kostnadslager(grupper=("Period",), filtrering=None, perioder=None):
+        """
+        Aggregat över perioder ur kostnadslagret, t.ex. trenden för ett projekt:
+        fraga_kostnadslager(("Period",), {"KonProj": "P.98116002"}, ("202401", "202412")).
+        Returns:
+            pd.DataFrame: grupperna, Kostnad och Rader
+        """
+        if not config.KOSTNADSLAGER or not os.path.exists(config.KOSTNADSLAGER):
+            raise ValueError("Kostnadslagret saknas. Ange KOSTNADSLAGER i config.py och bearbeta rapporter först.")
+        return Kostnadslager(config.KOSTNADSLAGER).aggregera(grupper, filtrering, perioder)
+
+    def _rapport_destination(self, report_url, download_suffix=None):
+        """
+        Filnamn för en nedladdad rapport i reports-mappen: namn efter datum, eller
+        samma fil som en avbruten nedladdning av samma rapport så att den återupptas.
+        """
+        # Skapa reports-mappen om den inte finns
+        reports_dir = "reports"
+        os.makedirs(reports_dir, exist_ok=True)
+        local_filename = self.nedladdare.pagaende_destination(report_url, reports_dir)
+        if not local_filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            namn = f"{timestamp}_{download_suffix}" if download_suffix else timestamp
+            local_filename = os.path.join(reports_dir, f"azure_cost_report_{namn}.csv.gz")
+        return local_filename
 
-    def process_cost_data(self, report_url=None, local_file_path=None):
+    @med_korningsmatning
+    def process_cost_data(self, report_url=None, local_file_path=None, chunksize=None, data_kolumner=None,
+                          excel_filename=None, download_suffix=None):
         """
         Bearbetar kostnadsdata från den detaljerade rapporten.
         Args:
             report_url (str, optional): URL till den genererade rapporten
-            local_file_path (str, optional): Sökväg till en befintlig rapportfil
+            local_file_path (str eller list, optional): Sökväg till en befintlig rapportfil, eller flera
+                rapportfiler som slås ihop utan dubbletter (se sla_ihop_rapporter)
+            chunksize (int, optional): Läs och bearbeta rapporten strömmande i chunkar om så många rader
+            data_kolumner (list, optional): Kolumner som sparas för Data-fliken. Vid läsning från
+                Parquet-cachen läses endast dessa och de kolumner bearbetningen behöver.
+            excel_filename (str, optional): Sökväg till Excel-filen (standard: namn efter perioden)
+            download_suffix (str, optional): Suffix i namnet på den nedladdade filen, t.ex. vid parallella körningar
         Returns:
             pd.DataFrame: Bearbetad data i konteringsformat
         """
@@ -553,21 +3556,20 @@ class AzureCostProcessor:
             self.logger.info("Bearbetar kostnadsdata från detaljerad rapport")
             
             if report_url:
-                # Skapa reports-mappen om den inte finns
-                reports_dir = "reports"
-                os.makedirs(reports_dir, exist_ok=True)
-                
-                # Generera filnamn baserat på datum
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                local_filename = os.path.join(reports_dir, f"azure_cost_report_{timestamp}.csv.gz")
+                local_filename = self._rapport_destination(report_url, download_suffix)
                 
-                # Ladda ner filen
+                # Ladda ner filen (downloadUrl är en SAS-URL och ska inte ha Authorization-header)
                 self.logger.info(f"Laddar ner rapport till {local_filename}")
-                with requests.get(report_url, stream=True) as r:
-                    r.raise_for_status()
-                    with open(local_filename, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            f.write(chunk)
+                nedladdning = self.nedladdare.starta(report_url, local_filename)
+                if chunksize:
+                    # Strömmande läge: tolka CSV-datat medan filen laddas ner
+                    with nedladdning.oppna() as strom:
+                        df = self._process_cost_data_streaming(strom, chunksize, data_kolumner, excel_filename)
+                    nedladdning.vanta()
+                    self.logger.info(f"Rapport nedladdad framgångsrikt till {local_filename}")
+                    return df
+                with matningssteg("nedladdning"):
+                    nedladdning.vanta()
                 self.logger.info(f"Rapport nedladdad framgångsrikt till {local_filename}")
                 
                 file_to_process = local_filename
@@ -576,55 +3578,61 @@ class AzureCostProcessor:
             else:
                 raise ValueError("Antingen report_url eller local_file_path måste anges")
 
-            # Kontrollera om filen är gzip-komprimerad genom att läsa de första bytena
-            with open(file_to_process, 'rb') as f:
-                magic = f.read(2)
-            
-            # Läs in CSV-filen med rätt inställningar
-            self.logger.info(f"Läser in CSV-data från {file_to_process}")
-            if magic == b'\x1f\x8b':  # gzip magic number
-                self.logger.info("Filen är gzip-komprimerad")
-                df = pd.read_csv(file_to_process, compression='gzip')
+            if isinstance(file_to_process, (list, tuple)):
+                if len(file_to_process) == 1:
+                    file_to_process = file_to_process[0]
+                elif chunksize:
+                    self.logger.info("Flera rapporter slås ihop i minnet, chunksize används inte")
+                    chunksize = None
+            if chunksize:
+                return self._process_cost_data_streaming(file_to_process, chunksize, data_kolumner, excel_filename)
+
+            if isinstance(file_to_process, (list, tuple)):
+                df = self.sla_ihop_rapporter(file_to_process, self.bearbetningskolumner(data_kolumner))
             else:
-                self.logger.info("Filen är en vanlig CSV-fil")
-                # Öppna filen explicit i textläge med UTF-8 encoding
-                with open(file_to_process, 'r', encoding='utf-8-sig') as f:
-                    df = pd.read_csv(f)
-            
-            self.logger.info(f"CSV-data inläst framgångsrikt. Antal rader: {len(df)}")
+                df = self._las_rapport(file_to_process, self.bearbetningskolumner(data_kolumner))
             
             # Skriv ut kolumnnamnen för att se vad vi har att arbeta med
             # logger.info("Tillgängliga kolumner i rapporten:")
             # for col in df.columns:
             #     logger.info(f"- {col}")
 
-            # Summera hela kolumnen CostInBillingCurrency
-            if 'CostInBillingCurrency' in df.columns:
-                total_cost = df['CostInBillingCurrency'].sum()
-                self.logger.info(f"\nTOTALSUMMA för CostInBillingCurrency: {total_cost:,.2f}\n")
-            else:
-                self.logger.warning("Kolumnen 'CostInBillingCurrency' saknas i rapporten!")
-
-            # Subtotaler per ResourceGroup, MeterCategory och SubscriptionName
-            for group_col in ['ResourceGroup', 'MeterCategory', 'SubscriptionName']:
-                if group_col in df.columns:
-                    self.logger.info(f"\nSUBTOTALER per {group_col}:")
-                    subtotals = df.groupby(group_col)['CostInBillingCurrency'].sum().sort_values(ascending=False)
-                    for name, subtotal in subtotals.items():
-                        self.logger.info(f"  {name}: {subtotal:,.2f}")
-                else:
-                    self.logger.warning(f"Kolumnen '{group_col}' saknas i rapporten!")
+            # Totalsumma, antal rader och subtotaler per dimension i en gruppering
+            sammanfattning = self.skapa_sammanfattning()
+            with matningssteg("sammanfattning", len(df)):
+                sammanfattning.lagg_till(df)
+            self.logga_sammanfattning(sammanfattning)
 
             # Extrahera costcenter-taggen ur Tags-kolumnen
-            if 'Tags' in df.columns:
+            if all(kolumn in df.columns for _, kolumn in TAG_KOLUMNER):
+                self.logger.info("\nTaggar redan uppdelade i Parquet-cachen.")
+            elif 'Tags' in df.columns:
                 self.logger.info("\nExtraherar taggar ur Tags-kolumnen...")
-                # Använd apply med extract_tags för att extrahera alla taggar
-                df = df.apply(lambda row: self.extract_tags(row), axis=1)
+                # Tolka varje unik Tags-sträng en gång och fyll i taggkolumnerna kolumnvis
+                with matningssteg("taggar", len(df)):
+                    df = self.extract_tags_columns(df)
             else:
                 self.logger.warning("Kolumnen 'Tags' saknas i rapporten!")
+            with matningssteg("resursinventering", len(df)):
+                df = self.komplettera_taggar(df)
+            with matningssteg("tagg_overrides", len(df)):
+                df = self.tillampa_tagg_overrides(df, self.skapa_tagg_override_index())
+
+            lager = self.kostnadslager()
+            if lager:
+                self.spara_i_kostnadslager(lager, df, self.skapa_konteringsackumulator(self.load_kontering_config()))
 
             # Efter bearbetning: exportera till Excel
-            self.export_to_excel(df)
+            if data_kolumner is not None:
+                kontering = self.generate_konteringsrader(df, self.load_kontering_config())
+                period = None
+                if 'BillingPeriodStartDate' in df.columns and 'BillingPeriodEndDate' in df.columns:
+                    period = (df['BillingPeriodStartDate'].min(), df['BillingPeriodEndDate'].max())
+                df = df[[col for col in data_kolumner if col in df.columns]]
+                self.export_to_excel(df, excel_filename, kontering=kontering, period=period,
+                                     sammanfattning=sammanfattning)
+            else:
+                self.export_to_excel(df, excel_filename, sammanfattning=sammanfattning)
 
             # Här kommer vi senare att lägga till kod för att bearbeta datan
             # För nu returnerar vi bara DataFrame
@@ -634,19 +3642,757 @@ class AzureCostProcessor:
             self.logger.error(f"Fel vid bearbetning av kostnadsdata: {str(e)}")
             raise
 
+    @contextlib.contextmanager
+    def korning(self, namn, **parametrar):
+        """
+        Mäter en körning med Korningsmatning. Stegen loggas när körningen är klar och
+        körningsrapporten sparas som JSON bredvid Excel-filen (<excel>_korning.json),
+        eller i EXCEL_OUTPUT_DIR om ingen Excel-fil skapades.
+        """
+        if aktiv_matning() is not None:
+            yield aktiv_matning()
+            return
+        matning = Korningsmatning(self.logger, namn, config.PROFILERING, parametrar).starta()
+        _AKTIV_MATNING.matning = matning
+        try:
+            yield matning
+        except Exception as e:
+            matning.fel = str(e)
+            raise
+        finally:
+            _AKTIV_MATNING.matning = None
+            matning.avsluta()
+            matning.logga()
+            if config.KORNINGSRAPPORT:
+                if matning.excel_fil:
+                    path = f"{os.path.splitext(matning.excel_fil)[0]}_korning.json"
+                else:
+                    path = os.path.join(config.EXCEL_OUTPUT_DIR, f"korning_{matning.tidpunkt:%Y%m%d_%H%M%S}.json")
+                try:
+                    self.logger.info(f"Körningsrapport sparad: {matning.spara(path)}")
+                except OSError as e:
+                    self.logger.warning(f"Kunde inte spara körningsrapporten: {e}")
+
+    @staticmethod
+    def inkrementellt_intervall(billing_period, sedda_dagar, omrakning_dagar, idag=None):
+        """
+        Datumintervall att hämta i inkrementellt läge: från periodens början, eller från
+        de senaste omrakning_dagar redan bearbetade dagarna (Azure räknar om nyliga dagar
+        i efterhand), till och med idag eller periodens slut.
+        Args:
+            billing_period (str): Period i formatet 'YYYYMM'
+            sedda_dagar (iterable): Redan bearbetade dagar som 'YYYY-MM-DD'
+            omrakning_dagar (int): Antal redan bearbetade dagar som hämtas igen
+            idag (date, optional): Dagens datum (standard: idag)
+        Returns:
+            tuple: (start, slut) som date
+        """
+        start = datetime.strptime(billing_period, "%Y%m").date()
+        nasta = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+        slut = min(nasta - timedelta(days=1), idag or datetime.now().date())
+        if sedda_dagar:
+            senaste = datetime.strptime(max(sedda_dagar), "%Y-%m-%d").date()
+            start = max(start, min(senaste + timedelta(days=1) - timedelta(days=omrakning_dagar), slut))
+        return start, slut
+
+    @staticmethod
+    def _regler_hash(kontering_config, resource_regler, tagg_overrides=()):
+        return hashlib.sha256(
+            json.dumps([kontering_config, resource_regler, list(tagg_overrides)], sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    @med_korningsmatning
+    def process_cost_data_inkrementell(self, billing_account_id=None, billing_period=None, local_file_path=None,
+                                       data_kolumner=None, excel_filename=None, full_omrakning=False):
+        """
+        Inkrementell bearbetning av en period. Ett persistent tillstånd per dag
+        (DagligtTillstand) håller taggade kostnadsrader och konteringsaggregat för
+        redan bearbetade dagar. Endast dagar som saknas i tillståndet eller vars innehåll
+        har ändrats (omräknade av Azure) taggas och konteras, och periodens totaler och
+        Kontering-flik byggs av dagaggregaten i datumordning. Kontering och Summary blir
+        identiska med full_omrakning, då tillståndet raderas och hela perioden bearbetas om,
+        och med process_cost_data för en rapport med samma rader. Data-fliken och gruppernas
+        BillingDescriptionTag (Flera beskrivningar i Medius) följer datumordning.
+        Args:
+            billing_account_id (str, optional): Billing account ID, krävs om rapporten ska hämtas från Azure
+            billing_period (str, optional): Period i formatet 'YYYYMM' (standard: innevarande månad)
+            local_file_path (str, optional): Befintlig rapportfil att läsa in i stället för att hämta från Azure
+            data_kolumner (list, optional): Kolumner för Data-fliken (None = alla, [] = ingen Data-flik)
+            excel_filename (str, optional): Sökväg till Excel-filen
+            full_omrakning (bool): Radera tillståndet och bearbeta om hela perioden
+        Returns:
+            pd.DataFrame: Data för Data-fliken för hela perioden
+        """
+        try:
+            billing_period = billing_period or datetime.now().strftime("%Y%m")
+            namn = f"{billing_account_id or 'lokal'}_{billing_period}"
+            katalog = self._inkrementell_katalog(billing_account_id, billing_period)
+            if full_omrakning and os.path.isdir(katalog):
+                self.logger.info(f"Full omräkning: raderar inkrementellt tillstånd i {katalog}")
+                shutil.rmtree(katalog)
+            tillstand = DagligtTillstand(katalog)
+
+            tidsintervall = None
+            if local_file_path:
+                file_to_process = local_file_path
+            elif billing_account_id:
+                tidsintervall = self.inkrementellt_intervall(
+                    billing_period, tillstand.dagar, config.INKREMENTELL_OMRAKNING_DAGAR
+                )
+                self.logger.info(
+                    f"Hämtar dagarna {tidsintervall[0]:%Y-%m-%d} till {tidsintervall[1]:%Y-%m-%d} "
+                    f"({len(tillstand.dagar)} dagar redan bearbetade)"
+                )
+                report_url = self.generate_detailed_cost_report_billing_account(
+                    billing_account_id, billing_period, tidsintervall
+                )
+                if not report_url:
+                    raise Exception("Ingen rapport-URL mottagen")
+                file_to_process = self._rapport_destination(report_url, f"{namn}_delta")
+                self.logger.info(f"Laddar ner rapport till {file_to_process}")
+                self.nedladdare.ladda_ner(report_url, file_to_process)
+            else:
+                raise ValueError("Antingen billing_account_id eller local_file_path måste anges")
+
+            regler = self._inkrementella_regler()
+
+            with matningssteg("inlasning") as steg:
+                df = self._read_cost_csv(file_to_process)
+                steg["rader"] = len(df)
+            self.logger.info(f"CSV-data inläst framgångsrikt. Antal rader: {len(df)}")
+            if 'Date' not in df.columns:
+                raise ValueError("Kolumnen 'Date' krävs för inkrementell bearbetning")
+            datum = pd.to_datetime(df['Date'], errors='coerce')
+            ogiltiga = datum.isna()
+            if ogiltiga.any():
+                # Rader utan dag hamnar inte i någon grupp och skulle annars försvinna ur periodens totaler
+                exempel = ", ".join(repr(v) for v in df.loc[ogiltiga, 'Date'].astype(object).unique()[:5])
+                raise ValueError(
+                    f"{int(ogiltiga.sum())} av {len(df)} rader saknar eller har ogiltigt värde i kolumnen 'Date' "
+                    f"({exempel}) och kan inte bearbetas inkrementellt"
+                )
+            dag_nycklar = datum.dt.strftime('%Y-%m-%d')
+            del datum
+            inlasta = {dag: dag_df.reset_index(drop=True) for dag, dag_df in df.groupby(dag_nycklar, sort=True)}
+            del df
+
+            # Rapporten är fullständig för sitt intervall: dagar utan rader där har försvunnit
+            if tidsintervall:
+                forsta, sista = (f"{d:%Y-%m-%d}" for d in tidsintervall)
+            elif inlasta:
+                forsta, sista = min(inlasta), max(inlasta)
+            else:
+                forsta = sista = None
+            if forsta is not None:
+                for dag in [d for d in tillstand.dagar if forsta <= d <= sista and d not in inlasta]:
+                    self.logger.info(f"Dag {dag} saknas i den nya rapporten och tas bort ur tillståndet")
+                    tillstand.ta_bort_dag(dag)
+
+            def dagperiod(dag_df):
+                if 'BillingPeriodStartDate' in dag_df.columns and 'BillingPeriodEndDate' in dag_df.columns:
+                    return [pd.to_datetime(dag_df['BillingPeriodStartDate'].min()).strftime('%Y-%m-%d'),
+                            pd.to_datetime(dag_df['BillingPeriodEndDate'].max()).strftime('%Y-%m-%d')]
+                return None
+
+            uppdaterade = set()
+            for dag, dag_df in inlasta.items():
+                hash_ = tillstand.innehallshash(dag_df)
+                tidigare = tillstand.dagar.get(dag)
+                if tidigare and tidigare["hash"] == hash_:
+                    continue
+                self.logger.info(f"{'Omräknad' if tidigare else 'Ny'} dag {dag}: {len(dag_df)} rader")
+                with matningssteg("taggar", len(dag_df)):
+                    dag_df = self._typa_kostnadsdata(dag_df)
+                aggregat = self._kontera_dag(dag_df, *regler[0])
+                with matningssteg("tillstand_skrivning", len(dag_df)):
+                    tillstand.uppdatera_dag(dag, dag_df, hash_, aggregat, dagperiod(dag_df))
+                uppdaterade.add(dag)
+            self.logger.info(f"{len(uppdaterade)} av {len(inlasta)} inlästa dagar var nya eller omräknade")
+            return self._exportera_tillstand(tillstand, regler, uppdaterade, data_kolumner, excel_filename)
+
+        except Exception as e:
+            self.logger.error(f"Fel vid inkrementell bearbetning av kostnadsdata: {str(e)}")
+            raise
+
+    def _inkrementella_regler(self):
+        """
+        Konteringskonfiguration, kompilerade resursregler och tagg-overrides samt deras
+        gemensamma hash, som avgör om sparade dagaggregat behöver konteras om.
+        """
+        kontering_config = self.load_kontering_config()
+        regel_index = self.skapa_regelindex()
+        override_index = self.skapa_tagg_override_index()
+        regler_hash = self._regler_hash(kontering_config, regel_index.regler, override_index.overrides)
+        return (kontering_config, regel_index, override_index), regler_hash
+
+    # Dagfilerna sparas utan tagg-overrides, som appliceras när dagarna konteras och läses
+    def _kontera_dag(self, dag_df, kontering_config, regel_index, override_index):
+        ackumulator = Konteringsackumulator(kontering_config, regel_index)
+        ackumulator.lagg_till(self.tillampa_tagg_overrides(self.komplettera_taggar(dag_df.copy()), override_index))
+        return ackumulator.aggregat()
+
+    def _las_dag(self, tillstand, dag, override_index, kolumner=None):
+        behov = None if kolumner is None else list(kolumner) + ['ResourceId', 'Date']
+        with matningssteg("tillstand_lasning") as steg:
+            dag_df = tillstand.las_dag(dag, behov)
+            steg["rader"] = len(dag_df)
+        dag_df = self.tillampa_tagg_overrides(self.komplettera_taggar(dag_df), override_index)
+        return dag_df if kolumner is None else dag_df[[col for col in kolumner if col in dag_df.columns]]
+
+    def _exportera_tillstand(self, tillstand, regler, uppdaterade, data_kolumner=None, excel_filename=None):
+        """
+        Konterar om sparade dagar om reglerna ändrats, sparar tillståndet och exporterar
+        perioden till Excel (och kostnadslagret) från dagaggregaten i datumordning.
+        Kontering och Summary blir identiska med en vanlig körning av samma kostnadsrader,
+        eftersom Netto och subtotaler hålls som exakta delsummor. Data-fliken och gruppernas
+        BillingDescriptionTag (Flera beskrivningar i Medius) följer datumordning i stället för radordning.
+        """
+        (kontering_config, regel_index, override_index), regler_hash = regler
+        # Ändrade konteringsregler: kontera om sparade dagar utan att läsa in dem från Azure igen
+        if tillstand.regler_hash is not None and tillstand.regler_hash != regler_hash:
+            self.logger.info("Konteringsreglerna eller tagg-overrides har ändrats, konterar om sparade dagar")
+            for dag in tillstand.dagar:
+                if dag not in uppdaterade:
+                    tillstand.dagar[dag]["aggregat"] = self._kontera_dag(
+                        tillstand.las_dag(dag), kontering_config, regel_index, override_index
+                    )
+        tillstand.regler_hash = regler_hash
+        tillstand.spara()
+        self.spara_regeltilldelning(regel_index)
+
+        dagar = sorted(tillstand.dagar)
+        if not dagar:
+            self.logger.warning("Inga bearbetade dagar för perioden, ingen export görs.")
+            return pd.DataFrame()
+        ackumulator = Konteringsackumulator(kontering_config, regel_index)
+        sammanfattning = self.skapa_sammanfattning()
+        for dag in dagar:
+            ackumulator.lagg_till_aggregat(tillstand.dagar[dag]["aggregat"])
+            with matningssteg("sammanfattning") as steg:
+                dag_df = tillstand.las_dag(dag, [sammanfattning.kostnadskolumn] + sammanfattning.dimensioner)
+                sammanfattning.lagg_till(dag_df)
+                steg["rader"] = len(dag_df)
+        self.logger.info(f"Inkrementellt tillstånd för {dagar[0]} till {dagar[-1]}")
+        self.logga_sammanfattning(sammanfattning)
+
+        perioder = [tillstand.dagar[dag]["period"] for dag in dagar if tillstand.dagar[dag]["period"]]
+        period = (min(p[0] for p in perioder), max(p[1] for p in perioder)) if perioder else None
+        if data_kolumner is not None and not data_kolumner:
+            df = pd.DataFrame()
+        else:
+            delar = [self._las_dag(tillstand, dag, override_index, data_kolumner) for dag in dagar]
+            with matningssteg("sammanslagning"):
+                df = self.konkatenera(delar)
+            del delar
+        self.export_to_excel(df, excel_filename, kontering=ackumulator.resultat(), period=period,
+                             sammanfattning=sammanfattning)
+
+        lager = self.kostnadslager()
+        if lager:
+            alla = df if data_kolumner is None else self.konkatenera(
+                [self._las_dag(tillstand, dag, override_index) for dag in dagar]
+            )
+            self.spara_i_kostnadslager(lager, alla, ackumulator)
+        return df
+
+    def _inkrementell_katalog(self, billing_account_id, billing_period):
+        return os.path.join(config.INKREMENTELL_KATALOG, f"{billing_account_id or 'lokal'}_{billing_period}")
+
+    @med_korningsmatning
+    def export_inkrementell_period(self, billing_account_id=None, billing_period=None, data_kolumner=None,
+                                   excel_filename=None):
+        """
+        Exporterar en period till Excel från sparat inkrementellt tillstånd, utan att
+        hämta eller läsa in några rapporter. Sparade dagar konteras om först om
+        konteringsreglerna eller tagg-overrides har ändrats.
+        Args:
+            billing_account_id (str, optional): Billing account ID (None = tillstånd från lokala filer)
+            billing_period (str, optional): Period i formatet 'YYYYMM' (standard: innevarande månad)
+            data_kolumner (list, optional): Kolumner för Data-fliken (None = alla, [] = ingen Data-flik)
+            excel_filename (str, optional): Sökväg till Excel-filen
+        Returns:
+            pd.DataFrame: Data för Data-fliken för hela perioden
+        """
+        billing_period = billing_period or datetime.now().strftime("%Y%m")
+        katalog = self._inkrementell_katalog(billing_account_id, billing_period)
+        if not os.path.exists(os.path.join(katalog, DagligtTillstand.FIL)):
+            raise ValueError(f"Inget inkrementellt tillstånd finns för {billing_account_id or 'lokal'} {billing_period} ({katalog})")
+        return self._exportera_tillstand(
+            DagligtTillstand(katalog), self._inkrementella_regler(), set(), data_kolumner, excel_filename
+        )
+
+
+class Konteringstjanst:
+    """
+    Lokal HTTP-tjänst som håller kompilerade regler, den senaste bearbetade rapporten
+    och konteringsaggregaten i minnet och svarar på frågor som "var konteras den här
+    resursen?" utan att skriptet startas om och rapporten läses in på nytt.
+
+    Regelfilerna (och rapportfilen) kontrolleras mot sin ändringstid högst en gång per
+    kontrollintervall. Ändrade regler konteras om från de taggade raderna i minnet,
+    och en ändrad eller nyare rapport läses in på nytt.
+
+    Endpoints (GET, svar i JSON):
+        /resurs?id=<ResourceId>        Regel och kontering med källor och kostnad per konteringsgrupp
+        /grupp?konproj=..&rg=..&aktivitet=..&projkat=..[&antal=20]
+                                       Konteringsgrupper med netto och största resurser
+        /kontering                     Konteringsraderna som i Kontering-fliken
+        /status                        Inläst rapport, regelfiler och laddningstider
+    """
+
+    REGELFILER = ("kontering_config.json", "kontering_resource_config.json", "tag_overrides.json")
+    GRUPPFILTER = {"konproj": "Kon/Proj", "rg": "RG", "aktivitet": "Aktivitet", "projkat": "ProjKat"}
+
+    def __init__(self, processor, rapportfiler=None, rapportkatalog="reports", kontrollintervall=1.0):
+        self.processor = processor
+        self.logger = processor.logger
+        self.rapportfiler = list(rapportfiler or [])
+        self.rapportkatalog = rapportkatalog
+        self.kontrollintervall = kontrollintervall
+        # Frågorna håller _lock bara för att hämta det aktuella tillståndet. Ett nytt
+        # tillstånd byggs under _laddning och byts sedan in under _lock.
+        self._lock = threading.Lock()
+        self._laddning = threading.Lock()
+        self._kontrollerad = 0.0
+        self._tillstand = None
+
+    def _senaste_rapport(self):
+        filer = glob.glob(os.path.join(self.rapportkatalog, "*.csv.gz"))
+        if not filer:
+            raise ValueError(f"Inga rapporter hittades i {self.rapportkatalog}")
+        return max(filer, key=self.processor.rapport_tidpunkt)
+
+    @staticmethod
+    def _mtid(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _las_rapport(self, filer):
+        """
+        Läser in och taggar rapportfilerna.
+        Returns:
+            tuple: (taggade rader, status)
+        """
+        p = self.processor
+        start = time.perf_counter()
+        # Data-fliken skrivs inte, så endast bearbetningens kolumner läses in
+        kolumner = p.bearbetningskolumner([])
+        if len(filer) > 1:
+            df = p.sla_ihop_rapporter(filer, kolumner)
+        else:
+            df = p._las_rapport(filer[0], kolumner)
+        if 'Tags' in df.columns and not all(kolumn in df.columns for _, kolumn in TAG_KOLUMNER):
+            df = p.extract_tags_columns(df)
+        taggad = p.komplettera_taggar(df)
+        self.logger.info(f"Rapport inläst i tjänsten: {', '.join(filer)} ({len(df)} rader)")
+        return taggad, {"rapport_laddad": datetime.now().isoformat(timespec='seconds'),
+                        "rapport_sekunder": round(time.perf_counter() - start, 3)}
+
+    def _kontera(self, taggad):
+        """
+        Konterar de taggade raderna och bygger uppslagstabellerna per ResourceId och
+        konteringsgrupp. Per ResourceId och grupp sparas även vilka källor resursens
+        rader har tilldelats.
+        """
+        p = self.processor
+        start = time.perf_counter()
+        df = p.tillampa_tagg_overrides(taggad.copy(), p.skapa_tagg_override_index())
+        ackumulator = p.skapa_konteringsackumulator(p.load_kontering_config())
+        ackumulator.lagg_till(df)
+        p.spara_regeltilldelning(ackumulator.regel_index)
+        kontering_df, warnings = ackumulator.resultat()
+
+        # Netto per ResourceId och källa, sedan per ResourceId och konteringsgrupp
+        kalla_id, _ = ackumulator.tilldela_kallor(df)
+        per_kalla = pd.DataFrame({
+            "ResourceId": df["ResourceId"].astype(object).fillna("").astype(str).to_numpy() if "ResourceId" in df.columns else "",
+            "kalla": kalla_id,
+            "netto": df["CostInBillingCurrency"].to_numpy(dtype=np.float64, na_value=0.0)
+                     if "CostInBillingCurrency" in df.columns else 0.0,
+        }).groupby(["ResourceId", "kalla"], sort=False)["netto"].sum().reset_index()
+        per_kalla["grupp"] = ackumulator.grupp_for_kalla[per_kalla["kalla"].to_numpy()]
+        per_resurs = per_kalla.groupby(["ResourceId", "grupp"], sort=False).agg(
+            netto=("netto", "sum"), kallor=("kalla", list)).reset_index()
+        per_resurs = per_resurs.sort_values("netto", ascending=False, kind="stable")
+        resurser, grupp_resurser = {}, {}
+        for resource_id, nr, netto, kallor in per_resurs.itertuples(index=False):
+            resurser.setdefault(resource_id.lower(), []).append((int(nr), float(netto), sorted(map(int, kallor))))
+            grupp_resurser.setdefault(int(nr), []).append((resource_id, float(netto)))
+
+        for w in warnings:
+            self.logger.warning(w)
+        return {
+            "ackumulator": ackumulator,
+            "kontering_df": kontering_df,
+            "warnings": warnings,
+            "resurser": resurser,
+            "grupp_resurser": grupp_resurser,
+            "status": {"konterad": datetime.now().isoformat(timespec='seconds'),
+                       "kontering_sekunder": round(time.perf_counter() - start, 3)},
+        }
+
+    def ladda(self, vanta=True):
+        """
+        Laddar om det som ändrats sedan förra kontrollen: rapporten och/eller reglerna.
+        Frågor besvaras från det tidigare tillståndet tills det nya har byggts.
+        Med vanta=False görs ingen kontroll om en annan tråd redan laddar om.
+        """
+        if not self._laddning.acquire(blocking=vanta):
+            return
+        try:
+            self._kontrollerad = time.monotonic()
+            with self._lock:
+                tidigare = self._tillstand
+            filer = self.rapportfiler or [self._senaste_rapport()]
+            mtider = {path: self._mtid(path) for path in list(self.REGELFILER) + filer}
+            if tidigare is not None and mtider == tidigare["mtider"]:
+                return
+            if tidigare is None or filer != tidigare["filer"] or any(
+                    mtider[path] != tidigare["mtider"].get(path) for path in filer):
+                taggad, status = self._las_rapport(filer)
+            else:
+                self.logger.info("Regelfilerna har ändrats, konterar om")
+                taggad, status = tidigare["taggad"], tidigare["status"]
+            tillstand = self._kontera(taggad)
+            tillstand.update(filer=filer, mtider=mtider, taggad=taggad, status=dict(status, **tillstand["status"]))
+            with self._lock:
+                self._tillstand = tillstand
+        finally:
+            self._laddning.release()
+
+    def _aktuell(self):
+        """
+        Det aktuella tillståndet. Efter kontrollintervallet kontrolleras filerna först,
+        utan att vänta på en omladdning som en annan fråga redan har startat.
+        """
+        if time.monotonic() - self._kontrollerad >= self.kontrollintervall:
+            self.ladda(vanta=self._tillstand is None)
+        with self._lock:
+            return self._tillstand
+
+    @staticmethod
+    def _grupp(tillstand, nr, antal=None):
+        ackumulator = tillstand["ackumulator"]
+        state = ackumulator.grupper[nr]
+        grupp = {kolumn: varde for kolumn, varde in ackumulator.kallvarden[state["kalla"]].items()
+                 if not kolumn.startswith("_")}
+        grupp["Netto"] = math.fsum(state["delar"])
+        if antal is not None:
+            grupp["resurser"] = [{"ResourceId": resource_id, "netto": netto}
+                                 for resource_id, netto in tillstand["grupp_resurser"].get(nr, [])[:antal]]
+        return grupp
+
+    @staticmethod
+    def _kalla(ackumulator, kalla):
+        if kalla < ackumulator.devops_offset:
+            typ = "resursregel"
+        elif kalla < ackumulator.devops_default_id:
+            typ = "DevOps-mappning"
+        elif kalla == ackumulator.devops_default_id:
+            typ = "DevOps-default"
+        else:
+            typ = "uppsamlingskontering"
+        return {"typ": typ, "beskrivning": ackumulator.kallor[kalla].get("beskrivning", "") or ""}
+
+    def resurs(self, resource_id):
+        """
+        Var en resurs konteras: matchande resursregel och en post per konteringsgrupp som
+        resursens rader i den inlästa rapporten har tilldelats, med källorna (resursregel,
+        DevOps-mappning, DevOps-default eller uppsamlingskontering) och resursens netto i
+        gruppen. En resurs som saknas i rapporten har inga konteringsposter.
+        """
+        tillstand = self._aktuell()
+        ackumulator = tillstand["ackumulator"]
+        regel_idx = ackumulator.regel_index.hitta_index(resource_id)
+        regel = ackumulator.regel_index.regler[regel_idx] if regel_idx >= 0 else None
+        return {
+            "ResourceId": resource_id,
+            "regel": None if regel is None else {"index": regel_idx, "beskrivning": regel.get("beskrivning", "")},
+            "kontering": [dict(self._grupp(tillstand, nr), Netto=netto,
+                               kallor=[self._kalla(ackumulator, kalla) for kalla in kallor])
+                          for nr, netto, kallor in tillstand["resurser"].get(str(resource_id).lower(), [])],
+        }
+
+    def grupper(self, filter_=None, antal=20):
+        """
+        Konteringsgrupper som matchar filtret (t.ex. {"konproj": "P.98116002"}), med netto
+        och de största resurserna.
+        """
+        tillstand = self._aktuell()
+        ackumulator = tillstand["ackumulator"]
+        villkor = {self.GRUPPFILTER[nyckel]: varde for nyckel, varde in (filter_ or {}).items()
+                   if nyckel in self.GRUPPFILTER}
+        resultat = []
+        for nr, state in enumerate(ackumulator.grupper):
+            if state["kalla"] is None:
+                continue
+            varden = ackumulator.kallvarden[state["kalla"]]
+            if all(str(varden.get(kolumn, "")) == varde for kolumn, varde in villkor.items()):
+                resultat.append(self._grupp(tillstand, nr, antal))
+        return sorted(resultat, key=lambda g: -abs(g["Netto"]))
+
+    def kontering(self):
+        tillstand = self._aktuell()
+        rader = tillstand["kontering_df"].drop(columns=["_empty1", "_empty2", "_beskrivningar"], errors="ignore")
+        return {"rader": json.loads(rader.to_json(orient="records", force_ascii=False)),
+                "varningar": list(tillstand["warnings"])}
+
+    def tjanststatus(self):
+        tillstand = self._aktuell()
+        return dict(tillstand["status"], rapportfiler=tillstand["filer"], rader=len(tillstand["taggad"]),
+                    regelfiler={path: tillstand["mtider"].get(path) is not None for path in self.REGELFILER})
+
+    def hantera(self, sokvag, parametrar):
+        """
+        Svarar på en GET-förfrågan.
+        Returns:
+            tuple: (HTTP-status, JSON-serialiserbart svar)
+        """
+        if sokvag == "/resurs":
+            if not parametrar.get("id"):
+                return 400, {"fel": "Parametern id (ResourceId) saknas"}
+            return 200, self.resurs(parametrar["id"])
+        if sokvag == "/grupp":
+            antal = int(parametrar.get("antal", 20))
+            return 200, self.grupper(parametrar, antal)
+        if sokvag == "/kontering":
+            return 200, self.kontering()
+        if sokvag == "/status":
+            return 200, self.tjanststatus()
+        return 404, {"fel": f"Okänd sökväg: {sokvag}"}
+
+    def skapa_server(self, vard="127.0.0.1", port=8765):
+        """
+        Skapar en trådad HTTP-server för tjänsten (port 0 = valfri ledig port).
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qsl
+        tjanst = self
+
+        class Hanterare(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                try:
+                    status, svar = tjanst.hantera(url.path.rstrip("/") or "/", dict(parse_qsl(url.query)))
+                except ValueError as e:
+                    status, svar = 400, {"fel": str(e)}
+                except Exception as e:
+                    tjanst.logger.error(f"Fel i tjänsten för {self.path}: {e}")
+                    status, svar = 500, {"fel": str(e)}
+                data = json.dumps(svar, ensure_ascii=False, default=str).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                tjanst.logger.debug(f"{self.address_string()} {format % args}")
+
+        self.ladda()
+        return ThreadingHTTPServer((vard, port), Hanterare)
+
+    def kor(self, vard="127.0.0.1", port=8765):
+        server = self.skapa_server(vard, port)
+        self.logger.info(f"Konteringstjänsten lyssnar på http://{vard}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.logger.info("Konteringstjänsten avslutas")
+        finally:
+            server.server_close()
+
+
+def _lista(varde):
+    return [del_.strip() for del_ in (varde or "").split(',') if del_.strip()]
+
+def skapa_argumentparser():
+    """
+    Kommandoradsgränssnitt med underkommandona generate, process, export, serve och query.
+    Utan underkommando startar den interaktiva menyn.
+    """
+    def bearbetning(p, default=None):
+        # I underkommandon är standardvärdet SUPPRESS så att flaggor givna före kommandot inte skrivs över
+        p.add_argument('-v', '--verbose', action='store_true', default=default or False,
+                       help='Aktivera detaljerad loggning')
+        p.add_argument('--chunksize', type=int, default=default or config.STREAM_CHUNK_SIZE,
+                       help='Bearbeta rapporten strömmande i chunkar om så många rader')
+        p.add_argument('--data-kolumner', default=default,
+                       help='Kommaseparerad lista med kolumner som sparas för Data-fliken (tom sträng = ingen Data-flik)')
+        p.add_argument('--profilera', choices=Korningsmatning.PROFILERINGAR, default=default,
+                       help='Profilera körningen med cProfile eller tracemalloc (resultatet hamnar i körningsrapporten)')
+        p.add_argument('--processer', type=int, default=default,
+                       help='Antal processer för taggtolkning och regelmatchning (1 = seriellt, 0 = alla kärnor)')
+
+    def urval(p, perioder_hjalp):
+        p.add_argument('-p', '--perioder', default=None, help=perioder_hjalp)
+        p.add_argument('--billing-accounts', '--scope', dest='billing_accounts', default=None,
+                       help='Kommaseparerade billing account ID:n')
+
+    def inkrementell(p):
+        p.add_argument('--inkrementell', action='store_true',
+                       help='Bearbeta bara nya eller omräknade dagar i perioden (standard: innevarande månad)')
+        p.add_argument('--full-omrakning', action='store_true',
+                       help='Inkrementellt läge: radera sparat tillstånd och bearbeta om hela perioden')
+
+    parser = argparse.ArgumentParser(description='Azure Cost Processor',
+                                     epilog='Utan kommando startar den interaktiva menyn.')
+    bearbetning(parser)
+    kommandon = parser.add_subparsers(dest='kommando', metavar='KOMMANDO')
+
+    generate = kommandon.add_parser('generate', help='Generera rapporter i Azure och bearbeta dem')
+    bearbetning(generate, argparse.SUPPRESS)
+    urval(generate, "Perioder att generera, t.ex. '202401-202412' eller '202401,202403' (standard: REPORT_TIME_PERIOD)")
+    generate.add_argument('-o', '--utfil', default=None, help='Sökväg till Excel-filen (endast för en rapport)')
+    generate.add_argument('--max-parallella', type=int, default=config.BATCH_MAX_PARALLELLA,
+                          help='Max antal rapporter som pollas och bearbetas samtidigt')
+    generate.add_argument('--aggregerad', action='store_true',
+                          help='Hämta kostnaden summerad per resurs, mätare och taggar via Query API '
+                               'i stället för den detaljerade rapporten')
+    inkrementell(generate)
+
+    process = kommandon.add_parser('process', help='Bearbeta en befintlig rapportfil')
+    bearbetning(process, argparse.SUPPRESS)
+    process.add_argument('-i', '--rapportfil', required=True, nargs='+',
+                         help='Rapportfil (.csv eller .csv.gz). Flera filer slås ihop utan dubblerade kostnadsrader')
+    process.add_argument('-o', '--utfil', default=None, help='Sökväg till Excel-filen')
+    urval(process, 'Inkrementellt läge: perioden som filen läses in i (YYYYMM)')
+    inkrementell(process)
+
+    export = kommandon.add_parser('export', help='Exportera en period till Excel från inkrementellt tillstånd')
+    bearbetning(export, argparse.SUPPRESS)
+    urval(export, 'Period att exportera (YYYYMM, standard: innevarande månad)')
+    export.add_argument('-o', '--utfil', default=None, help='Sökväg till Excel-filen')
+
+    serve = kommandon.add_parser('serve', help='Starta konteringstjänsten (HTTP) med regler och rapport i minnet')
+    serve.add_argument('-v', '--verbose', action='store_true', default=argparse.SUPPRESS,
+                       help='Aktivera detaljerad loggning')
+    serve.add_argument('-i', '--rapportfil', nargs='*', default=None,
+                       help='Rapportfil(er) att hålla i minnet (standard: senaste rapporten i reports)')
+    serve.add_argument('--vard', default=config.TJANST_VARD, help='Adress att lyssna på')
+    serve.add_argument('--port', type=int, default=config.TJANST_PORT, help='Port att lyssna på')
+
+    query = kommandon.add_parser('query', help='Fråga kostnadslagret')
+    query.add_argument('-v', '--verbose', action='store_true', default=argparse.SUPPRESS,
+                       help='Aktivera detaljerad loggning')
+    query.add_argument('-g', '--grupper', default='Period',
+                       help="Kommaseparerade kolumner att gruppera på, t.ex. 'Period,KonProj'")
+    query.add_argument('--filter', default=None, help="Filter som 'KonProj=P.98116002,SubscriptionName=Prod'")
+    query.add_argument('-p', '--perioder', default=None, help="Perioder att ta med, t.ex. '202401-202412'")
+    return parser
+
 def main():
     try:
-        # Lägg till argumenthantering
-        parser = argparse.ArgumentParser(description='Azure Cost Processor')
-        parser.add_argument('-v', '--verbose', action='store_true', help='Aktivera detaljerad loggning')
-        args = parser.parse_args()
+        args = skapa_argumentparser().parse_args()
+        data_kolumner = config.DATA_KOLUMNER
+        if args.data_kolumner is not None:
+            data_kolumner = _lista(args.data_kolumner)
         
         # Konfigurera loggning baserat på verbose-flaggan
         logger = setup_logging(args.verbose)
+        if getattr(args, 'profilera', None):
+            config.PROFILERING = args.profilera
+        if getattr(args, 'processer', None) is not None:
+            config.PARALLELLA_PROCESSER = args.processer
+
+        # Fråga mot kostnadslagret, kräver ingen anslutning till Azure
+        if args.kommando == 'query':
+            filtrering = dict(villkor.split('=', 1) for villkor in _lista(args.filter)) or None
+            perioder = AzureCostProcessor.expandera_perioder(args.perioder) if args.perioder else None
+            resultat = AzureCostProcessor.fraga_kostnadslager(
+                _lista(args.grupper), filtrering, (min(perioder), max(perioder)) if perioder else None
+            )
+            with pd.option_context('display.max_rows', None, 'display.width', 200):
+                print(resultat.to_string(index=False))
+            return
         
+        # Azure-klienterna skapas först när ett kommando behöver dem
         processor = AzureCostProcessor(logger)
         logger.info("Azure Cost Processor startad")
-        
+
+        if args.kommando == 'generate':
+            accounts = _lista(args.billing_accounts or config.AZURE_BILLING_ACCOUNT_ID)
+            if not accounts:
+                raise ValueError("AZURE_BILLING_ACCOUNT_ID måste anges i .env-filen eller med --billing-accounts")
+            perioder = processor.expandera_perioder(args.perioder) if args.perioder else [None]
+            if args.utfil and len(accounts) * len(perioder) > 1:
+                raise ValueError("--utfil kan bara anges när en enda rapport genereras")
+            if args.aggregerad:
+                if args.inkrementell:
+                    raise ValueError("--aggregerad och --inkrementell kan inte kombineras")
+                for account in accounts:
+                    for period in perioder:
+                        processor.process_aggregerad_kostnad(account, period, data_kolumner=data_kolumner,
+                                                             excel_filename=args.utfil)
+                logger.info("Aggregerad kostnadsdata bearbetad framgångsrikt")
+            elif args.inkrementell:
+                # Uppdatera periodens tillstånd med nya eller omräknade dagar
+                for account in accounts:
+                    for period in perioder:
+                        processor.process_cost_data_inkrementell(
+                            account, period, data_kolumner=data_kolumner, excel_filename=args.utfil,
+                            full_omrakning=args.full_omrakning,
+                        )
+                logger.info("Inkrementell bearbetning klar")
+            elif len(accounts) * len(perioder) == 1:
+                report_url = processor.generate_detailed_cost_report_billing_account(accounts[0], perioder[0])
+                if not report_url:
+                    raise Exception("Ingen rapport-URL mottagen")
+                processor.process_cost_data(report_url, chunksize=args.chunksize, data_kolumner=data_kolumner,
+                                            excel_filename=args.utfil)
+                logger.info("Kostnadsdata bearbetad framgångsrikt")
+            else:
+                # Batchläge: alla rapportoperationer startas direkt och bearbetas när de blir klara
+                resultat = processor.generate_reports_batch(
+                    accounts, perioder, max_parallella=args.max_parallella,
+                    chunksize=args.chunksize, data_kolumner=data_kolumner,
+                )
+                misslyckade = [nyckel for nyckel, utfall in resultat.items() if isinstance(utfall, Exception)]
+                logger.info(f"Batch klar: {len(resultat) - len(misslyckade)} av {len(resultat)} rapporter bearbetade")
+                if misslyckade:
+                    raise Exception(f"{len(misslyckade)} rapporter misslyckades: {misslyckade}")
+            return
+
+        if args.kommando == 'process':
+            for rapportfil in args.rapportfil:
+                if not os.path.exists(rapportfil):
+                    raise ValueError(f"Rapportfilen finns inte: {rapportfil}")
+            if args.inkrementell:
+                perioder = processor.expandera_perioder(args.perioder) if args.perioder else [None]
+                accounts = _lista(args.billing_accounts) or [None]
+                if len(perioder) > 1 or len(accounts) > 1:
+                    raise ValueError("En rapportfil kan bara läsas in i en period och ett billing account")
+                # Tillståndet ersätter hela dagar, så rapporterna läses in i den ordning de skapades
+                for nr, rapportfil in enumerate(sorted(args.rapportfil, key=processor.rapport_tidpunkt)):
+                    processor.process_cost_data_inkrementell(
+                        accounts[0], perioder[0], local_file_path=rapportfil, data_kolumner=data_kolumner,
+                        excel_filename=args.utfil, full_omrakning=args.full_omrakning and nr == 0,
+                    )
+            else:
+                processor.process_cost_data(None, args.rapportfil, chunksize=args.chunksize,
+                                            data_kolumner=data_kolumner, excel_filename=args.utfil)
+            logger.info("Kostnadsdata bearbetad framgångsrikt")
+            return
+
+        if args.kommando == 'serve':
+            Konteringstjanst(processor, args.rapportfil, kontrollintervall=config.TJANST_KONTROLLINTERVALL).kor(
+                args.vard, args.port)
+            return
+
+        if args.kommando == 'export':
+            perioder = processor.expandera_perioder(args.perioder) if args.perioder else [None]
+            accounts = _lista(args.billing_accounts) or [None]
+            if args.utfil and len(accounts) * len(perioder) > 1:
+                raise ValueError("--utfil kan bara anges när en enda period exporteras")
+            for account in accounts:
+                for period in perioder:
+                    processor.export_inkrementell_period(account, period, data_kolumner=data_kolumner,
+                                                         excel_filename=args.utfil)
+            logger.info("Export klar")
+            return
+
         # Fråga användaren om de vill generera en ny rapport eller bearbeta en befintlig
         print("\nVälj alternativ:")
         print("1. Generera ny kostnadsrapport från Azure")
@@ -673,7 +4419,7 @@ def main():
                 raise ValueError("AZURE_BILLING_ACCOUNT_ID måste anges i .env-filen")
             report_url = processor.generate_detailed_cost_report_billing_account(config.AZURE_BILLING_ACCOUNT_ID, period if period else None)
             if report_url:
-                processed_data = processor.process_cost_data(report_url)
+                processed_data = processor.process_cost_data(report_url, chunksize=args.chunksize, data_kolumner=data_kolumner)
                 logger.info("Kostnadsdata bearbetad framgångsrikt")
         
         elif choice == "2":
@@ -689,12 +4435,14 @@ def main():
                 for i, file in enumerate(files, 1):
                     print(f"{i}. {file}")
                 
-                file_choice = input("\nVälj rapport att bearbeta (ange nummer): ").strip()
+                file_choice = input("\nVälj rapport att bearbeta (ange nummer, flera kommaseparerade slås ihop): ").strip()
                 try:
-                    selected_file = files[int(file_choice) - 1]
-                    file_path = os.path.join(reports_dir, selected_file)
-                    logger.info(f"Bearbetar befintlig rapport: {selected_file}")
-                    processed_data = processor.process_cost_data(None, file_path)
+                    selected_files = [files[int(val) - 1] for val in _lista(file_choice)]
+                    if not selected_files:
+                        raise ValueError(file_choice)
+                    file_paths = [os.path.join(reports_dir, selected_file) for selected_file in selected_files]
+                    logger.info(f"Bearbetar befintlig rapport: {', '.join(selected_files)}")
+                    processed_data = processor.process_cost_data(None, file_paths, chunksize=args.chunksize, data_kolumner=data_kolumner)
                     logger.info("Kostnadsdata bearbetad framgångsrikt")
                 except (ValueError, IndexError):
                     print("Ogiltigt val. Avslutar.")
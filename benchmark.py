@@ -0,0 +1,481 @@
+"""
+Benchmark för bearbetningskedjan i azure_cost_processor.py.
+
+Genererar seedade syntetiska EA-rapporter (detailed cost) och en regelfil, kör
+varje steg i kedjan (inläsning, taggextrahering, regelmatchning, kontering,
+sammanfattning och Excel-export) och mäter tid och toppminne per steg. Resultaten
+kan sparas som baslinje och jämföras mot en tidigare sparad baslinje. Allt körs
+lokalt utan anslutning till Azure.
+
+Exempel:
+    python benchmark.py --rader 10000,1000000 --spara-baslinje
+    python benchmark.py --rader 10000,1000000 --tolerans 0.2
+"""
+import argparse
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import azure_cost_processor as acp
+import config
+
+# Standardstorlekar (antal rader) som benchmarken körs för
+STANDARD_RADER = [10_000, 1_000_000, 10_000_000]
+STANDARD_KATALOG = "reports/benchmark"
+# Tillåten relativ försämring mot baslinjen innan ett steg räknas som regression
+STANDARD_TOLERANS = 0.2
+# Kortare försämringar än så här räknas inte som regression, eftersom de är brus
+MIN_SKILLNAD_SEKUNDER = 0.05
+
+EA_KOLUMNER = [
+    'BillingAccountId', 'BillingAccountName', 'BillingPeriodStartDate', 'BillingPeriodEndDate', 'Date',
+    'SubscriptionId', 'SubscriptionName', 'ResourceGroup', 'ResourceId', 'ResourceLocation',
+    'MeterCategory', 'MeterSubCategory', 'MeterName', 'MeterRegion', 'UnitOfMeasure', 'Quantity',
+    'EffectivePrice', 'CostInBillingCurrency', 'BillingCurrency', 'ConsumedService', 'Tags',
+]
+METER_MIX = [
+    ('Virtual Machines', 'Dv3/DSv3 Series', 'D2 v3/D2s v3', '1 Hour', 'Microsoft.Compute'),
+    ('Storage', 'General Block Blob v2', 'Hot LRS Data Stored', '1 GB/Month', 'Microsoft.Storage'),
+    ('Azure App Service', 'Premium v3 Plan', 'P1 v3 App', '1 Hour', 'Microsoft.Web'),
+    ('SQL Database', 'Single Standard', 'S0 DTUs', '1/Day', 'Microsoft.Sql'),
+    ('Bandwidth', 'Rtn Preference: MGN', 'Standard Data Transfer Out', '1 GB', 'Microsoft.Network'),
+    ('Log Analytics', 'Log Analytics', 'Analytics Logs Data Ingestion', '1 GB', 'Microsoft.OperationalInsights'),
+]
+DEVOPS_MIX = [
+    ('Azure Pipelines', 'Microsoft-hosted CI/CD Concurrent Job'),
+    ('Azure Repos and Boards (Basic)', 'Basic User'),
+    ('Azure Test Plans', 'Standard User'),
+    ('Azure Artifacts', 'Artifacts Storage'),
+]
+RESURSTYPER = [
+    'Microsoft.Compute/virtualMachines', 'Microsoft.Storage/storageAccounts', 'Microsoft.Web/sites',
+    'Microsoft.Sql/servers', 'Microsoft.Network/publicIPAddresses', 'Microsoft.OperationalInsights/workspaces',
+]
+# Andel resurser per taggformat: giltig JSON, enkelfnuttad "JSON", trasig sträng och inga taggar
+STANDARD_TAGGFORMAT = {'json': 0.6, 'enkelfnutt': 0.15, 'trasig': 0.1, 'tom': 0.15}
+
+
+class SyntetiskRapport:
+    """
+    Seedad generator för syntetiska EA-rapporter (detailed cost) och en matchande
+    regelfil. Samma parametrar och seed ger alltid samma filer.
+
+    Rapporten består av prenumerationer med resursgrupper och resurser. Varje resurs
+    har en fast mätare och fasta taggar i något av taggformaten, och varje rad är en
+    dags kostnad för en slumpad resurs. En andel av raderna är Azure DevOps-kostnader
+    utan ResourceId. Regelfilen innehåller mönster på prenumeration, resursgrupp,
+    exakta ResourceId och övriga wildcards, så att alla vägar i regelmatchningen används.
+    """
+
+    def __init__(self, rader, prenumerationer=10, resursgrupper=100, resurser_per_grupp=20, taggformat=None,
+                 devops_andel=0.05, regler=200, seed=42, period="202505"):
+        self.rader = int(rader)
+        self.prenumerationer = int(prenumerationer)
+        self.resursgrupper = int(resursgrupper)
+        self.resurser_per_grupp = int(resurser_per_grupp)
+        self.taggformat = dict(taggformat or STANDARD_TAGGFORMAT)
+        self.devops_andel = float(devops_andel)
+        self.regler = int(regler)
+        self.seed = int(seed)
+        self.period = str(period)
+        if set(self.taggformat) - set(STANDARD_TAGGFORMAT):
+            raise ValueError(f"Okända taggformat: {sorted(set(self.taggformat) - set(STANDARD_TAGGFORMAT))}")
+        self._resurser = None
+
+    def parametrar(self):
+        return {
+            "rader": self.rader, "prenumerationer": self.prenumerationer, "resursgrupper": self.resursgrupper,
+            "resurser_per_grupp": self.resurser_per_grupp, "taggformat": self.taggformat,
+            "devops_andel": self.devops_andel, "regler": self.regler, "seed": self.seed, "period": self.period,
+        }
+
+    def nyckel(self, rader=True):
+        """
+        Kort hash av parametrarna, används i filnamnen så att genererade filer kan återanvändas.
+        Regelfilen beror inte på antalet rader och nycklas utan det.
+        """
+        parametrar = self.parametrar()
+        if not rader:
+            del parametrar["rader"]
+        return hashlib.sha256(json.dumps(parametrar, sort_keys=True).encode()).hexdigest()[:12]
+
+    def resurser(self):
+        """
+        Resurstabellen: en rad per resurs med prenumeration, resursgrupp, mätare och Tags.
+        """
+        if self._resurser is not None:
+            return self._resurser
+        rng = np.random.default_rng(self.seed)
+        sub_ids = [f"{rng.integers(16 ** 8):08x}-{rng.integers(16 ** 4):04x}-{rng.integers(16 ** 4):04x}-"
+                   f"{rng.integers(16 ** 4):04x}-{rng.integers(16 ** 12):012x}" for _ in range(self.prenumerationer)]
+        grupp_sub = rng.integers(self.prenumerationer, size=self.resursgrupper)
+        grupp_namn = [f"rg-{'prod' if g % 3 else 'test'}-{g:04d}" for g in range(self.resursgrupper)]
+
+        antal = self.resursgrupper * self.resurser_per_grupp
+        grupp = np.repeat(np.arange(self.resursgrupper), self.resurser_per_grupp)
+        typ = rng.integers(len(RESURSTYPER), size=antal)
+        formater = list(self.taggformat)
+        andelar = np.array([self.taggformat[f] for f in formater], dtype=float)
+        format_idx = rng.choice(len(formater), size=antal, p=andelar / andelar.sum())
+        projekt = rng.integers(90000000, 99999999, size=antal)
+        aktivitet = rng.integers(1, 999, size=antal)
+        kat = rng.choice(['5420', '5430', '6540'], size=antal)
+
+        rader = []
+        for i in range(antal):
+            g = grupp[i]
+            sub = sub_ids[grupp_sub[g]]
+            resource_id = (f"/subscriptions/{sub}/resourceGroups/{grupp_namn[g]}/providers/"
+                           f"{RESURSTYPER[typ[i]]}/res{i:06d}")
+            taggar = {
+                "Billing-proj": str(projekt[i]), "Billing-akt": f"{aktivitet[i]:03d}", "billing-kat": kat[i],
+                "Billing-description": f"Resurs {i}", "costcenter": f"CC{g % 17}",
+            }
+            tags = self._formatera_taggar(taggar, formater[format_idx[i]])
+            rader.append((sub, f"Sub-{sub[:4]}", grupp_namn[g], resource_id, typ[i], tags))
+        self._resurser = pd.DataFrame(
+            rader, columns=['SubscriptionId', 'SubscriptionName', 'ResourceGroup', 'ResourceId', 'Meter', 'Tags']
+        )
+        return self._resurser
+
+    @staticmethod
+    def _formatera_taggar(taggar, format_):
+        if format_ == 'json':
+            return json.dumps(taggar)
+        if format_ == 'enkelfnutt':
+            return "{" + ", ".join(f"'{k}': '{v}'" for k, v in taggar.items()) + "}"
+        if format_ == 'trasig':
+            # Saknar klamrar och har ett avbrutet värde, tolkas med regex-fallbacken
+            return ",".join(f'"{k}": "{v}"' for k, v in taggar.items())[:-3]
+        return ''
+
+    def skriv_csv(self, path, chunk=1_000_000):
+        """
+        Skriver rapporten som gzip-komprimerad CSV, chunkvis så att även stora rapporter
+        genereras med begränsat minne.
+        """
+        resurser = self.resurser()
+        rng = np.random.default_rng(self.seed + 1)
+        start = pd.Timestamp(f"{self.period[:4]}-{self.period[4:]}-01")
+        slut = start + pd.offsets.MonthEnd(0)
+        datum = pd.date_range(start, slut).strftime('%m/%d/%Y').to_numpy(dtype=object)
+        meter = np.array(METER_MIX, dtype=object)
+        devops = np.array(DEVOPS_MIX, dtype=object)
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+            for start_rad in range(0, self.rader, chunk):
+                n = min(chunk, self.rader - start_rad)
+                idx = rng.integers(len(resurser), size=n)
+                res = resurser.iloc[idx]
+                m = meter[res['Meter'].to_numpy()]
+                ar_devops = rng.random(n) < self.devops_andel
+                d = devops[rng.integers(len(devops), size=n)]
+                df = pd.DataFrame({
+                    'BillingAccountId': '12345678',
+                    'BillingAccountName': 'Syntetiskt konto',
+                    'BillingPeriodStartDate': start.strftime('%m/%d/%Y'),
+                    'BillingPeriodEndDate': slut.strftime('%m/%d/%Y'),
+                    'Date': datum[rng.integers(len(datum), size=n)],
+                    'SubscriptionId': res['SubscriptionId'].to_numpy(),
+                    'SubscriptionName': res['SubscriptionName'].to_numpy(),
+                    'ResourceGroup': np.where(ar_devops, '', res['ResourceGroup'].to_numpy()),
+                    'ResourceId': np.where(ar_devops, '', res['ResourceId'].to_numpy()),
+                    'ResourceLocation': np.where(ar_devops, 'global', 'westeurope'),
+                    'MeterCategory': np.where(ar_devops, 'Azure DevOps', m[:, 0]),
+                    'MeterSubCategory': np.where(ar_devops, d[:, 0], m[:, 1]),
+                    'MeterName': np.where(ar_devops, d[:, 1], m[:, 2]),
+                    'MeterRegion': 'EU West',
+                    'UnitOfMeasure': np.where(ar_devops, '1/Month', m[:, 3]),
+                    'Quantity': rng.gamma(2.0, 3.0, size=n).round(6),
+                    'EffectivePrice': rng.gamma(2.0, 0.5, size=n).round(6),
+                    'CostInBillingCurrency': rng.lognormal(0.0, 1.5, size=n).round(6),
+                    'BillingCurrency': 'SEK',
+                    'ConsumedService': np.where(ar_devops, 'microsoft.visualstudio', m[:, 4]),
+                    'Tags': np.where(ar_devops, '', res['Tags'].to_numpy()),
+                }, columns=EA_KOLUMNER)
+                df.to_csv(f, header=start_rad == 0, index=False)
+        return path
+
+    def regelkonfiguration(self):
+        """
+        Resursregler i formatet för kontering_resource_config.json. Mönstren fördelas
+        på prenumerationer, resursgrupper, exakta ResourceId och övriga wildcards.
+        """
+        resurser = self.resurser()
+        rng = np.random.default_rng(self.seed + 2)
+        subs = resurser['SubscriptionId'].unique()
+        grupper = resurser['ResourceGroup'].unique()
+        regler = []
+        for i in range(self.regler):
+            typ = i % 4
+            if typ == 0:
+                monster = [f"*/subscriptions/{subs[rng.integers(len(subs))]}/*"]
+            elif typ == 1:
+                monster = [f"*/resourceGroups/{grupper[rng.integers(len(grupper))]}/*"]
+            elif typ == 2:
+                monster = list(resurser['ResourceId'].iloc[rng.integers(len(resurser), size=3)])
+            else:
+                monster = [f"*/providers/{RESURSTYPER[rng.integers(len(RESURSTYPER))]}/res{rng.integers(1000):03d}*"]
+            regler.append({
+                "resource_ids": monster,
+                "konproj": f"P.{rng.integers(10000000, 99999999)}" if i % 2 else "",
+                "rg": "" if i % 2 else str(rng.integers(10000, 19999)),
+                "akt": f"{rng.integers(1, 999):03d}",
+                "projakt": "",
+                "projkat": "6540",
+                "beskrivning": f"Syntetisk regel {i}",
+            })
+        # Sista regeln fångar det mesta av resten, som en bred uppsamlingsregel i en riktig regelfil
+        if regler:
+            regler[-1]["resource_ids"] = ["*/providers/microsoft.web/*"]
+        return {"konteringsregler": regler}
+
+    def skapa(self, katalog):
+        """
+        Skapar rapport och regelfil i katalog om de inte redan finns.
+        Returns:
+            tuple: (sökväg till rapporten, sökväg till regelfilen)
+        """
+        os.makedirs(katalog, exist_ok=True)
+        rapport = os.path.join(katalog, f"syntetisk_{self.rader}_{self.nyckel()}.csv.gz")
+        regelfil = os.path.join(katalog, f"kontering_resource_config_{self.nyckel(rader=False)}.json")
+        if not os.path.exists(rapport):
+            tmp = f"{rapport}.tmp"
+            self.skriv_csv(tmp)
+            os.replace(tmp, rapport)
+        if not os.path.exists(regelfil):
+            with open(regelfil, "w", encoding="utf-8") as f:
+                json.dump(self.regelkonfiguration(), f, ensure_ascii=False, indent=2)
+        return rapport, regelfil
+
+
+class Benchmark:
+    """
+    Kör bearbetningskedjan steg för steg och mäter väggklocktid och minne per steg.
+    Minnet anges som processens högsta RSS under steget och som ökningen jämfört
+    med stegets start.
+    """
+
+    def __init__(self, processor, logger, mat_minne=True, data_flik=True):
+        self.processor = processor
+        self.logger = logger
+        self.mat_minne = mat_minne
+        self.data_flik = data_flik
+
+    def matt(self, resultat, steg, funktion, *args, **kwargs):
+        minne = acp.MinnesMatare() if self.mat_minne else contextlib.nullcontext()
+        start = time.perf_counter()
+        with minne:
+            varde = funktion(*args, **kwargs)
+        sekunder = time.perf_counter() - start
+        topp = okning = None
+        if self.mat_minne and minne.topp is not None:
+            topp, okning = minne.topp / 1e6, (minne.topp - minne.start) / 1e6
+        resultat[steg] = {"sekunder": round(sekunder, 4),
+                          "toppminne_mb": round(topp, 1) if topp is not None else None,
+                          "minnesokning_mb": round(okning, 1) if okning is not None else None}
+        self.logger.info(f"  {steg}: {sekunder:.2f} s"
+                         + (f", toppminne {topp:.0f} MB (+{okning:.0f} MB)" if topp is not None else ""))
+        return varde
+
+    def _regelmatchning(self, regler, resource_ids):
+        index = acp.KonteringsregelIndex(regler)
+        return index.hitta_index_kolumn(pd.Series(resource_ids), self.processor.parallell)
+
+    def kor(self, rapport, regelfil, katalog):
+        """
+        Kör alla steg för en rapport.
+        Returns:
+            dict: Mätvärden per steg
+        """
+        p = self.processor
+        resultat = {}
+        kontering_config = p.load_kontering_config()
+        regler = p.load_resource_kontering_config(regelfil)
+        # Konteringen läser regelfilen från arbetskatalogen, som i en vanlig körning
+        with _arbetskatalog(katalog, regelfil):
+            df = self.matt(resultat, "inlasning", p._read_cost_csv, rapport)
+            rader = len(df)
+            df = self.matt(resultat, "taggar", p.extract_tags_columns, df)
+            self.matt(resultat, "regelmatchning", self._regelmatchning, regler,
+                      df['ResourceId'].dropna().unique())
+            kontering = self.matt(resultat, "kontering", p.generate_konteringsrader, df, kontering_config)
+
+            def sammanfatta():
+                sammanfattning = p.skapa_sammanfattning()
+                sammanfattning.lagg_till(df)
+                return sammanfattning
+            sammanfattning = self.matt(resultat, "sammanfattning", sammanfatta)
+            # Medius-kommentarerna skrivs till stdout och hör inte till benchmarkens utdata
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.matt(resultat, "excel", p.export_to_excel, df if self.data_flik else pd.DataFrame(),
+                          os.path.join(katalog, f"benchmark_{rader}.xlsx"), kontering=kontering,
+                          sammanfattning=sammanfattning)
+        resultat["totalt"] = {
+            "sekunder": round(sum(v["sekunder"] for v in resultat.values()), 4),
+            "toppminne_mb": max((v["toppminne_mb"] for v in resultat.values() if v["toppminne_mb"] is not None),
+                                default=None),
+            "minnesokning_mb": None,
+        }
+        for steg in resultat.values():
+            steg["rader_per_sekund"] = round(rader / steg["sekunder"]) if steg["sekunder"] else None
+        return resultat
+
+
+@contextlib.contextmanager
+def _arbetskatalog(katalog, regelfil):
+    """
+    Byter arbetskatalog till katalog med regelfilen som kontering_resource_config.json
+    och den ordinarie kontering_config.json, om den finns.
+    """
+    tidigare = os.getcwd()
+    kalla = os.path.join(tidigare, "kontering_config.json")
+    shutil.copyfile(regelfil, os.path.join(katalog, "kontering_resource_config.json"))
+    if os.path.exists(kalla):
+        shutil.copyfile(kalla, os.path.join(katalog, "kontering_config.json"))
+    os.chdir(katalog)
+    try:
+        yield
+    finally:
+        os.chdir(tidigare)
+
+
+def jamfor(resultat, baslinje, tolerans=STANDARD_TOLERANS):
+    """
+    Jämför mätvärden mot en baslinje.
+    Args:
+        resultat (dict): Mätvärden per antal rader och steg
+        baslinje (dict): Tidigare sparade mätvärden i samma format
+        tolerans (float): Tillåten relativ försämring av tiden. Försämringar under
+            MIN_SKILLNAD_SEKUNDER räknas inte.
+    Returns:
+        pd.DataFrame: En rad per antal rader och steg som finns i båda, med kvot och regressionsflagga
+    """
+    rader = []
+    for antal, steg_resultat in resultat.items():
+        for steg, varden in steg_resultat.items():
+            tidigare = baslinje.get(antal, {}).get(steg)
+            if not tidigare or not tidigare.get("sekunder"):
+                continue
+            kvot = varden["sekunder"] / tidigare["sekunder"]
+            rader.append({
+                "Rader": int(antal), "Steg": steg,
+                "Sekunder": varden["sekunder"], "Baslinje": tidigare["sekunder"], "Kvot": round(kvot, 2),
+                "Toppminne MB": varden.get("toppminne_mb"), "Baslinje MB": tidigare.get("toppminne_mb"),
+                "Regression": kvot > 1 + tolerans and varden["sekunder"] - tidigare["sekunder"] > MIN_SKILLNAD_SEKUNDER,
+            })
+    return pd.DataFrame(rader, columns=["Rader", "Steg", "Sekunder", "Baslinje", "Kvot", "Toppminne MB",
+                                        "Baslinje MB", "Regression"])
+
+
+def miljo():
+    return {
+        "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+        "plattform": platform.platform(), "processor": platform.processor() or platform.machine(),
+    }
+
+
+def skapa_argumentparser():
+    parser = argparse.ArgumentParser(description="Benchmark för bearbetningskedjan med syntetiska EA-rapporter")
+    parser.add_argument('--rader', default=",".join(str(r) for r in STANDARD_RADER),
+                        help='Kommaseparerade rapportstorlekar i antal rader')
+    parser.add_argument('--prenumerationer', type=int, default=10, help='Antal prenumerationer')
+    parser.add_argument('--resursgrupper', type=int, default=100, help='Antal resursgrupper')
+    parser.add_argument('--resurser-per-grupp', type=int, default=20, help='Antal resurser per resursgrupp')
+    parser.add_argument('--taggformat', default=None,
+                        help='Andelar per taggformat, t.ex. "json=0.6,enkelfnutt=0.15,trasig=0.1,tom=0.15"')
+    parser.add_argument('--devops-andel', type=float, default=0.05, help='Andel Azure DevOps-rader')
+    parser.add_argument('--regler', type=int, default=200, help='Antal regler i den genererade regelfilen')
+    parser.add_argument('--seed', type=int, default=42, help='Seed för generatorn')
+    parser.add_argument('--katalog', default=STANDARD_KATALOG, help='Katalog för genererade filer och resultat')
+    parser.add_argument('--baslinje', default=None,
+                        help='Baslinjefil (standard <katalog>/baslinje.json)')
+    parser.add_argument('--spara-baslinje', action='store_true', help='Spara resultatet som ny baslinje')
+    parser.add_argument('--tolerans', type=float, default=STANDARD_TOLERANS,
+                        help='Tillåten relativ försämring mot baslinjen innan ett steg flaggas')
+    parser.add_argument('--upprepningar', type=int, default=1,
+                        help='Antal körningar per storlek, den snabbaste per steg sparas')
+    parser.add_argument('--utan-minne', action='store_true', help='Mät inte minnesanvändningen')
+    parser.add_argument('--utan-data', action='store_true', help='Hoppa över Data-fliken i Excel-steget')
+    parser.add_argument('--processer', type=int, default=1,
+                        help='Antal processer för taggtolkning och regelmatchning (1 = seriellt, 0 = alla kärnor)')
+    return parser
+
+
+def main():
+    args = skapa_argumentparser().parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger("benchmark")
+    # Bearbetningens egna loggrader skulle dränka mätresultaten
+    processor = acp.AzureCostProcessor(logging.getLogger("benchmark.processor"))
+    logging.getLogger("benchmark.processor").setLevel(logging.WARNING)
+    config.PARALLELLA_PROCESSER = args.processer
+    # Sparade regeltilldelningar från en tidigare upprepning skulle göra att regelmatchningen inte mäts
+    config.REGELTILLDELNING_CACHE = None
+
+    taggformat = None
+    if args.taggformat:
+        taggformat = {namn: float(andel) for namn, andel in
+                      (del_.split('=', 1) for del_ in args.taggformat.split(',') if del_.strip())}
+    katalog = os.path.abspath(args.katalog)
+    baslinje_fil = args.baslinje or os.path.join(katalog, "baslinje.json")
+    benchmark = Benchmark(processor, logger, mat_minne=not args.utan_minne, data_flik=not args.utan_data)
+
+    resultat = {}
+    parametrar = None
+    for antal in (int(r) for r in args.rader.split(',') if r.strip()):
+        rapport = SyntetiskRapport(antal, args.prenumerationer, args.resursgrupper, args.resurser_per_grupp,
+                                   taggformat, args.devops_andel, args.regler, args.seed)
+        parametrar = {k: v for k, v in rapport.parametrar().items() if k != "rader"}
+        parametrar["data_flik"] = not args.utan_data
+        if args.processer != 1:
+            parametrar["processer"] = args.processer
+        start = time.perf_counter()
+        rapport_fil, regelfil = rapport.skapa(katalog)
+        logger.info(f"{antal} rader: rapport {rapport_fil} klar efter {time.perf_counter() - start:.1f} s")
+        korningar = [benchmark.kor(rapport_fil, regelfil, katalog) for _ in range(max(args.upprepningar, 1))]
+        # Snabbaste körningen per steg är minst påverkad av andra processer på maskinen
+        resultat[str(antal)] = {steg: min((k[steg] for k in korningar), key=lambda v: v["sekunder"])
+                                for steg in korningar[0]}
+
+    korning = {"tidpunkt": pd.Timestamp.now().isoformat(timespec='seconds'), "miljo": miljo(),
+               "parametrar": parametrar, "resultat": resultat}
+    resultat_fil = os.path.join(katalog, f"resultat_{pd.Timestamp.now():%Y%m%d_%H%M%S}.json")
+    with open(resultat_fil, "w", encoding="utf-8") as f:
+        json.dump(korning, f, ensure_ascii=False, indent=2)
+    logger.info(f"Resultat sparat i {resultat_fil}")
+
+    regression = False
+    if os.path.exists(baslinje_fil):
+        with open(baslinje_fil, "r", encoding="utf-8") as f:
+            baslinje = json.load(f)
+        if baslinje.get("parametrar") != parametrar:
+            logger.warning("Baslinjen är körd med andra generatorparametrar, jämförelsen är inte rättvisande")
+        jamforelse = jamfor(resultat, baslinje.get("resultat", {}), args.tolerans)
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(jamforelse.to_string(index=False))
+        regression = bool(jamforelse["Regression"].any())
+        if regression:
+            logger.warning(f"Regression mot baslinjen {baslinje_fil} (tolerans {args.tolerans:.0%})")
+    else:
+        logger.info(f"Ingen baslinje hittades i {baslinje_fil}")
+
+    if args.spara_baslinje:
+        with open(baslinje_fil, "w", encoding="utf-8") as f:
+            json.dump(korning, f, ensure_ascii=False, indent=2)
+        logger.info(f"Baslinje sparad i {baslinje_fil}")
+    return 1 if regression and not args.spara_baslinje else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,10 +13,92 @@ AZURE_BILLING_ACCOUNT_ID = os.getenv('AZURE_BILLING_ACCOUNT_ID')
 # Rapportkonfiguration
 REPORT_TIME_PERIOD = "Last30Days"  # Kan ändras till "Last7Days", "LastMonth", etc.
 REPORT_GRANULARITY = "Daily"  # Kan ändras till "Monthly", "Hourly", etc.
+# Pollning av rapportoperationer (sekunder): första intervall, max intervall och total deadline.
+# Retry-After från Azure har företräde framför backoff-intervallet.
+POLL_INITIALT_INTERVALL = 5
+POLL_MAX_INTERVALL = 60
+POLL_DEADLINE = 3600
+# Pågående rapportoperationer sparas här så att pollningen kan återupptas efter omstart
+RAPPORT_OPERATIONER_FIL = "reports/pending_operations.json"
+RAPPORT_OPERATION_GILTIG_TIMMAR = 24
+
+# Antal återanvända HTTP-anslutningar i den delade sessionen
+HTTP_POOL_STORLEK = 10
+
+# Nedladdning av rapporter: antal parallella Range-anrop, storlek per del och läsbuffert (bytes)
+NEDLADDNING_PARALLELLA = 4
+NEDLADDNING_DELSTORLEK = 32 * 1024 * 1024
+NEDLADDNING_BUFFERT = 1024 * 1024
+
+# Aggregerat läge (generate --aggregerad): kostnaden hämtas summerad per ResourceId och MeterId via
+# Cost Management Query API i stället för den detaljerade rapporten. Query API tillåter högst två
+# grupperingar per fråga, så attributen nedan (nyckeldimension: dimensioner) och varje tagg i
+# TAG_KOLUMNER hämtas i egna frågor och kopplas på
+QUERY_ATTRIBUT = {
+    'MeterId': ['MeterCategory', 'MeterSubcategory', 'Meter'],
+    'ResourceId': ['ResourceGroupName', 'SubscriptionName'],
+}
+# "None" summerar hela perioden, "Daily" ger en rad per dag (krävs för tagg-overrides med giltighetsintervall)
+QUERY_GRANULARITET = "None"
+QUERY_BAS_URL = "https://management.azure.com"
+QUERY_API_VERSION = "2023-03-01"
+# Max antal försök per anrop när Query API throttlar (429) eller svarar med 5xx
+QUERY_MAX_FORSOK = 5
+
+# Batchläge: max antal rapporter som pollas och bearbetas samtidigt
+BATCH_MAX_PARALLELLA = 4
+
+# Taggtolkning och regelmatchning på flera kärnor: antal processer (1 = seriellt, 0 = alla kärnor)
+PARALLELLA_PROCESSER = 1
+# Minsta antal nya unika värden (Tags-strängar eller ResourceId) för att arbetet ska fördelas på processerna
+PARALLELL_MIN_UNIKA = 20000
+
+# Inkrementellt läge: katalog för tillstånd per dag och antal redan bearbetade dagar
+# som hämtas igen vid varje körning (Azure räknar om kostnader för nyliga dagar i efterhand)
+INKREMENTELL_KATALOG = "reports/inkrementell"
+INKREMENTELL_OMRAKNING_DAGAR = 3
+
+# Strömmande inläsning: antal rader per chunk (None = läs hela filen på en gång)
+STREAM_CHUNK_SIZE = None
+# Kolumner som sparas för Data-fliken vid strömmande inläsning (None = alla, [] = ingen Data-flik)
+DATA_KOLUMNER = None
+
+# Spara nedladdade/bearbetade rapporter som typad Parquet-cache bredvid originalfilen (kräver pyarrow)
+PARQUET_CACHE = True
+
+# Lokalt kostnadslager (SQLite) där bearbetade och konterade rader sparas per period för
+# frågor över flera månader, t.ex. "reports/kostnadslager.sqlite" (None = används inte)
+KOSTNADSLAGER = None
+
+# Tilldelad resursregel per ResourceId sparas här mellan körningar, t.ex. "reports/regeltilldelning.json".
+# Efter en ändring i kontering_resource_config.json matchas bara ResourceId vars utfall kan ha ändrats (None = används inte)
+REGELTILLDELNING_CACHE = None
+
+# Resursinventering: tomma taggar i kostnadsexporten fylls i från resursernas och resursgruppernas
+# taggar i Azure (kräver läsbehörighet). Varje prenumeration listas en gång och cachas lokalt i TTL timmar
+RESURSINVENTERING = False
+RESURSINVENTERING_KATALOG = "reports/inventering"
+RESURSINVENTERING_TTL_TIMMAR = 24
+
+# Dimensioner med subtotaler i sammanfattningen (fliken Summary)
+SAMMANFATTNING_DIMENSIONER = ['ResourceGroup', 'MeterCategory', 'SubscriptionName']
+
+# Konteringstjänsten (serve): adress, port och hur ofta regelfilerna och rapporten kontrolleras (sekunder)
+TJANST_VARD = "127.0.0.1"
+TJANST_PORT = 8765
+TJANST_KONTROLLINTERVALL = 1.0
 
 # Excel-konfiguration
 EXCEL_OUTPUT_DIR = "reports"
 EXCEL_TEMPLATE_PATH = "templates/accounting_template.xlsx"
+# Motor för Data-fliken: "tabell" (Excel-tabell), "strömmande" (constant_memory, snabbare för stora rapporter) eller "auto"
+EXCEL_DATA_MOTOR = "auto"
+# Antal rader upp till vilket "auto" skriver Data-fliken som Excel-tabell
+EXCEL_TABELL_MAX_RADER = 100000
+# Data över Excels radgräns: "blad" (flera Data-blad), "parquet" eller "csv" (hela datat i fil bredvid Excel-filen)
+EXCEL_DATA_OVERFLOW = "blad"
 
-# Skapa output-katalog om den inte finns
-os.makedirs(EXCEL_OUTPUT_DIR, exist_ok=True) 
\ No newline at end of file
+# Körningsrapport: tid, CPU-tid, minne och rader per sekund per steg sparas som JSON bredvid Excel-filen
+KORNINGSRAPPORT = True
+# Valfri profilering under hela körningen: None, "cprofile" eller "tracemalloc" (ger märkbart långsammare körning)
+PROFILERING = None
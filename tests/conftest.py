@@ -0,0 +1,67 @@
+import logging
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import azure_cost_processor as acp  # noqa: E402
+import benchmark  # noqa: E402
+import config  # noqa: E402
+
+
+@pytest.fixture
+def arbetskatalog(tmp_path, monkeypatch):
+    """
+    Tom arbetskatalog med repots kontering_config.json och de inställningar som
+    annars skulle skriva cachefiler eller körningsrapporter bredvid testdatat.
+    """
+    shutil.copyfile(os.path.join(REPO, "kontering_config.json"), tmp_path / "kontering_config.json")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "PARQUET_CACHE", False)
+    monkeypatch.setattr(config, "KORNINGSRAPPORT", False)
+    monkeypatch.setattr(config, "KOSTNADSLAGER", None)
+    monkeypatch.setattr(config, "REGELTILLDELNING_CACHE", None)
+    monkeypatch.setattr(config, "RESURSINVENTERING", False)
+    monkeypatch.setattr(config, "PARALLELLA_PROCESSER", 1)
+    return tmp_path
+
+
+@pytest.fixture
+def syntetisk_rapport(arbetskatalog):
+    """
+    Liten seedad EA-rapport med matchande regelfil som kontering_resource_config.json.
+    """
+    rapport, regelfil = benchmark.SyntetiskRapport(6000, prenumerationer=3, resursgrupper=12,
+                                                   resurser_per_grupp=5, regler=20).skapa(arbetskatalog / "data")
+    shutil.copyfile(regelfil, arbetskatalog / "kontering_resource_config.json")
+    return rapport
+
+
+@pytest.fixture
+def processor():
+    processor = acp.AzureCostProcessor(logging.getLogger("test"))
+    yield processor
+    if "session" in processor._klienter:
+        processor.session.close()
+
+
+@pytest.fixture
+def exporter(processor, monkeypatch):
+    """
+    Fångar Kontering-raderna och Kostnadssammanfattningen som skickas till export_to_excel.
+    """
+    fangade = []
+    export_to_excel = processor.export_to_excel
+
+    def fanga(df, filename=None, kontering=None, sammanfattning=None, **kwargs):
+        if kontering is None:
+            kontering = processor.generate_konteringsrader(df, processor.load_kontering_config())
+        fangade.append((kontering[0], sammanfattning))
+        return export_to_excel(df, filename, kontering=kontering, sammanfattning=sammanfattning, **kwargs)
+
+    monkeypatch.setattr(processor, "export_to_excel", fanga)
+    return fangade
@@ -0,0 +1,63 @@
+import pandas as pd
+import pytest
+
+import config
+
+
+@pytest.fixture
+def inkrementell_katalog(arbetskatalog, monkeypatch):
+    monkeypatch.setattr(config, "INKREMENTELL_KATALOG", str(arbetskatalog / "inkrementell"))
+
+
+def assert_samma_export(export, forvantad, beskrivningsordning=True):
+    # Exakt likhet, inte bara inom avrundningsfel
+    kontering, sammanfattning = export
+    forvantad_kontering, forvantad_sammanfattning = forvantad
+    if not beskrivningsordning:
+        # Inkrementellt läge samlar gruppernas BillingDescriptionTag i datumordning i stället för radordning
+        kontering = kontering.assign(_beskrivningar=kontering["_beskrivningar"].map(sorted))
+        forvantad_kontering = forvantad_kontering.assign(
+            _beskrivningar=forvantad_kontering["_beskrivningar"].map(sorted))
+    pd.testing.assert_frame_equal(kontering, forvantad_kontering, check_exact=True)
+    assert sammanfattning.som_dict() == forvantad_sammanfattning.som_dict()
+
+
+def test_strommande_och_inkrementell_export_ar_identisk_med_vanlig_korning(processor, exporter, syntetisk_rapport,
+                                                                            arbetskatalog, inkrementell_katalog):
+    vanlig = processor.process_cost_data(local_file_path=syntetisk_rapport,
+                                         excel_filename=str(arbetskatalog / "vanlig.xlsx"))
+    strommad = processor.process_cost_data(local_file_path=syntetisk_rapport, chunksize=700,
+                                           excel_filename=str(arbetskatalog / "strommad.xlsx"))
+    inkrementell = processor.process_cost_data_inkrementell(billing_period="202505", local_file_path=syntetisk_rapport,
+                                                            excel_filename=str(arbetskatalog / "inkrementell.xlsx"))
+    assert len(vanlig) == len(strommad) == len(inkrementell)
+    assert len(exporter[0][0]) > 2
+    assert_samma_export(exporter[1], exporter[0])
+    assert_samma_export(exporter[2], exporter[0], beskrivningsordning=False)
+
+
+def test_inkrementella_korningar_ger_samma_export_som_vanlig_korning(processor, exporter, syntetisk_rapport,
+                                                                     arbetskatalog, inkrementell_katalog):
+    df = pd.read_csv(syntetisk_rapport)
+    dag = pd.to_datetime(df["Date"]).dt.day
+    # Tre körningar med överlappande dagar, som när Azure räknar om de senaste dagarna
+    for nr, (forsta, sista) in enumerate([(1, 12), (10, 22), (20, 31)]):
+        path = arbetskatalog / f"del{nr}.csv.gz"
+        df[(dag >= forsta) & (dag <= sista)].to_csv(path, index=False)
+        processor.process_cost_data_inkrementell(billing_period="202505", local_file_path=str(path),
+                                                 excel_filename=str(arbetskatalog / f"del{nr}.xlsx"))
+    processor.process_cost_data(local_file_path=syntetisk_rapport, excel_filename=str(arbetskatalog / "vanlig.xlsx"))
+    assert_samma_export(exporter[-2], exporter[-1], beskrivningsordning=False)
+
+
+def test_rader_utan_giltigt_datum_stoppar_inkrementell_korning(processor, syntetisk_rapport, arbetskatalog,
+                                                              inkrementell_katalog):
+    df = pd.read_csv(syntetisk_rapport)
+    df.loc[[3, 7], "Date"] = None
+    df.loc[11, "Date"] = "inte ett datum"
+    path = arbetskatalog / "ogiltiga_datum.csv.gz"
+    df.to_csv(path, index=False)
+    with pytest.raises(ValueError, match=f"3 av {len(df)} rader saknar eller har ogiltigt värde i kolumnen 'Date'"):
+        processor.process_cost_data_inkrementell(billing_period="202505", local_file_path=str(path),
+                                                 excel_filename=str(arbetskatalog / "ogiltiga_datum.xlsx"))
+    assert not (arbetskatalog / "ogiltiga_datum.xlsx").exists()
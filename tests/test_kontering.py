@@ -0,0 +1,20 @@
+import json
+import os
+
+import pandas as pd
+
+FORVANTAD = os.path.join(os.path.dirname(__file__), "data", "kontering_forvantad.json")
+
+
+def test_kontering_ar_densamma_som_inspelad(processor, syntetisk_rapport):
+    df = processor.extract_tags_columns(processor._read_cost_csv(syntetisk_rapport))
+    kontering, varningar = processor.generate_konteringsrader(df, processor.load_kontering_config())
+
+    with open(FORVANTAD, encoding="utf-8") as f:
+        forvantad = json.load(f)
+    forvantad_df = pd.DataFrame(forvantad["rader"], columns=forvantad["kolumner"])
+    forvantad_df["_beskrivningar"] = forvantad_df["_beskrivningar"].map(
+        lambda varde: tuple(varde) if isinstance(varde, list) else varde)
+    # Netto ska stämma exakt, inte bara inom avrundningsfel
+    pd.testing.assert_frame_equal(kontering, forvantad_df, check_exact=True, check_dtype=False)
+    assert varningar == forvantad["varningar"]
@@ -0,0 +1,50 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import azure_cost_processor as acp
+
+
+def radvis_index(processor, regler, resource_id):
+    # Den ursprungliga loopen: fnmatch mot gemener, regel för regel
+    regel = processor.hitta_konteringsregel(resource_id, regler)
+    return next((idx for idx, r in enumerate(regler) if r is regel), -1)
+
+
+def test_index_ger_samma_regel_som_radvis_matchning(processor, syntetisk_rapport):
+    rapport = pd.read_csv(syntetisk_rapport, keep_default_na=False)
+    resource_ids = sorted(set(rapport["ResourceId"]) - {""})
+    forsta = resource_ids[0]
+    sub, rg = forsta.split("/")[2], forsta.split("/")[4]
+
+    regler = processor.load_resource_kontering_config()
+    # Överlappande mönster: en bred wildcard före segment- och exakta regler för samma resurser,
+    # ett resursgruppsmönster med wildcard och ett exakt ResourceId som redan täcks av tidigare regler
+    regler = [
+        {"resource_ids": [f"*/resourcegroups/{rg[:-2]}*/providers/microsoft.compute/*"]},
+        *regler,
+        {"resource_ids": [f"*/subscriptions/{sub.upper()}/*"]},
+        {"resource_ids": [f"*/resourceGroups/{rg}/*", "*/resourceGroups/rg-prod-*/*"]},
+        {"resource_ids": [forsta.upper(), "*res00000?"]},
+    ]
+    with open(os.path.join(os.path.dirname(acp.__file__), "kontering_resource_config.json"), encoding="utf-8") as f:
+        regler += json.load(f)["konteringsregler"]
+    index = acp.KonteringsregelIndex(regler)
+    assert index.segment_lookup["subscriptions"] and index.segment_lookup["resourcegroups"]
+    assert index.exakta and index.wildcard_regex is not None
+
+    kandidater = resource_ids + [
+        "", float("nan"), None, forsta.upper(), f"{forsta}/child", forsta[:-1],
+        f"/subscriptions/{sub}", f"/subscriptions/{sub}/resourceGroups/{rg}", f"/subscriptions/{sub}/",
+        f"/x/subscriptions/{sub}/y", f"/resourceGroups/{rg}/", "/subscriptions//resourceGroups//",
+    ]
+    forvantat = [radvis_index(processor, regler, resource_id) for resource_id in kandidater]
+    assert [index.hitta_index(resource_id) for resource_id in kandidater] == forvantat
+    # Både träffar på många olika regler, på den breda wildcarden först och inga träffar
+    vinnare = set(forvantat)
+    assert {0, -1} <= vinnare and len(vinnare) >= 10
+
+    kolumn = pd.Series(kandidater, dtype=object)
+    np.testing.assert_array_equal(acp.KonteringsregelIndex(regler).hitta_index_kolumn(kolumn), forvantat)
@@ -0,0 +1,156 @@
+import json
+import math
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import pytest
+
+import azure_cost_processor as acp
+
+DEVOPS_ORG = "/subscriptions/sub-devops/resourceGroups/rg-devops/providers/Microsoft.VisualStudio/account/org-1"
+UTAN_REGEL = "/subscriptions/sub-ovrigt/resourceGroups/rg-utan-regel/providers/Microsoft.Storage/storageAccounts/st1"
+
+
+@pytest.fixture
+def tjanstrapport(processor, syntetisk_rapport, arbetskatalog):
+    """
+    Den syntetiska rapporten där DevOps-raderna har organisationens ResourceId och
+    en resurs saknar matchande resursregel.
+    """
+    df = pd.read_csv(syntetisk_rapport, keep_default_na=False)
+    devops = df["MeterCategory"] == "Azure DevOps"
+    df.loc[devops, "ResourceId"] = DEVOPS_ORG
+    df.loc[df.index[~devops][:25], "ResourceId"] = UTAN_REGEL
+    path = arbetskatalog / "azure_cost_report_20250601_080000.csv.gz"
+    df.to_csv(path, index=False)
+    regel_index = processor.skapa_regelindex()
+    assert regel_index.hitta_index(DEVOPS_ORG) == regel_index.hitta_index(UTAN_REGEL) == -1
+    return str(path), df
+
+
+@pytest.fixture
+def tjanst(processor, tjanstrapport):
+    return acp.Konteringstjanst(processor, [tjanstrapport[0]], kontrollintervall=0)
+
+
+@pytest.fixture
+def hamta(tjanst):
+    server = tjanst.skapa_server(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def hamta(sokvag):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}{sokvag}", timeout=30) as svar:
+                return svar.status, json.load(svar)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    yield hamta
+    server.shutdown()
+    server.server_close()
+
+
+def netto(df, resource_id):
+    return math.fsum(df.loc[df["ResourceId"] == resource_id, "CostInBillingCurrency"])
+
+
+def test_devops_resurs_konteras_enligt_matare(hamta, tjanstrapport):
+    _, df = tjanstrapport
+    status, svar = hamta(f"/resurs?id={DEVOPS_ORG}")
+    assert status == 200 and svar["regel"] is None
+    typer = {kalla["typ"] for post in svar["kontering"] for kalla in post["kallor"]}
+    assert typer == {"DevOps-mappning", "DevOps-default"}
+    # En post per konteringsgrupp som organisationens rader tilldelats
+    assert len(svar["kontering"]) == len({(p["Kon/Proj"], p["RG"], p["Aktivitet"]) for p in svar["kontering"]}) == 4
+    konteringar = {post["kallor"][0]["beskrivning"]: post for post in svar["kontering"]}
+    assert konteringar["Bygg- och deploy-pipelines (CI/CD)"]["Kon/Proj"] == "P.20257601"
+    assert konteringar["Användarlicenser för Devops basicanvändare"]["RG"] == "19003"
+    assert konteringar["Övriga DevOps-kostnader"]["Kon/Proj"] == "9999"
+    assert "P.201726" not in {post["Kon/Proj"] for post in svar["kontering"]}
+    assert math.fsum(post["Netto"] for post in svar["kontering"]) == pytest.approx(netto(df, DEVOPS_ORG), rel=1e-12)
+
+
+def test_resurs_med_regel_utan_regel_och_utanfor_rapporten(hamta, tjanstrapport, processor):
+    _, df = tjanstrapport
+    status, svar = hamta(f"/resurs?id={UTAN_REGEL.upper()}")
+    assert status == 200 and svar["regel"] is None
+    [post] = svar["kontering"]
+    assert post["kallor"] == [{"typ": "uppsamlingskontering",
+                               "beskrivning": "Uppsamlingskontering för ej taggade kostnader"}]
+    assert (post["Kon/Proj"], post["Aktivitet"]) == ("P.201726", "999")
+    assert post["Netto"] == pytest.approx(netto(df, UTAN_REGEL), rel=1e-12)
+
+    regel_index = processor.skapa_regelindex()
+    med_regel = next(rid for rid in df["ResourceId"].unique() if rid and regel_index.hitta_index(rid) >= 0)
+    status, svar = hamta(f"/resurs?id={med_regel}")
+    regel = regel_index.regler[regel_index.hitta_index(med_regel)]
+    assert svar["regel"] == {"index": regel_index.hitta_index(med_regel), "beskrivning": regel.get("beskrivning", "")}
+    assert [kalla["typ"] for post in svar["kontering"] for kalla in post["kallor"]] == ["resursregel"]
+
+    status, svar = hamta("/resurs?id=/subscriptions/saknas/resourceGroups/rg/providers/x/y/z")
+    assert status == 200 and svar["kontering"] == []
+
+
+def test_grupp_kontering_status_och_fel(hamta, tjanstrapport, processor):
+    path, df = tjanstrapport
+    status, grupper = hamta("/grupp?konproj=P.20257601&antal=3")
+    assert status == 200 and len(grupper) == 1
+    assert grupper[0]["resurser"][0]["ResourceId"] == DEVOPS_ORG and len(grupper[0]["resurser"]) == 1
+
+    status, kontering = hamta("/kontering")
+    forvantad, varningar = processor.generate_konteringsrader(
+        processor.extract_tags_columns(processor._read_cost_csv(path)), processor.load_kontering_config())
+    assert status == 200 and kontering["varningar"] == varningar
+    assert [rad["Kon/Proj"] for rad in kontering["rader"]] == list(forvantad["Kon/Proj"])
+    assert [rad["Netto"] for rad in kontering["rader"]] == pytest.approx(list(forvantad["Netto"]), rel=1e-12)
+
+    status, tjanststatus = hamta("/status")
+    assert status == 200 and tjanststatus["rader"] == len(df) and tjanststatus["rapportfiler"] == [path]
+    assert tjanststatus["regelfiler"]["kontering_resource_config.json"]
+
+    assert hamta("/resurs")[0] == 400
+    assert hamta("/okand")[0] == 404
+
+
+def test_fragor_besvaras_under_omladdning(tjanst, arbetskatalog):
+    tjanst.ladda()
+    fore = tjanst.resurs(DEVOPS_ORG)
+
+    # Ny regel för DevOps-organisationen; omkonteringen hålls kvar tills frågan nedan är besvarad
+    regelfil = arbetskatalog / "kontering_resource_config.json"
+    with open(regelfil, encoding="utf-8") as f:
+        regler = json.load(f)
+    regler["konteringsregler"].insert(0, {"resource_ids": ["*/account/org-1"], "konproj": "P.555", "rg": "",
+                                          "akt": "738", "projakt": "", "projkat": "5420", "beskrivning": "DevOps-org"})
+    with open(regelfil, "w", encoding="utf-8") as f:
+        json.dump(regler, f)
+    mtid = os.stat(regelfil).st_mtime + 10
+    os.utime(regelfil, (mtid, mtid))
+
+    startad, slapp = threading.Event(), threading.Event()
+    kontera = tjanst._kontera
+
+    def hallen_kontering(taggad):
+        startad.set()
+        assert slapp.wait(30)
+        return kontera(taggad)
+
+    tjanst._kontera = hallen_kontering
+    laddning = threading.Thread(target=tjanst.ladda)
+    laddning.start()
+    try:
+        assert startad.wait(30)
+        # Besvaras från det tidigare tillståndet utan att vänta på omladdningen
+        assert tjanst.resurs(DEVOPS_ORG) == fore
+    finally:
+        slapp.set()
+        laddning.join(30)
+
+    efter = tjanst.resurs(DEVOPS_ORG)
+    assert efter["regel"] == {"index": 0, "beskrivning": "DevOps-org"}
+    [post] = efter["kontering"]
+    assert post["Kon/Proj"] == "P.555" and post["kallor"] == [{"typ": "resursregel", "beskrivning": "DevOps-org"}]
+    assert post["Netto"] == pytest.approx(math.fsum(p["Netto"] for p in fore["kontering"]), rel=1e-12)
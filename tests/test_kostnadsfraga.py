@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import azure_cost_processor as acp
+import config
+
+SCOPE = "/providers/Microsoft.Billing/billingAccounts/12345678"
+# Dimensioner som Query API kan gruppera på och motsvarande kolumn i den detaljerade rapporten
+DIMENSIONER = {
+    "ResourceId": "ResourceId", "MeterId": "MeterId", "MeterCategory": "MeterCategory",
+    "MeterSubcategory": "MeterSubCategory", "Meter": "MeterName", "ResourceGroupName": "ResourceGroup",
+    "SubscriptionName": "SubscriptionName", "SubscriptionId": "SubscriptionId",
+}
+
+
+class Svar:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self._data = data
+        self.headers = headers or {}
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self._data
+
+
+def gruppering(definition):
+    return [g["name"] for g in definition["dataset"]["grouping"]]
+
+
+def ogiltig_definition(definition):
+    """
+    Samma kontroller som Query API gör av grupperingen, annars returneras 400.
+    """
+    grupper = definition["dataset"].get("grouping", [])
+    if len(grupper) > acp.KostnadsFraga.MAX_GRUPPERINGAR:
+        return f"Invalid query definition: at most 2 grouping clauses are allowed, got {len(grupper)}"
+    for g in grupper:
+        if g["type"] == "Dimension" and g["name"] not in DIMENSIONER:
+            return f"Invalid dimension {g['name']}"
+        if g["type"] not in ("Dimension", "TagKey"):
+            return f"Invalid grouping type {g['type']}"
+    return None
+
+
+class FejkadQueryApi:
+    """
+    Query API över en detaljerad rapport: validerar definitionen som tjänsten, summerar
+    kostnaden per gruppering (och dag med granularitet Daily), returnerar ResourceId med
+    gemener och taggar som TagKey/TagValue, sidar med nextLink och throttlar ett anrop.
+    """
+
+    SIDA = 40
+
+    def __init__(self, detaljer):
+        self.detaljer = detaljer
+        self.definitioner = []
+        self.anrop = 0
+
+    def svar(self, definition):
+        df = self.detaljer
+        kolumner = [{"name": "Cost", "type": "Number"}]
+        grupper = []
+        if definition["dataset"]["granularity"] == "Daily":
+            df = df.assign(UsageDate=df["Date"].dt.strftime("%Y%m%d").astype(int))
+            grupper.append("UsageDate")
+            kolumner.append({"name": "UsageDate", "type": "Number"})
+        for g in definition["dataset"]["grouping"]:
+            if g["type"] == "Dimension":
+                varden = df[DIMENSIONER[g["name"]]].astype(object).fillna("").astype(str)
+                df = df.assign(**{g["name"]: varden.str.lower() if g["name"] == "ResourceId" else varden})
+                grupper.append(g["name"])
+                kolumner.append({"name": g["name"], "type": "String"})
+            else:
+                kolumn = dict(acp.TAG_KOLUMNER)[g["name"].lower()]
+                varde = df[kolumn].astype(object).fillna("").astype(str)
+                df = df.assign(TagKey=np.where(varde != "", g["name"], ""), TagValue=varde)
+                grupper += ["TagKey", "TagValue"]
+                kolumner += [{"name": "TagKey", "type": "String"}, {"name": "TagValue", "type": "String"}]
+        summor = df.groupby(grupper, sort=False)["CostInBillingCurrency"].sum().reset_index()
+        kolumner.append({"name": "Currency", "type": "String"})
+        return kolumner, [[kostnad, *nyckel, "SEK"] for *nyckel, kostnad in summor[grupper + ["CostInBillingCurrency"]]
+                          .itertuples(index=False)]
+
+    def post(self, url, json=None, headers=None):
+        self.anrop += 1
+        if self.anrop == 2:
+            return Svar(429, {"error": {"code": "429"}},
+                        {"x-ms-ratelimit-microsoft.costmanagement-qpu-retry-after": "1"})
+        fel = ogiltig_definition(json)
+        if fel:
+            return Svar(400, {"error": {"code": "BadRequest", "message": fel}})
+        self.definitioner.append(json)
+        kolumner, rader = self.svar(json)
+        delar = urlsplit(url)
+        skip = int(parse_qs(delar.query).get("$skiptoken", ["0"])[0])
+        nasta = None
+        if skip + self.SIDA < len(rader):
+            nasta = f"{delar.scheme}://{delar.netloc}{delar.path}?api-version=2023-03-01&$skiptoken={skip + self.SIDA}"
+        return Svar(200, {"properties": {"nextLink": nasta, "columns": kolumner,
+                                         "rows": rader[skip:skip + self.SIDA]}})
+
+
+@pytest.fixture
+def inspelade_svar():
+    with open(os.path.join(os.path.dirname(__file__), "data", "query_svar.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_frågorna_håller_sig_inom_två_grupperingar():
+    with pytest.raises(ValueError):
+        acp.KostnadsFraga.definition(datetime(2025, 5, 1), datetime(2025, 5, 31), ["ResourceId", "MeterId"],
+                                     ["billing-proj"])
+
+
+def test_svar_i_dokumenterat_format(inspelade_svar):
+    sidor = {}
+    anropade = []
+
+    def post(url, json=None, headers=None):
+        assert ogiltig_definition(json) is None
+        nyckel = ",".join(gruppering(json))
+        anropade.append(nyckel)
+        # Andra sidan hämtas via nextLink med samma definition
+        sida = sidor.get(nyckel, 0)
+        sidor[nyckel] = sida + 1
+        return Svar(200, inspelade_svar[nyckel][sida])
+
+    fraga = acp.KostnadsFraga(logging.getLogger("test"), http_post=post, sleep=lambda s: None)
+    df = fraga.hamta_kostnad(SCOPE, datetime(2025, 5, 1), datetime(2025, 5, 31), config.QUERY_ATTRIBUT,
+                             ["billing-proj", "billing-description"])
+
+    assert sorted(set(anropade)) == sorted(k for k in inspelade_svar if not k.startswith("_"))
+    assert fraga.metriker["sidor"] == 9
+    assert len(df) == 4
+    assert df["CostInBillingCurrency"].sum() == pytest.approx(635.63971)
+    vm = df[df["MeterId"] == "8f5c2d6e-3a1b-4c9d-b0e7-1f2a3b4c5d6e"].iloc[0]
+    assert (vm["MeterCategory"], vm["MeterSubCategory"], vm["MeterName"]) == ("Virtual Machines", "Dv3/DSv3 Series",
+                                                                             "D4 v3/D4s v3")
+    assert (vm["ResourceGroup"], vm["SubscriptionName"], vm["BillingCurrency"]) == ("rg-prod-0001", "Produktion", "SEK")
+    # Omtaggad resurs: värdet med störst kostnad används
+    assert json.loads(vm["Tags"]) == {"billing-proj": "98116002", "billing-description": "Byggserver"}
+    db = df[df["MeterId"] == "4d3c2b1a-0f9e-4d8c-a7b6-5e4d3c2b1a0f"].iloc[0]
+    assert json.loads(db["Tags"]) == {"billing-description": "Testdatabas"}
+    # Kostnad utan ResourceId: mätarens attribut men varken resursgrupp, prenumeration eller taggar
+    devops = df[df["ResourceId"] == ""].iloc[0]
+    assert devops["MeterCategory"] == "Azure DevOps"
+    assert pd.isna(devops["SubscriptionName"]) and pd.isna(devops["ResourceGroup"])
+    assert devops["Tags"] == "{}"
+
+
+def test_aggregerat_lage_ger_samma_kontering_som_detaljerad_rapport(processor, exporter, syntetisk_rapport,
+                                                                    arbetskatalog):
+    detaljer = processor.extract_tags_columns(processor._read_cost_csv(syntetisk_rapport))
+    # Syntetiska rapporten saknar MeterId: en per unik mätare
+    matare = detaljer[["MeterCategory", "MeterSubCategory", "MeterName"]].astype(str).agg("|".join, axis=1)
+    detaljer["MeterId"] = pd.factorize(matare)[0].astype(str)
+    api = FejkadQueryApi(detaljer)
+    fraga = processor.skapa_kostnadsfraga(http_post=api.post, headers=lambda: {}, bas_url="https://query.test",
+                                          sleep=lambda s: None)
+    processor.process_cost_data(local_file_path=syntetisk_rapport, excel_filename=str(arbetskatalog / "detalj.xlsx"))
+    aggregerad = processor.process_aggregerad_kostnad("12345678", "202505", excel_filename=str(arbetskatalog / "agg.xlsx"),
+                                                      fraga=fraga)
+
+    assert all(ogiltig_definition(d) is None for d in api.definitioner)
+    assert fraga.metriker["fragor"] == 1 + sum(map(len, config.QUERY_ATTRIBUT.values())) + len(acp.TAG_NYCKLAR)
+    assert fraga.metriker["omforsok"] == 1 and fraga.metriker["sidor"] > fraga.metriker["fragor"]
+    assert len(aggregerad) < len(detaljer)
+
+    (detalj_kontering, detalj_sammanfattning), (agg_kontering, agg_sammanfattning) = exporter
+    pd.testing.assert_frame_equal(agg_kontering.drop(columns=["Netto"]), detalj_kontering.drop(columns=["Netto"]))
+    np.testing.assert_allclose(agg_kontering["Netto"].astype(float), detalj_kontering["Netto"].astype(float), rtol=1e-9)
+    assert agg_sammanfattning.total == pytest.approx(detalj_sammanfattning.total, rel=1e-12)
+    # Antal rader skiljer sig eftersom raderna är summerade
+    for dimension in ("ResourceGroup", "MeterCategory"):
+        pd.testing.assert_series_equal(agg_sammanfattning.subtotaler(dimension).set_index(dimension)["Summa"],
+                                       detalj_sammanfattning.subtotaler(dimension).set_index(dimension)["Summa"],
+                                       check_exact=False, rtol=1e-9, check_index_type=False)
@@ -0,0 +1,168 @@
+import base64
+import hashlib
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+DELSTORLEK = 50_000
+
+
+@pytest.fixture
+def rangeserver(syntetisk_rapport):
+    """
+    Lokal HTTP-server som serverar rapporten med Range-stöd och Content-MD5. Varje svar
+    pausar halvvägs, längre ju längre in i filen delen ligger, så att läsaren hinner
+    ikapp och väntar vid en halvskriven del i varje segment.
+    """
+    with open(syntetisk_rapport, "rb") as f:
+        data = f.read()
+    md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+
+    class Hanterare(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-MD5", md5)
+            self.end_headers()
+
+        def do_GET(self):
+            m = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+            start = 0
+            if m:
+                start, slut = int(m[1]), int(m[2])
+                kropp = data[start:slut + 1]
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{slut}/{len(data)}")
+            else:
+                kropp = data
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(kropp)))
+            self.end_headers()
+            halva = len(kropp) // 2
+            self.wfile.write(kropp[:halva])
+            self.wfile.flush()
+            time.sleep(0.3 * (1 + start // DELSTORLEK))
+            self.wfile.write(kropp[halva:])
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Hanterare)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/blob/rapport.csv.gz?sig=abc", data
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fa_segment(processor, rangeserver):
+    processor.nedladdare.delstorlek = DELSTORLEK
+    processor.nedladdare.buffert = 16 * 1024
+    assert len(rangeserver[1]) > 3 * DELSTORLEK
+
+
+def test_strom_under_nedladdning_ger_hela_filen(processor, rangeserver, fa_segment, arbetskatalog):
+    url, data = rangeserver
+    nedladdning = processor.nedladdare.starta(url, str(arbetskatalog / "rapport.csv.gz"))
+    assert len(nedladdning.segment) > 1
+    with nedladdning.oppna() as strom:
+        last = strom.read()
+    assert nedladdning.vanta() == str(arbetskatalog / "rapport.csv.gz")
+    assert last == data
+
+
+def test_strommande_bearbetning_med_flera_segment(processor, rangeserver, fa_segment, syntetisk_rapport,
+                                                  arbetskatalog):
+    url, _ = rangeserver
+    strommad = processor.process_cost_data(report_url=url, chunksize=500,
+                                           excel_filename=str(arbetskatalog / "strommad.xlsx"))
+    lokal = processor.process_cost_data(local_file_path=syntetisk_rapport,
+                                        excel_filename=str(arbetskatalog / "lokal.xlsx"))
+    assert len(strommad) == len(lokal) == len(pd.read_csv(syntetisk_rapport))
+    for blad in ("Kontering", "Summary"):
+        pd.testing.assert_frame_equal(pd.read_excel(arbetskatalog / "strommad.xlsx", sheet_name=blad),
+                                      pd.read_excel(arbetskatalog / "lokal.xlsx", sheet_name=blad))
+
+
+
+
+@pytest.fixture
+def felserver(syntetisk_rapport):
+    """
+    Range-server där andra segmentet svarar med en felstatus: de första gångerna enligt
+    fel["antal"], eller varje gång om antal är None.
+    """
+    with open(syntetisk_rapport, "rb") as f:
+        data = f.read()
+    fel = {"status": 500, "antal": 1, "anrop": 0}
+
+    class Hanterare(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+
+        def do_GET(self):
+            start, slut = map(int, re.match(r"bytes=(\d+)-(\d+)", self.headers["Range"]).groups())
+            if start == DELSTORLEK:
+                fel["anrop"] += 1
+                if fel["antal"] is None or fel["anrop"] <= fel["antal"]:
+                    self.send_response(fel["status"])
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+            kropp = data[start:slut + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{slut}/{len(data)}")
+            self.send_header("Content-Length", str(len(kropp)))
+            self.end_headers()
+            self.wfile.write(kropp)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Hanterare)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/blob/rapport.csv.gz?sig=abc", data, fel
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def vantetider(processor):
+    vantetider = []
+    processor.nedladdare.delstorlek = DELSTORLEK
+    processor.nedladdare.sleep = vantetider.append
+    return vantetider
+
+
+def test_misslyckat_segment_forsoker_igen_med_backoff(processor, felserver, vantetider, arbetskatalog):
+    url, data, fel = felserver
+    fel["antal"] = 2
+    destination = processor.nedladdare.starta(url, str(arbetskatalog / "rapport.csv.gz")).vanta()
+    with open(destination, "rb") as f:
+        assert f.read() == data
+    assert fel["anrop"] == 3
+    # Första och andra omförsöket väntar kring 1 s respektive 2 s, med jitter
+    assert len(vantetider) == 2
+    assert 0.8 <= vantetider[0] <= 1.2 and 1.6 <= vantetider[1] <= 2.4
+
+
+def test_utgangen_sas_forsoks_inte_igen(processor, felserver, vantetider, arbetskatalog):
+    url, _, fel = felserver
+    fel.update(status=403, antal=None)
+    nedladdning = processor.nedladdare.starta(url, str(arbetskatalog / "rapport.csv.gz"))
+    with pytest.raises(Exception, match="403"):
+        nedladdning.vanta()
+    assert fel["anrop"] == 1
+    assert vantetider == []
@@ -0,0 +1,49 @@
+import json
+
+import pandas as pd
+
+import azure_cost_processor as acp
+import config
+
+
+def kontera(processor, rapport):
+    df = processor.extract_tags_columns(processor._read_cost_csv(rapport))
+    kontering, varningar = processor.generate_konteringsrader(df, processor.load_kontering_config())
+    return df, kontering, varningar
+
+
+def test_parallell_bearbetning_ger_samma_resultat_som_seriell(processor, syntetisk_rapport, arbetskatalog,
+                                                              monkeypatch):
+    # Två regler med både konproj och rg ger varningar, som ska komma i samma ordning
+    with open(arbetskatalog / "kontering_resource_config.json", encoding="utf-8") as f:
+        regelfil = json.load(f)
+    for regel in regelfil["konteringsregler"][:2]:
+        regel.update(konproj=regel.get("konproj") or "P.1", rg=regel.get("rg") or "10000")
+    with open(arbetskatalog / "kontering_resource_config.json", "w", encoding="utf-8") as f:
+        json.dump(regelfil, f)
+
+    seriell_df, seriell_kontering, seriella_varningar = kontera(processor, syntetisk_rapport)
+    assert processor.parallell is None
+
+    monkeypatch.setattr(config, "PARALLELLA_PROCESSER", 2)
+    monkeypatch.setattr(config, "PARALLELL_MIN_UNIKA", 1)
+    parallell = processor.parallell
+    assert isinstance(parallell, acp.ParallellBearbetning) and parallell.processer == 2
+    try:
+        parallell_df, parallell_kontering, parallella_varningar = kontera(processor, syntetisk_rapport)
+        assert parallell._pool is not None
+        arbetare = list(parallell._pool._processes.values())
+        assert len(arbetare) == 2
+    finally:
+        parallell.stang()
+
+    taggkolumner = [kolumn for _, kolumn in acp.TAG_KOLUMNER]
+    pd.testing.assert_frame_equal(parallell_df[taggkolumner], seriell_df[taggkolumner])
+    assert len(seriell_kontering) > 2
+    pd.testing.assert_frame_equal(parallell_kontering, seriell_kontering, check_exact=True)
+    assert len(seriella_varningar) == 2
+    assert parallella_varningar == seriella_varningar
+
+    # Poolen är stängd och arbetsprocesserna har avslutats
+    assert parallell._pool is None
+    assert not any(process.is_alive() for process in arbetare)
@@ -0,0 +1,94 @@
+import pytest
+
+import azure_cost_processor as acp
+
+A = {"resource_ids": ["*/resourceGroups/rg-a/*"], "konproj": "P.1"}
+B = {"resource_ids": ["*/resourceGroups/rg-b/*"], "konproj": "P.2"}
+C = {"resource_ids": ["*/providers/Microsoft.Web/*"], "konproj": "P.3"}
+NY = {"resource_ids": ["*/sites/app-b"], "konproj": "P.4"}
+B_ANDRAD = {"resource_ids": ["*/resourceGroups/rg-b2/*"], "konproj": "P.2"}
+B_NYA_VARDEN = {"resource_ids": ["*/resourcegroups/RG-B/*"], "konproj": "P.9", "beskrivning": "Ändrad"}
+SQL = {"resource_ids": ["*/providers/Microsoft.Sql/*"], "konproj": "P.5"}
+
+# Matchar B och C, och tilldelades B med de gamla reglerna
+APP_B = "/subscriptions/sub-1/resourceGroups/rg-b/providers/Microsoft.Web/sites/app-b"
+# Matchade ingen av de gamla reglerna
+DATABAS = "/subscriptions/sub-1/resourceGroups/rg-z/providers/Microsoft.Sql/servers/db-1"
+
+GAMLA = [A, B, C]
+
+
+def ateranvand(tmp_path, resource_id, nya):
+    """
+    Sparar tilldelningen med GAMLA och returnerar den återanvända regelpositionen med
+    nya, eller None om ResourceId:t måste prövas om. Kontrollerar även att en
+    återanvänd position är densamma som en ny matchning ger.
+    """
+    path = str(tmp_path / "regeltilldelning.json")
+    gammalt_index = acp.KonteringsregelIndex(GAMLA)
+    gammalt_index.hitta_index(resource_id)
+    acp.Regeltilldelning(path).spara(gammalt_index)
+
+    index = acp.KonteringsregelIndex(nya)
+    ateranvanda, omprovas = acp.Regeltilldelning(path).tillampa(index)
+    assert ateranvanda + omprovas == 1
+    if not ateranvanda:
+        return None
+    position = index.tilldelning()[resource_id.lower()]
+    assert position == acp.KonteringsregelIndex(nya).hitta_index(resource_id)
+    return position
+
+
+@pytest.mark.parametrize("nya, forvantad", [
+    # Oförändrade regler och regler som läggs till efter den tilldelade
+    ([A, B, C], 1),
+    ([A, B, NY, C], 1),
+    # En regel före den tilldelade byter plats med den
+    ([B, A, C], 0),
+    # Ändrade konteringsvärden och versaler i mönstret påverkar inte tilldelningen
+    ([A, B_NYA_VARDEN, C], 1),
+    # En ny regel före den tilldelade kan matcha först
+    ([A, NY, B, C], None),
+    ([NY, A, B, C], None),
+    # Den tilldelade regelns mönster ändras eller regeln tas bort
+    ([A, B_ANDRAD, C], None),
+    ([A, C], None),
+    # En senare regel flyttas före den tilldelade
+    ([A, C, B], None),
+    ([C, A, B], None),
+])
+def test_tilldelad_regel(tmp_path, nya, forvantad):
+    assert ateranvand(tmp_path, APP_B, nya) == forvantad
+
+
+@pytest.mark.parametrize("nya, forvantad", [
+    # Samma regler i annan ordning kan fortfarande inte matcha
+    ([C, B, A], -1),
+    ([A, C], -1),
+    # En ny regel kan matcha resursen som tidigare saknade träff
+    ([A, B, C, SQL], None),
+    ([SQL, A, B, C], None),
+    ([A, B, C, NY], None),
+])
+def test_resurs_utan_traff(tmp_path, nya, forvantad):
+    assert ateranvand(tmp_path, DATABAS, nya) == forvantad
+
+
+def test_andrad_regel_ger_ny_matchning_efter_omprovning(tmp_path):
+    # APP_B matchade B. När B:s mönster ändras prövas resursen om och hamnar på C.
+    assert ateranvand(tmp_path, APP_B, [A, B_ANDRAD, C]) is None
+    assert acp.KonteringsregelIndex([A, B_ANDRAD, C]).hitta_index(APP_B) == 2
+    assert ateranvand(tmp_path, APP_B, [A, C]) is None
+    assert acp.KonteringsregelIndex([A, C]).hitta_index(APP_B) == 1
+    assert ateranvand(tmp_path, APP_B, [A, NY, B, C]) is None
+    assert acp.KonteringsregelIndex([A, NY, B, C]).hitta_index(APP_B) == 1
+
+
+def test_sparad_position_utanfor_reglerna_provas_om(tmp_path):
+    tilldelning = acp.Regeltilldelning(str(tmp_path / "saknas.json"))
+    tilldelning.regler = [acp.Regeltilldelning.regelhash(regel) for regel in GAMLA]
+    nya = [acp.Regeltilldelning.regelhash(regel) for regel in GAMLA]
+    positioner = {regel_hash: idx for idx, regel_hash in enumerate(nya)}
+    assert tilldelning._ny_tilldelning(1, nya, positioner, positioner) == 1
+    assert tilldelning._ny_tilldelning(-1, nya, positioner, positioner) == -1
+    assert tilldelning._ny_tilldelning(len(GAMLA), nya, positioner, positioner) is None
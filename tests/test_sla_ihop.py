@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+import pytest
+
+import azure_cost_processor as acp
+
+
+@pytest.fixture
+def basrader(syntetisk_rapport):
+    """
+    40 kostnadsrader med unika radnycklar och en kolumn Rad som inte ingår i nyckeln.
+    """
+    df = pd.read_csv(syntetisk_rapport)
+    nyckel = [kol for kol in acp.RADNYCKEL_KOLUMNER if kol in df.columns]
+    df = df.drop_duplicates(subset=nyckel).head(40).reset_index(drop=True)
+    return df.assign(Rad=df.index)
+
+
+def skriv(df, path, mtime):
+    df.to_csv(path, index=False)
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def rader(df):
+    return sorted(zip(df["Rad"], df["CostInBillingCurrency"]))
+
+
+def test_senare_omrakning_ersatter_tidigare_rader(processor, basrader, arbetskatalog):
+    # Rad 5 förekommer två gånger i den äldre rapporten och rad 35 två gånger i den nyare.
+    # Rad 25 förekommer två gånger i den äldre men finns även i den nyare.
+    aldre = pd.concat([basrader.iloc[:30], basrader.iloc[[5, 25]]]).assign(CostInBillingCurrency=1.0)
+    nyare = pd.concat([basrader.iloc[20:], basrader.iloc[[35]]]).assign(CostInBillingCurrency=2.0)
+    # Ändringstiderna pekar åt andra hållet än tidsstämplarna i filnamnen
+    filer = [skriv(nyare, arbetskatalog / "azure_cost_report_20250520_080000.csv.gz", 1_000_000),
+             skriv(aldre, arbetskatalog / "azure_cost_report_20250510_080000.csv.gz", 2_000_000)]
+
+    df = processor.sla_ihop_rapporter(filer)
+    assert rader(df) == sorted([(rad, 1.0) for rad in [*range(20), 5]] + [(rad, 2.0) for rad in [*range(20, 40), 35]])
+    assert df["CostInBillingCurrency"].sum() == 21 * 1.0 + 21 * 2.0
+
+
+def test_ordningen_kommer_fran_tidsstampeln_i_filnamnet(processor, basrader, arbetskatalog):
+    forsta = skriv(basrader.assign(CostInBillingCurrency=1.0),
+                   arbetskatalog / "azure_cost_report_20250501_000000_a.csv.gz", 3_000_000)
+    andra = skriv(basrader.assign(CostInBillingCurrency=2.0),
+                  arbetskatalog / "azure_cost_report_20250501_120000_b.csv.gz", 1_000_000)
+    for filer in ([forsta, andra], [andra, forsta]):
+        assert rader(processor.sla_ihop_rapporter(filer)) == [(rad, 2.0) for rad in range(40)]
+
+    # Utan tidsstämpel i namnet används filens ändringstid
+    aldre = skriv(basrader.assign(CostInBillingCurrency=3.0), arbetskatalog / "manuell_b.csv", 1_000_000)
+    nyare = skriv(basrader.assign(CostInBillingCurrency=4.0), arbetskatalog / "manuell_a.csv", 2_000_000)
+    assert rader(processor.sla_ihop_rapporter([nyare, aldre])) == [(rad, 4.0) for rad in range(40)]
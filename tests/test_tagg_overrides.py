@@ -0,0 +1,89 @@
+import json
+import logging
+
+import pandas as pd
+
+import azure_cost_processor as acp
+
+RESURS = "/subscriptions/sub-1/resourceGroups/rg-app/providers/Microsoft.Web/sites/app-1"
+
+
+def kostnadsrader(datum, resource_id=RESURS):
+    return pd.DataFrame({
+        "ResourceId": [resource_id] * len(datum),
+        "Date": pd.to_datetime(pd.Series(datum), format="mixed"),
+        "BillingTag": ["ursprunglig"] * len(datum),
+        "CostCenterTag": ["cc-0"] * len(datum),
+    })
+
+
+def tillampa(processor, overrides, df):
+    return list(processor.tillampa_tagg_overrides(df, acp.TaggOverrideIndex(overrides))["BillingTag"])
+
+
+def test_giltighetsintervallet_ar_slutet_i_bada_andar(processor):
+    df = kostnadsrader(["2025-05-09", "2025-05-10", "2025-05-15", "2025-05-20", "2025-05-20 23:30", "2025-05-21"])
+    overrides = [{"resource_id": "*/sites/app-1", "tag": "billing", "value": "ny",
+                  "valid_from": "2025-05-10", "valid_to": "2025-05-20"}]
+    assert tillampa(processor, overrides, df) == [
+        "ursprunglig", "ny", "ny", "ny", "ny", "ursprunglig"]
+
+
+def test_oppna_intervall_och_rader_utan_datum(processor):
+    datum = ["2000-01-01", "2025-05-09", "2025-05-10", "2099-12-31", None]
+    fran = [{"resource_id": "*", "tag": "billing", "value": "fran", "valid_from": "2025-05-10", "valid_to": None}]
+    till = [{"resource_id": "*", "tag": "billing", "value": "till", "valid_to": "2025-05-09"}]
+    alltid = [{"resource_id": "*", "tag": "billing", "value": "alltid"}]
+    assert tillampa(processor, fran, kostnadsrader(datum)) == [
+        "ursprunglig", "ursprunglig", "fran", "fran", "ursprunglig"]
+    assert tillampa(processor, till, kostnadsrader(datum)) == [
+        "till", "till", "ursprunglig", "ursprunglig", "ursprunglig"]
+    # Rader utan tolkningsbart datum får ingen override, inte ens av ett obegränsat intervall
+    assert tillampa(processor, alltid, kostnadsrader(datum)) == ["alltid"] * 4 + ["ursprunglig"]
+
+
+def test_senare_override_vinner_vid_overlapp(processor):
+    df = kostnadsrader(["2025-05-01", "2025-05-10", "2025-05-20"])
+    overrides = [
+        {"resource_id": "*/resourcegroups/rg-app/*", "tag": "billing", "value": "forsta"},
+        {"resource_id": RESURS.upper(), "tag": "billing", "value": "andra", "valid_from": "2025-05-10"},
+        {"resource_id": "*/sites/app-2", "tag": "billing", "value": "annan resurs"},
+    ]
+    assert tillampa(processor, overrides, df) == ["forsta", "andra", "andra"]
+    assert tillampa(processor, list(reversed(overrides[:2])), kostnadsrader(["2025-05-01", "2025-05-10"])) == [
+        "forsta", "forsta"]
+
+
+def test_taggnyckel_och_kolumnnamn_ger_samma_kolumn(processor):
+    df = kostnadsrader(["2025-05-10"]).drop(columns="CostCenterTag")
+    overrides = [
+        {"resource_id": "*", "tag": "billing", "value": "nyckel"},
+        {"resource_id": "*", "tag": " CostCenterTag ", "value": "kolumn"},
+        {"resource_id": "*", "tag": "BILLING-RG", "value": "versaler"},
+        {"resource_id": "*", "tag": "billingprojtag", "value": "gemener"},
+    ]
+    index = acp.TaggOverrideIndex(overrides)
+    assert index.kolumner == ["BillingTag", "CostCenterTag", "BillingRGTag", "BillingProjTag"]
+    assert index.warnings == []
+    rad = processor.tillampa_tagg_overrides(df, index).iloc[0]
+    # Saknade taggkolumner skapas
+    assert (rad["BillingTag"], rad["CostCenterTag"], rad["BillingRGTag"], rad["BillingProjTag"]) == (
+        "nyckel", "kolumn", "versaler", "gemener")
+
+
+def test_ogiltiga_overrides_hoppas_over_med_varning(processor, arbetskatalog, caplog):
+    overrides = [
+        {"resource_id": "*", "tag": "okand-tagg", "value": "x"},
+        {"tag": "billing", "value": "saknar resource_id"},
+        {"resource_id": "", "tag": "billing", "value": "tomt resource_id"},
+        {"resource_id": "*", "value": "saknar tag"},
+        {"resource_id": "*", "tag": "billing", "value": "giltig"},
+    ]
+    with open(arbetskatalog / "tag_overrides.json", "w", encoding="utf-8") as f:
+        json.dump({"overrides": overrides}, f)
+    with caplog.at_level(logging.WARNING):
+        index = processor.skapa_tagg_override_index()
+    assert index.overrides == overrides[-1:]
+    assert len(index.warnings) == 4
+    assert sum("Ogiltig tagg-override ignoreras" in r.getMessage() for r in caplog.records) == 4
+    assert list(processor.tillampa_tagg_overrides(kostnadsrader(["2025-05-10"]), index)["BillingTag"]) == ["giltig"]